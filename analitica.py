@@ -0,0 +1,287 @@
+"""
+Statistiche di popolazione per gli amministratori.
+
+Invece di calcolare i micronutrienti dieta per dieta, ``dettaglio_pasti`` viene letto
+a colonne (dieta, alimento, grammi) in array NumPy e aggregato in blocco:
+per ogni blocco di diete si costruisce la matrice diete x alimenti dei grammi e la si
+moltiplica per la matrice alimenti x nutrienti del catalogo. Le diete di ogni DB
+(principale e shard) sono divise in partizioni per intervallo di id, con lo stesso numero
+di diete ciascuna, ed elaborate in parallelo da un pool di processi (uno per core);
+i risultati parziali vengono poi sommati. Le ricette degli utenti sono espanse nei loro
+ingredienti (grammi in proporzione alla composizione) prima della moltiplicazione.
+
+NumPy e' una dipendenza opzionale, necessaria solo per queste statistiche.
+"""
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    np = None
+
+from nutritional_targets import LARN_DICT, assicura_larn_caricati
+
+# Diete per blocco: limita la matrice diete x alimenti (blocco x n_alimenti float64).
+DIETE_PER_BLOCCO = 2000
+PARTIZIONI_PER_CORE = 4
+
+
+def _catalogo_matrice(conn: sqlite3.Connection) -> tuple:
+    """Ritorna codici, nomi, nutrienti e la matrice alimenti x nutrienti dei valori per 100g."""
+    from crud_manager import _to_float_value
+
+    codici, nomi = [], {}
+    righe = conn.execute("SELECT codice_alimento, nome FROM alimenti ORDER BY codice_alimento")
+    for codice, nome in righe:
+        codici.append(codice)
+        nomi[codice] = nome
+    nutrienti = [
+        row[0]
+        for row in conn.execute("SELECT DISTINCT nutriente FROM valori_nutrizionali ORDER BY nutriente")
+    ]
+    indice_codici = {codice: i for i, codice in enumerate(codici)}
+    indice_nutrienti = {nutriente: j for j, nutriente in enumerate(nutrienti)}
+
+    matrice = np.zeros((len(codici), len(nutrienti)))
+    for codice, nutriente, valore_100g in conn.execute(
+        "SELECT codice_alimento, nutriente, valore_100g FROM valori_nutrizionali"
+    ):
+        i = indice_codici.get(codice)
+        if i is not None:
+            matrice[i, indice_nutrienti[nutriente]] = _to_float_value(valore_100g)
+    return codici, nomi, nutrienti, matrice
+
+
+def _percorso_db(conn: sqlite3.Connection) -> str:
+    for _seq, nome, percorso in conn.execute("PRAGMA database_list"):
+        if nome == "main":
+            return percorso
+    raise RuntimeError("Database principale non trovato")
+
+
+def _composizione_ricette(conn: sqlite3.Connection) -> dict[str, list[tuple[str, float]]]:
+    """Per ogni codice ricetta, gli ingredienti con la frazione del peso totale."""
+    composizione: dict[str, list[tuple[str, float]]] = {}
+    for codice, codice_alimento, frazione in conn.execute(
+        """
+        SELECT r.codice, i.codice_alimento, i.grammi / r.grammi_totali
+        FROM ricette r
+        JOIN ingredienti_ricetta i ON i.ricetta_id = r.id
+        """
+    ):
+        composizione.setdefault(codice, []).append((codice_alimento, frazione))
+    return composizione
+
+
+def _espandi_ricette(righe, composizione: dict[str, list[tuple[str, float]]]):
+    """Sostituisce le righe delle ricette con una riga per ingrediente."""
+    for dieta_id, codice, grammi in righe:
+        ingredienti = composizione.get(codice)
+        if ingredienti is None:
+            yield dieta_id, codice, grammi
+            continue
+        for codice_alimento, frazione in ingredienti:
+            yield dieta_id, codice_alimento, (grammi or 0.0) * frazione
+
+
+def _aggrega_partizione(
+    percorso_db: str,
+    id_min: int,
+    id_max: int,
+    codici: list[str],
+    matrice: "np.ndarray",
+    target: dict[str, "np.ndarray"],
+    percorso_utenti: str,
+) -> dict:
+    """Aggrega le diete con id in [id_min, id_max]; eseguita nei processi del pool."""
+    conn = sqlite3.connect(f"file:{percorso_db}?mode=ro", uri=True)
+    try:
+        if percorso_db != percorso_utenti:
+            # Shard delle diete: il sesso degli utenti e' nel DB principale.
+            conn.execute("ATTACH DATABASE ? AS principale", (f"file:{percorso_utenti}?mode=ro",))
+            conn.execute("CREATE TEMP VIEW utenti AS SELECT id, sesso FROM principale.utenti")
+        indice_codici = {codice: i for i, codice in enumerate(codici)}
+        n_alimenti, n_nutrienti = matrice.shape
+        parziale = {
+            "diete": 0,
+            "giorni": 0,
+            "somma": np.zeros(n_nutrienti),
+            "sotto_target": np.zeros(n_nutrienti, dtype=np.int64),
+            "utilizzi": np.zeros(n_alimenti, dtype=np.int64),
+            "grammi": np.zeros(n_alimenti),
+        }
+        composizione = _composizione_ricette(conn)
+
+        # Gli id non sono contigui (diete eliminate, shard): i blocchi sono sugli id esistenti.
+        id_diete = np.array(
+            [row[0] for row in conn.execute(
+                "SELECT id FROM diete WHERE id BETWEEN ? AND ? ORDER BY id", (id_min, id_max)
+            )],
+            dtype=np.int64,
+        )
+        for posizione in range(0, len(id_diete), DIETE_PER_BLOCCO):
+            id_blocco = id_diete[posizione:posizione + DIETE_PER_BLOCCO]
+            inizio, fine = int(id_blocco[0]), int(id_blocco[-1])
+            dimensione = len(id_blocco)
+
+            giorni = np.zeros(dimensione, dtype=np.int64)
+            femmine = np.zeros(dimensione, dtype=bool)
+            for dieta_id, giorni_dieta, sesso in conn.execute(
+                """
+                SELECT d.id, COUNT(DISTINCT p.giorno_settimana), u.sesso
+                FROM diete d
+                JOIN utenti u ON u.id = d.utente_id
+                JOIN pasti p ON p.dieta_id = d.id AND p.giorno_settimana BETWEEN 1 AND 7
+                WHERE d.id BETWEEN ? AND ?
+                GROUP BY d.id
+                """,
+                (inizio, fine),
+            ):
+                riga = np.searchsorted(id_blocco, dieta_id)
+                giorni[riga] = giorni_dieta
+                femmine[riga] = (sesso or "").strip().upper() == "F"
+
+            righe = conn.execute(
+                """
+                SELECT p.dieta_id, dp.codice_alimento, dp.quantita_grammi
+                FROM dettaglio_pasti dp
+                JOIN pasti p ON p.id = dp.pasto_id
+                WHERE p.dieta_id BETWEEN ? AND ? AND p.giorno_settimana BETWEEN 1 AND 7
+                """,
+                (inizio, fine),
+            ).fetchall()
+            if composizione:
+                righe = list(_espandi_ricette(righe, composizione))
+            if righe:
+                colonna_diete, colonna_codici, colonna_grammi = zip(*righe)
+                diete = np.searchsorted(
+                    id_blocco, np.fromiter(colonna_diete, dtype=np.int64, count=len(righe))
+                )
+                alimenti = np.fromiter(
+                    (indice_codici.get(codice, -1) for codice in colonna_codici),
+                    dtype=np.int64,
+                    count=len(righe),
+                )
+                grammi = np.fromiter(
+                    (g or 0.0 for g in colonna_grammi), dtype=np.float64, count=len(righe)
+                )
+                validi = (alimenti >= 0) & (grammi > 0)
+                diete, alimenti, grammi = diete[validi], alimenti[validi], grammi[validi]
+
+                parziale["utilizzi"] += np.bincount(alimenti, minlength=n_alimenti)
+                parziale["grammi"] += np.bincount(alimenti, weights=grammi, minlength=n_alimenti)
+
+                # Grammi per (dieta, alimento), poi totali per dieta = G @ valori_100g / 100.
+                grammi_diete = np.bincount(
+                    diete * n_alimenti + alimenti, weights=grammi, minlength=dimensione * n_alimenti
+                ).reshape(dimensione, n_alimenti)
+                totali = grammi_diete @ matrice / 100.0
+            else:
+                totali = np.zeros((dimensione, n_nutrienti))
+
+            pianificate = giorni > 0
+            parziale["diete"] += int(pianificate.sum())
+            parziale["giorni"] += int(giorni.sum())
+            parziale["somma"] += totali[pianificate].sum(axis=0)
+
+            medie = totali[pianificate] / giorni[pianificate, None]
+            target_diete = np.where(femmine[pianificate, None], target["F"], target["M"])
+            parziale["sotto_target"] += ((target_diete > 0) & (medie < target_diete)).sum(axis=0)
+        return parziale
+    finally:
+        conn.close()
+
+
+def _partizioni(percorso_db: str, quante: int) -> list[tuple[int, int]]:
+    """Intervalli di id [primo, ultimo] con circa lo stesso numero di diete ciascuno."""
+    conn = sqlite3.connect(f"file:{percorso_db}?mode=ro", uri=True)
+    try:
+        ids = [row[0] for row in conn.execute("SELECT id FROM diete ORDER BY id")]
+    finally:
+        conn.close()
+    if not ids:
+        return []
+    passo = max(1, -(-len(ids) // quante))
+    return [(ids[i], ids[min(i + passo, len(ids)) - 1]) for i in range(0, len(ids), passo)]
+
+
+def calcola_statistiche_popolazione(
+    conn: sqlite3.Connection,
+    limite_alimenti: int = 20,
+    processi: int | None = None,
+    percorsi_diete: list[str] | None = None,
+) -> dict:
+    """
+    Ritorna, su tutte le diete con almeno un giorno pianificato (del DB di ``conn`` o,
+    se indicati, dei DB in ``percorsi_diete``, es. gli shard):
+    - media giornaliera di ogni nutriente (totale assunto / giorni pianificati);
+    - per i nutrienti con target LARN, la quota di diete la cui media giornaliera e' sotto target;
+    - gli alimenti piu' usati (numero di utilizzi e grammi totali).
+    """
+    if np is None:
+        raise RuntimeError("Le statistiche di popolazione richiedono NumPy (pip install numpy)")
+
+    assicura_larn_caricati()
+    codici, nomi, nutrienti, matrice = _catalogo_matrice(conn)
+    target = {
+        sesso: np.array(
+            [float(LARN_DICT.get(nutriente, {}).get(sesso, 0.0) or 0.0) for nutriente in nutrienti]
+        )
+        for sesso in ("M", "F")
+    }
+    processi = processi or os.cpu_count() or 1
+    percorso_utenti = _percorso_db(conn)
+    partizioni = [
+        (percorso, a, b)
+        for percorso in percorsi_diete or [percorso_utenti]
+        for a, b in _partizioni(percorso, processi * PARTIZIONI_PER_CORE)
+    ]
+    argomenti = (codici, matrice, target, percorso_utenti)
+
+    if processi == 1 or len(partizioni) <= 1:
+        parziali = [_aggrega_partizione(percorso, a, b, *argomenti) for percorso, a, b in partizioni]
+    else:
+        # spawn: il processo chiamante e' multi-thread (server), il fork non e' sicuro.
+        with ProcessPoolExecutor(max_workers=processi, mp_context=get_context("spawn")) as pool:
+            futuri = [
+                pool.submit(_aggrega_partizione, percorso, a, b, *argomenti) for percorso, a, b in partizioni
+            ]
+            parziali = [futuro.result() for futuro in futuri]
+
+    diete = sum(p["diete"] for p in parziali)
+    giorni = sum(p["giorni"] for p in parziali)
+    somma = sum((p["somma"] for p in parziali), np.zeros(len(nutrienti)))
+    sotto_target = sum((p["sotto_target"] for p in parziali), np.zeros(len(nutrienti), dtype=np.int64))
+    utilizzi = sum((p["utilizzi"] for p in parziali), np.zeros(len(codici), dtype=np.int64))
+    grammi = sum((p["grammi"] for p in parziali), np.zeros(len(codici)))
+
+    con_target = (target["M"] > 0) | (target["F"] > 0)
+    statistiche_nutrienti = {
+        nutriente: {
+            "media_giornaliera": float(somma[j] / giorni) if giorni else 0.0,
+            "quota_diete_sotto_larn": (
+                float(sotto_target[j] / diete) if diete and con_target[j] else None
+            ),
+        }
+        for j, nutriente in enumerate(nutrienti)
+    }
+
+    piu_usati = np.argsort(-utilizzi, kind="stable")[:limite_alimenti]
+    return {
+        "diete": diete,
+        "giorni_pianificati": giorni,
+        "nutrienti": statistiche_nutrienti,
+        "alimenti_piu_usati": [
+            {
+                "codice_alimento": codici[i],
+                "nome": nomi[codici[i]],
+                "utilizzi": int(utilizzi[i]),
+                "grammi_totali": float(grammi[i]),
+            }
+            for i in piu_usati
+            if utilizzi[i] > 0
+        ],
+    }
@@ -0,0 +1,184 @@
+"""
+Avvio dell'API: riscaldamento delle strutture pesanti e profilo dei tempi di avvio.
+
+Le fasi costose (target LARN, contesto bcrypt, schema del DB, catalogo in memoria,
+NumPy per le statistiche admin) sono comunque eseguite al primo uso. Il riscaldamento
+le anticipa:
+- normalmente durante lo startup dell'app, prima di accettare richieste;
+- con ``AVVIO_RAPIDO=1`` in un thread in background, mentre il server risponde gia'
+  a ``/health`` (liveness); ``/health/pronto`` diventa 200 a riscaldamento concluso.
+
+Uso:
+    python avvio.py profilo [--top 25] [--json]
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+AVVIO_RAPIDO = os.environ.get("AVVIO_RAPIDO", "").lower() in {"1", "true", "si", "yes"}
+
+logger = logging.getLogger("macro_micro.avvio")
+
+
+def _carica_larn() -> None:
+    from nutritional_targets import assicura_larn_caricati
+
+    assicura_larn_caricati()
+
+
+def _prepara_bcrypt() -> None:
+    from security import contesto_password
+
+    contesto_password().handler("bcrypt").get_backend()
+
+
+def _prepara_database() -> None:
+    from database import setup_database
+
+    # Esegue DDL e migrazioni una volta: le connessioni successive trovano lo schema pronto.
+    setup_database().close()
+
+
+def _carica_catalogo() -> None:
+    from catalogo_memoria import registro_catalogo
+
+    registro_catalogo.precarica()
+
+
+def _importa_numpy() -> None:
+    try:
+        import analitica  # noqa: F401
+    except ImportError:
+        pass
+
+
+FASI = (
+    ("larn", _carica_larn),
+    ("bcrypt", _prepara_bcrypt),
+    ("database", _prepara_database),
+    ("catalogo", _carica_catalogo),
+    ("numpy", _importa_numpy),
+)
+
+
+class Riscaldamento:
+    """Esegue le fasi di riscaldamento una sola volta e ne registra durata ed esito."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._completato = threading.Event()
+        self._avviato = False
+        self.durate: dict[str, float] = {}
+        self.errori: dict[str, str] = {}
+
+    def esegui(self) -> None:
+        with self._lock:
+            if self._avviato:
+                return
+            self._avviato = True
+        inizio = time.perf_counter()
+        for nome, funzione in FASI:
+            inizio_fase = time.perf_counter()
+            try:
+                funzione()
+            except Exception as exc:  # la fase verra' ritentata al primo uso reale
+                logger.exception("Riscaldamento '%s' fallito", nome)
+                self.errori[nome] = str(exc)
+            self.durate[nome] = time.perf_counter() - inizio_fase
+        self.durate["totale"] = time.perf_counter() - inizio
+        self._completato.set()
+        logger.info(
+            "Riscaldamento completato in %.0f ms (%s)",
+            self.durate["totale"] * 1000,
+            ", ".join(f"{nome}={durata * 1000:.0f}ms" for nome, durata in self.durate.items()),
+        )
+
+    def avvia_in_background(self) -> None:
+        threading.Thread(target=self.esegui, name="riscaldamento", daemon=True).start()
+
+    @property
+    def pronto(self) -> bool:
+        return self._completato.is_set()
+
+    def stato(self) -> dict:
+        return {
+            "pronto": self.pronto,
+            "avvio_rapido": AVVIO_RAPIDO,
+            "durate_ms": {nome: round(durata * 1000, 1) for nome, durata in dict(self.durate).items()},
+            "errori": dict(self.errori),
+        }
+
+
+riscaldamento = Riscaldamento()
+
+
+def profilo_import(modulo: str = "main_api") -> list[dict]:
+    """
+    Importa ``modulo`` in un interprete pulito con ``-X importtime`` e ritorna il tempo
+    per package di primo livello (self = somma dei tempi propri dei suoi moduli).
+    """
+    risultato = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        cwd=Path(__file__).resolve().parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    package: dict[str, dict] = {}
+    for riga in risultato.stderr.splitlines():
+        if not riga.startswith("import time:") or "self [us]" in riga:
+            continue
+        proprio, cumulativo, nome = riga.removeprefix("import time:").split("|")
+        nome_completo = nome.strip()
+        radice = nome_completo.split(".")[0]
+        voce = package.setdefault(radice, {"package": radice, "self_ms": 0.0, "cumulativo_ms": 0.0})
+        voce["self_ms"] += int(proprio) / 1000
+        if nome_completo == radice:
+            # Tempo complessivo del package la prima volta che viene importato (figli compresi).
+            voce["cumulativo_ms"] = max(voce["cumulativo_ms"], int(cumulativo) / 1000)
+    return sorted(package.values(), key=lambda voce: voce["self_ms"], reverse=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Profilo dei tempi di avvio dell'API")
+    parser.add_argument("comando", choices=["profilo"])
+    parser.add_argument("--modulo", default="main_api")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--json", action="store_true", help="Stampa il report in JSON")
+    args = parser.parse_args()
+
+    inizio = time.perf_counter()
+    package = profilo_import(args.modulo)
+    import_totale = (time.perf_counter() - inizio) * 1000
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    importlib.import_module(args.modulo)
+    riscaldamento.esegui()
+    report = {
+        "modulo": args.modulo,
+        "processo_import_ms": round(import_totale, 1),
+        "package": package[: args.top],
+        "riscaldamento_ms": riscaldamento.stato()["durate_ms"],
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Import di {args.modulo} (interprete pulito): {import_totale:.0f} ms incluso avvio di Python")
+    print(f"{'package':<28} {'self ms':>9} {'cumulativo ms':>14}")
+    for voce in report["package"]:
+        print(f"{voce['package']:<28} {voce['self_ms']:>9.1f} {voce['cumulativo_ms']:>14.1f}")
+    print("\nFasi di riscaldamento:")
+    for nome, durata in report["riscaldamento_ms"].items():
+        print(f"  {nome:<10} {durata:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
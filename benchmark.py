@@ -0,0 +1,508 @@
+"""
+Benchmark e load test dell'API eseguiti in-process.
+
+L'app FastAPI viene servita tramite ``httpx.ASGITransport`` contro un database
+generato in una cartella temporanea (catalogo copiato dal DB sorgente, utenti e
+diete sintetici). Per ogni scenario e livello di concorrenza vengono misurati
+throughput e latenze p50/p95/p99; i risultati sono salvati in JSON per poterli
+confrontare tra commit.
+
+Con ``--serializzazione`` misura invece, su una dieta grande, il tempo di serializzazione
+JSON di dieta completa, report e micronutrienti con i diversi metodi (json, percorso di
+default di FastAPI, pydantic, ``serializza_json``), la dimensione compressa e i byte
+effettivamente inviati dall'API per ogni Accept-Encoding.
+
+Uso:
+    python benchmark.py [--concorrenza 1 4 16] [--richieste 200] [--output risultati.json]
+    python benchmark.py --confronta base.json --output nuovo.json
+    python benchmark.py --serializzazione [--alimenti-per-pasto 15] [--ripetizioni 50]
+    python benchmark.py --modalita-letture lettori threadpool --concorrenza 16 64 256
+
+Con ``--modalita-letture`` gli scenari sono ripetuti per ogni modalita' delle letture
+degli endpoint async (vedi ``esecutore_letture``): pool di lettori con coda o threadpool
+di Starlette con una connessione per lettura.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+SCENARI = ("login", "ricerca", "simili", "apri_dieta", "crea_dieta", "aggiorna_dieta", "micro", "report")
+TERMINI_RICERCA = ("pane", "pasta", "mela", "latte", "pollo", "riso", "olio", "formaggio", "uova", "pesce")
+PASSWORD_BENCHMARK = "benchmark123"
+
+
+def _commit_corrente() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(valori: list[float], q: float) -> float:
+    """Percentile con interpolazione lineare (q tra 0 e 100)."""
+    if not valori:
+        return 0.0
+    ordinati = sorted(valori)
+    posizione = (len(ordinati) - 1) * q / 100.0
+    inferiore = int(posizione)
+    superiore = min(inferiore + 1, len(ordinati) - 1)
+    return ordinati[inferiore] + (ordinati[superiore] - ordinati[inferiore]) * (posizione - inferiore)
+
+
+def prepara_database(
+    percorso_db: str,
+    sorgente_catalogo: str,
+    utenti: int,
+    diete_per_utente: int,
+    seme: int,
+) -> None:
+    """Crea il DB di benchmark: catalogo copiato dalla sorgente piu' dati sintetici."""
+    from catalogo_io import carica_catalogo, leggi_catalogo
+    from database import setup_database
+    from genera_dati import genera_dati
+
+    sorgente = sqlite3.connect(sorgente_catalogo)
+    try:
+        nutrienti, alimenti = leggi_catalogo(sorgente)
+    finally:
+        sorgente.close()
+
+    conn = setup_database(percorso_db)
+    try:
+        carica_catalogo(conn.cursor(), nutrienti, alimenti)
+        conn.commit()
+        genera_dati(conn, utenti, diete_per_utente, seme=seme, password=PASSWORD_BENCHMARK)
+    finally:
+        conn.close()
+
+
+def genera_payload_dieta(
+    rng: random.Random,
+    codici: list[str],
+    nome: str,
+    alimenti_per_pasto: tuple[int, int] = (2, 6),
+):
+    """Dieta settimanale realistica: 7 giorni, 4-5 pasti, 2-6 alimenti per pasto."""
+    from schemas import DietaCompletaCreate
+
+    pasti = []
+    for giorno in range(1, 8):
+        for ordine, nome_pasto in enumerate(
+            ("Colazione", "Spuntino", "Pranzo", "Merenda", "Cena")[: rng.randint(4, 5)], start=1
+        ):
+            pasti.append(
+                {
+                    "nome_pasto": nome_pasto,
+                    "giorno_settimana": giorno,
+                    "ordine": ordine,
+                    "alimenti": [
+                        {"codice_alimento": rng.choice(codici), "grammi": rng.randint(10, 250)}
+                        for _ in range(rng.randint(*alimenti_per_pasto))
+                    ],
+                }
+            )
+    return DietaCompletaCreate(nome=nome, pasti=pasti)
+
+
+class ContestoBenchmark:
+    """Dati condivisi dagli scenari: client, token e diete degli utenti sintetici."""
+
+    def __init__(self, client, utenti: list[dict], codici: list[str], seme: int) -> None:
+        self.client = client
+        self.utenti = utenti
+        self.codici = codici
+        self.rng = random.Random(seme)
+
+    def utente(self, indice: int) -> dict:
+        return self.utenti[indice % len(self.utenti)]
+
+    def payload_dieta(self, nome: str) -> dict:
+        return genera_payload_dieta(self.rng, self.codici, nome).model_dump()
+
+
+async def _esegui_scenario(contesto: ContestoBenchmark, scenario: str, indice: int):
+    utente = contesto.utente(indice)
+    headers = {"Authorization": f"Bearer {utente['token']}"}
+    client = contesto.client
+    rng = contesto.rng
+
+    if scenario == "login":
+        return await client.post(
+            "/api/token",
+            data={"username": utente["email"], "password": PASSWORD_BENCHMARK},
+        )
+    if scenario == "ricerca":
+        return await client.get(
+            "/api/alimenti/search", params={"q": rng.choice(TERMINI_RICERCA)}, headers=headers
+        )
+    if scenario == "simili":
+        return await client.get(f"/api/alimenti/{rng.choice(contesto.codici)}/simili", headers=headers)
+    if scenario == "apri_dieta":
+        return await client.get(f"/api/diete/{rng.choice(utente['diete'])}/completa", headers=headers)
+    if scenario == "crea_dieta":
+        return await client.post(
+            "/api/diete/completa", json=contesto.payload_dieta(f"Bench {indice}"), headers=headers
+        )
+    if scenario == "aggiorna_dieta":
+        return await client.put(
+            f"/api/diete/{rng.choice(utente['diete'])}/completa",
+            json=contesto.payload_dieta(f"Bench {indice}"),
+            headers=headers,
+        )
+    if scenario == "report":
+        return await client.get(f"/api/diete/{rng.choice(utente['diete'])}/report", headers=headers)
+    if scenario == "micro":
+        alimenti = [
+            {"codice_alimento": rng.choice(contesto.codici), "grammi": rng.randint(10, 250)}
+            for _ in range(25)
+        ]
+        return await client.post(
+            "/api/nutrizione/giornaliera/micro", json={"alimenti": alimenti}, headers=headers
+        )
+    raise ValueError(f"Scenario sconosciuto: {scenario}")
+
+
+async def misura_scenario(
+    contesto: ContestoBenchmark,
+    scenario: str,
+    concorrenza: int,
+    richieste: int,
+    riscaldamento: int,
+) -> dict:
+    """Esegue ``richieste`` chiamate con ``concorrenza`` worker e ritorna le statistiche."""
+    for indice in range(riscaldamento):
+        await _esegui_scenario(contesto, scenario, indice)
+
+    latenze: list[float] = []
+    errori = 0
+    prossima = 0
+
+    async def worker() -> None:
+        nonlocal prossima, errori
+        while prossima < richieste:
+            indice = prossima
+            prossima += 1
+            inizio = time.perf_counter()
+            risposta = await _esegui_scenario(contesto, scenario, indice)
+            latenze.append(time.perf_counter() - inizio)
+            if risposta.status_code >= 400:
+                errori += 1
+
+    inizio = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concorrenza)))
+    durata = time.perf_counter() - inizio
+
+    return {
+        "scenario": scenario,
+        "concorrenza": concorrenza,
+        "richieste": len(latenze),
+        "errori": errori,
+        "durata_s": durata,
+        "throughput_rps": len(latenze) / durata if durata else 0.0,
+        "media_ms": statistics.fmean(latenze) * 1000 if latenze else 0.0,
+        "p50_ms": percentile(latenze, 50) * 1000,
+        "p95_ms": percentile(latenze, 95) * 1000,
+        "p99_ms": percentile(latenze, 99) * 1000,
+    }
+
+
+def _richieste_per_scenario(scenario: str, richieste: int) -> int:
+    # bcrypt e' volutamente lento: il login usa meno richieste per non dominare il tempo totale.
+    return max(10, richieste // 10) if scenario == "login" else richieste
+
+
+def _carica_utenti(percorso_db: str) -> tuple[list[str], list[dict]]:
+    """Codici del catalogo e utenti sintetici con token e id delle loro diete."""
+    from genera_dati import DOMINIO_EMAIL
+    from security import crea_access_token
+
+    conn = sqlite3.connect(percorso_db)
+    try:
+        codici = [row[0] for row in conn.execute("SELECT codice_alimento FROM alimenti")]
+        utenti = []
+        for utente_id, email, ruolo, sesso in conn.execute(
+            "SELECT id, email, ruolo, sesso FROM utenti WHERE email LIKE ? ORDER BY id",
+            (f"%@{DOMINIO_EMAIL}",),
+        ):
+            diete = [
+                row[0] for row in conn.execute("SELECT id FROM diete WHERE utente_id = ?", (utente_id,))
+            ]
+            token = crea_access_token(
+                data={"sub": str(utente_id), "email": email, "ruolo": ruolo, "sesso": sesso}
+            )
+            utenti.append({"id": utente_id, "email": email, "token": token, "diete": diete})
+    finally:
+        conn.close()
+    return codici, utenti
+
+
+async def esegui_benchmark(args: argparse.Namespace, percorso_db: str) -> list[dict]:
+    import httpx
+
+    import main_api
+    from nutritional_targets import load_larn_data
+
+    load_larn_data()
+    codici, utenti = _carica_utenti(percorso_db)
+
+    risultati = []
+    # Le eccezioni dell'app (es. "database is locked") diventano 500 e vengono contate come errori.
+    transport = httpx.ASGITransport(app=main_api.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        contesto = ContestoBenchmark(client, utenti, codici, args.seme)
+        for modalita in args.modalita_letture:
+            main_api.letture.modalita = modalita
+            for scenario in args.scenari:
+                for concorrenza in args.concorrenza:
+                    risultato = await misura_scenario(
+                        contesto,
+                        scenario,
+                        concorrenza,
+                        _richieste_per_scenario(scenario, args.richieste),
+                        args.riscaldamento,
+                    )
+                    risultato["modalita_letture"] = modalita
+                    risultati.append(risultato)
+                    print(
+                        f"{modalita:<10} {scenario:<15} c={concorrenza:<3} "
+                        f"{risultato['throughput_rps']:>9.1f} req/s  "
+                        f"p50 {risultato['p50_ms']:>8.2f} ms  p95 {risultato['p95_ms']:>8.2f} ms  "
+                        f"p99 {risultato['p99_ms']:>8.2f} ms  errori {risultato['errori']}"
+                    )
+    return risultati
+
+
+def _tempo_mediano_ms(funzione, ripetizioni: int) -> float:
+    tempi = []
+    for _ in range(ripetizioni):
+        inizio = time.perf_counter()
+        funzione()
+        tempi.append(time.perf_counter() - inizio)
+    return statistics.median(tempi) * 1000
+
+
+def _serializzatori() -> dict:
+    """Percorsi di serializzazione confrontati, tutti da oggetto Python a byte."""
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+
+    from serializzazione import orjson, serializza_json
+
+    def json_compatto(dati) -> bytes:
+        return json.dumps(dati, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    adattatore = TypeAdapter(dict)
+    return {
+        "json": json_compatto,
+        # JSONResponse senza response_model: jsonable_encoder e poi json.dumps.
+        "fastapi_default": lambda dati: json_compatto(jsonable_encoder(dati)),
+        # Con response_model: validazione e dump_json di pydantic.
+        "pydantic": lambda dati: adattatore.dump_json(adattatore.validate_python(dati)),
+        "orjson" if orjson is not None else "serializza_json": serializza_json,
+    }
+
+
+def _compressori() -> dict:
+    import gzip
+
+    from serializzazione import LIVELLO_GZIP, QUALITA_BROTLI, brotli
+
+    compressori = {
+        f"gzip{LIVELLO_GZIP}": lambda corpo: gzip.compress(corpo, compresslevel=LIVELLO_GZIP, mtime=0),
+        "gzip9": lambda corpo: gzip.compress(corpo, compresslevel=9, mtime=0),
+    }
+    if brotli is not None:
+        compressori[f"br{QUALITA_BROTLI}"] = lambda corpo: brotli.compress(corpo, quality=QUALITA_BROTLI)
+    return compressori
+
+
+async def benchmark_serializzazione(args: argparse.Namespace, percorso_db: str) -> list[dict]:
+    """Serializzazione e byte sul filo di dieta completa, report e micro per una dieta grande."""
+    import httpx
+
+    import main_api
+    from nutritional_targets import load_larn_data
+    from serializzazione import brotli
+
+    load_larn_data()
+    codici, utenti = _carica_utenti(percorso_db)
+    utente = utenti[0]
+    headers = {"Authorization": f"Bearer {utente['token']}"}
+    payload = genera_payload_dieta(
+        random.Random(args.seme), codici, "Bench grande", (args.alimenti_per_pasto, args.alimenti_per_pasto)
+    ).model_dump()
+    alimenti = [alimento for pasto in payload["pasti"] for alimento in pasto["alimenti"]]
+    print(f"Dieta di benchmark: {len(payload['pasti'])} pasti, {len(alimenti)} alimenti")
+
+    codifiche = ["identity", "gzip"] + (["br"] if brotli is not None else [])
+    serializzatori = _serializzatori()
+    compressori = _compressori()
+    risultati = []
+    transport = httpx.ASGITransport(app=main_api.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        risposta = await client.post("/api/diete/completa", json=payload, headers=headers)
+        risposta.raise_for_status()
+        dieta_id = risposta.json()["id"]
+        richieste = {
+            "dieta_completa": ("GET", f"/api/diete/{dieta_id}/completa", None),
+            "report": ("GET", f"/api/diete/{dieta_id}/report", None),
+            "micro": ("POST", "/api/nutrizione/giornaliera/micro", {"alimenti": alimenti}),
+        }
+        for nome, (metodo, percorso, corpo) in richieste.items():
+            risposta = await client.request(metodo, percorso, json=corpo, headers=headers)
+            risposta.raise_for_status()
+            dati = risposta.json()
+
+            tempi = {
+                serializzatore: _tempo_mediano_ms(lambda: funzione(dati), args.ripetizioni)
+                for serializzatore, funzione in serializzatori.items()
+            }
+            grezzo = json.dumps(dati, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            compressi = {
+                compressore: {
+                    "byte": len(funzione(grezzo)),
+                    "ms": _tempo_mediano_ms(lambda: funzione(grezzo), args.ripetizioni),
+                }
+                for compressore, funzione in compressori.items()
+            }
+            # Byte inviati dall'API: httpx decomprime il corpo, quindi si legge Content-Length.
+            sul_filo = {}
+            for codifica in codifiche:
+                risposta = await client.request(
+                    metodo, percorso, json=corpo, headers={**headers, "Accept-Encoding": codifica}
+                )
+                sul_filo[codifica] = int(risposta.headers.get("content-length", len(risposta.content)))
+
+            risultati.append(
+                {
+                    "payload": nome,
+                    "byte_json": len(grezzo),
+                    "serializzazione_ms": tempi,
+                    "compressione": compressi,
+                    "byte_sul_filo": sul_filo,
+                }
+            )
+            print(
+                f"{nome:<15} {len(grezzo) / 1024:>8.1f} KiB  "
+                + "  ".join(f"{chiave} {valore:.2f} ms" for chiave, valore in tempi.items())
+            )
+            print(
+                f"{'':<15} sul filo: "
+                + "  ".join(f"{chiave} {valore / 1024:.1f} KiB" for chiave, valore in sul_filo.items())
+            )
+    return risultati
+
+
+def confronta(base: dict, nuovo: dict) -> None:
+    """Stampa la variazione percentuale di throughput e p95 rispetto a un run precedente."""
+    # I run precedenti alle modalita' di lettura non le riportano: si confrontano con ogni modalita'.
+    indice_base = {}
+    for r in base.get("risultati", []):
+        indice_base[(r["scenario"], r["concorrenza"], r.get("modalita_letture"))] = r
+    print(f"\nConfronto con {base.get('commit') or 'base'} -> {nuovo.get('commit') or 'corrente'}")
+    for risultato in nuovo["risultati"]:
+        chiave = (risultato["scenario"], risultato["concorrenza"])
+        precedente = indice_base.get((*chiave, risultato.get("modalita_letture"))) or indice_base.get(
+            (*chiave, None)
+        )
+        if not precedente:
+            continue
+        delta_rps = _variazione(precedente["throughput_rps"], risultato["throughput_rps"])
+        delta_p95 = _variazione(precedente["p95_ms"], risultato["p95_ms"])
+        print(
+            f"{risultato.get('modalita_letture') or '':<10} {risultato['scenario']:<15} "
+            f"c={risultato['concorrenza']:<3} throughput {delta_rps:+7.1f}%  p95 {delta_p95:+7.1f}%"
+        )
+
+
+def _variazione(prima: float, dopo: float) -> float:
+    return ((dopo - prima) / prima * 100.0) if prima else 0.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark in-process dell'API Macro Micro")
+    parser.add_argument("--scenari", nargs="+", choices=SCENARI, default=list(SCENARI))
+    parser.add_argument("--concorrenza", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--richieste", type=int, default=200, help="Richieste misurate per scenario e livello")
+    parser.add_argument("--riscaldamento", type=int, default=5)
+    parser.add_argument("--utenti", type=int, default=20)
+    parser.add_argument("--diete-per-utente", type=int, default=3)
+    parser.add_argument("--catalogo", default="nutrizione.db", help="DB da cui copiare il catalogo")
+    parser.add_argument("--seme", type=int, default=42)
+    parser.add_argument(
+        "--modalita-letture",
+        nargs="+",
+        choices=("lettori", "threadpool"),
+        default=["lettori"],
+        help="Modalita' delle letture async da misurare (vedi esecutore_letture)",
+    )
+    parser.add_argument("--output", default="benchmark_risultati.json")
+    parser.add_argument("--confronta", help="JSON di un run precedente da confrontare")
+    parser.add_argument(
+        "--serializzazione",
+        action="store_true",
+        help="Misura serializzazione e compressione di una dieta grande invece degli scenari",
+    )
+    parser.add_argument("--alimenti-per-pasto", type=int, default=15)
+    parser.add_argument("--ripetizioni", type=int, default=50)
+    args = parser.parse_args()
+
+    sorgente_catalogo = str(Path(args.catalogo).resolve())
+    with tempfile.TemporaryDirectory(prefix="macro-micro-bench-") as cartella:
+        percorso_db = os.path.join(cartella, "benchmark.db")
+        # Va impostato prima di importare main_api/database.
+        os.environ["NUTRIZIONE_DB"] = percorso_db
+        os.environ["CATALOGO_SNAPSHOT_DIR"] = os.path.join(cartella, "catalogo")
+
+        print(f"Generazione database di benchmark ({args.utenti} utenti)...")
+        prepara_database(percorso_db, sorgente_catalogo, args.utenti, args.diete_per_utente, args.seme)
+        if args.serializzazione:
+            risultati, serializzazione = [], asyncio.run(benchmark_serializzazione(args, percorso_db))
+        else:
+            risultati, serializzazione = asyncio.run(esegui_benchmark(args, percorso_db)), None
+
+    report = {
+        "commit": _commit_corrente(),
+        "eseguito_il": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "piattaforma": platform.platform(),
+        "parametri": {
+            "richieste": args.richieste,
+            "riscaldamento": args.riscaldamento,
+            "utenti": args.utenti,
+            "diete_per_utente": args.diete_per_utente,
+            "seme": args.seme,
+        },
+        "risultati": risultati,
+    }
+    if serializzazione is not None:
+        report["parametri"]["alimenti_per_pasto"] = args.alimenti_per_pasto
+        report["serializzazione"] = serializzazione
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"\nRisultati salvati in {args.output}")
+
+    if args.confronta and risultati:
+        with open(args.confronta, encoding="utf-8") as file:
+            confronta(json.load(file), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Cache in memoria delle risposte gia' serializzate.
+
+La chiave contiene la revisione della risorsa (es. l'ETag), quindi una voce non diventa
+mai obsoleta: dopo una scrittura la chiave cambia e la voce vecchia esce per scadenza o
+per LRU. La durata breve limita la memoria occupata da diete non piu' richieste.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+CAPACITA_CACHE = int(os.environ.get("CACHE_RISPOSTE_VOCI", "2048"))
+DURATA_CACHE_S = float(os.environ.get("CACHE_RISPOSTE_DURATA_S", "60"))
+
+
+class CacheRisposte:
+    """LRU con scadenza, condivisa tra i thread delle richieste."""
+
+    def __init__(self, capacita: int = CAPACITA_CACHE, durata_s: float = DURATA_CACHE_S) -> None:
+        self.capacita = capacita
+        self.durata_s = durata_s
+        self._lock = threading.Lock()
+        self._voci: OrderedDict[Hashable, tuple[float, bytes]] = OrderedDict()
+
+    def ottieni(self, chiave: Hashable, produci: Callable[[], bytes]) -> bytes:
+        """Corpo in cache per ``chiave``, altrimenti lo produce (fuori dal lock) e lo memorizza."""
+        corpo = self.cerca(chiave)
+        if corpo is None:
+            corpo = produci()
+            self.memorizza(chiave, corpo)
+        return corpo
+
+    def cerca(self, chiave: Hashable) -> bytes | None:
+        """Corpo in cache e non scaduto per ``chiave``, o None."""
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is None or voce[0] <= time.monotonic():
+                return None
+            self._voci.move_to_end(chiave)
+            return voce[1]
+
+    def memorizza(self, chiave: Hashable, corpo: bytes) -> None:
+        with self._lock:
+            self._voci[chiave] = (time.monotonic() + self.durata_s, corpo)
+            self._voci.move_to_end(chiave)
+            while len(self._voci) > self.capacita:
+                self._voci.popitem(last=False)
+
+    def svuota(self) -> None:
+        with self._lock:
+            self._voci.clear()
@@ -56,14 +56,20 @@ def calcola_macro_pasto(conn: sqlite3.Connection, pasto_id: int) -> dict:
 
     for codice_alimento, quantita_grammi in alimenti_pasto:
         quantita = float(quantita_grammi or 0)
+        # Le ricette hanno il vettore per 100g precalcolato in valori_ricette.
         cursor.execute(
             """
             SELECT nutriente, valore_100g
             FROM valori_nutrizionali
             WHERE codice_alimento = ?
               AND nutriente IN (?, ?, ?, ?)
+            UNION ALL
+            SELECT nutriente, valore_100g
+            FROM valori_ricette
+            WHERE codice_ricetta = ?
+              AND nutriente IN (?, ?, ?, ?)
             """,
-            (codice_alimento, *NUTRIENTI_TARGET.keys()),
+            (codice_alimento, *NUTRIENTI_TARGET.keys(), codice_alimento, *NUTRIENTI_TARGET.keys()),
         )
         nutrienti = cursor.fetchall()
 
@@ -0,0 +1,97 @@
+"""
+Bundle compatto del catalogo per il calcolo dei nutrienti lato client.
+
+Il client scarica una volta per versione del catalogo anagrafica e valori per 100g di
+tutti gli alimenti e calcola i totali in locale, senza interrogare l'API a ogni
+modifica. Il bundle e' un JSON a colonne compatte:
+- ``nutrienti``: ``[nome, unita, chiave_macro]`` (prima i macro, poi i micro se richiesti);
+- ``categorie``: elenco delle categorie, referenziate per indice;
+- ``alimenti``: ``[codice, nome, indice_categoria, [indice_nutriente, valore_100g, ...]]``
+  con i soli valori diversi da zero.
+
+Il corpo (anche gia' compresso con gzip) e' costruito una volta per versione e variante
+e tenuto nel ``CatalogoMemoria``; l'ETag dipende solo da versione del catalogo, variante
+e formato, quindi resta valido tra worker e riavvii. Le ricette degli utenti non fanno
+parte del catalogo (vedi ``/api/ricette``).
+"""
+import gzip
+import hashlib
+import json
+from dataclasses import dataclass
+
+from catalogo_memoria import CatalogoMemoria
+
+FORMATO_BUNDLE = "macro-micro-bundle"
+VERSIONE_FORMATO_BUNDLE = 1
+LIVELLO_GZIP = 9
+
+
+@dataclass(frozen=True)
+class BundleCatalogo:
+    versione: str
+    micro: bool
+    corpo: bytes
+    corpo_gzip: bytes
+
+    def etag(self, compresso: bool = False) -> str:
+        """ETag forte della rappresentazione (diverso per il corpo compresso)."""
+        variante = "micro" if self.micro else "macro"
+        suffisso = "-gz" if compresso else ""
+        return f'"{self.versione}-{variante}-f{VERSIONE_FORMATO_BUNDLE}{suffisso}"'
+
+
+def costruisci_bundle(catalogo: CatalogoMemoria, micro: bool = False) -> BundleCatalogo:
+    """
+    Serializza il catalogo. Senza versione (catalogo letto dal DB principale, non da
+    uno snapshot) la versione e' l'hash del contenuto.
+    """
+    from crud_manager import MACRO_NUTRIENTI
+
+    nomi_nutrienti = list(MACRO_NUTRIENTI)
+    if micro:
+        nomi_nutrienti += sorted(n for n in catalogo.unita if n not in MACRO_NUTRIENTI)
+    indice_nutrienti = {nutriente: i for i, nutriente in enumerate(nomi_nutrienti)}
+    categorie = sorted({riga["categoria"] or "" for riga in catalogo.alimenti.values()})
+    indice_categorie = {categoria: i for i, categoria in enumerate(categorie)}
+
+    alimenti = []
+    for codice in sorted(catalogo.alimenti):
+        riga = catalogo.alimenti[codice]
+        coppie = sorted(
+            (indice_nutrienti[nutriente], valore)
+            for nutriente, valore in catalogo.valori.get(codice, {}).items()
+            if nutriente in indice_nutrienti and valore
+        )
+        valori = [elemento for coppia in coppie for elemento in coppia]
+        alimenti.append([codice, riga["nome"], indice_categorie[riga["categoria"] or ""], valori])
+
+    nutrienti = [
+        [nutriente, catalogo.unita.get(nutriente), MACRO_NUTRIENTI.get(nutriente)]
+        for nutriente in nomi_nutrienti
+    ]
+    versione = catalogo.versione
+    if not versione:
+        contenuto = json.dumps([nutrienti, categorie, alimenti], ensure_ascii=False, separators=(",", ":"))
+        versione = hashlib.sha256(contenuto.encode("utf-8")).hexdigest()[:16]
+
+    dati = {
+        "formato": FORMATO_BUNDLE,
+        "versione_formato": VERSIONE_FORMATO_BUNDLE,
+        "versione_catalogo": versione,
+        "micro": micro,
+        "nutrienti": nutrienti,
+        "categorie": categorie,
+        "alimenti": alimenti,
+    }
+    corpo = json.dumps(dati, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    # mtime=0: stessi byte a ogni costruzione, come richiede un ETag forte.
+    corpo_gzip = gzip.compress(corpo, compresslevel=LIVELLO_GZIP, mtime=0)
+    return BundleCatalogo(versione=versione, micro=micro, corpo=corpo, corpo_gzip=corpo_gzip)
+
+
+def bundle_catalogo(catalogo: CatalogoMemoria, micro: bool = False) -> BundleCatalogo:
+    """Bundle della variante richiesta, costruito al primo uso e poi riusato per la versione."""
+    bundle = catalogo.bundle.get(micro)
+    if bundle is None:
+        bundle = catalogo.bundle[micro] = costruisci_bundle(catalogo, micro)
+    return bundle
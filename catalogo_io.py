@@ -0,0 +1,237 @@
+"""
+Esportazione e importazione offline del catalogo alimenti.
+
+Il formato e' un JSON Lines compresso con gzip:
+- la prima riga e' l'intestazione (versione del formato, versione del catalogo,
+  dizionario dei nutrienti);
+- ogni riga successiva e' un alimento con i suoi valori in forma compatta
+  ``[indice_nutriente, valore_100g, valore_porzione]``.
+
+Uso:
+    python catalogo_io.py esporta catalogo.jsonl.gz [--db nutrizione.db]
+    python catalogo_io.py importa catalogo.jsonl.gz [--db nuovo.db]
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+from database import (
+    DB_PATH,
+    crea_indici_catalogo,
+    elimina_indici_catalogo,
+    ricalcola_totali_nutrizionali,
+    setup_database,
+)
+
+FORMATO = "macro-micro-catalogo"
+VERSIONE_FORMATO = 1
+CAMPI_ALIMENTO = (
+    "codice_alimento",
+    "nome",
+    "categoria",
+    "nome_scientifico",
+    "english_name",
+    "parte_edibile",
+    "porzione",
+)
+DIMENSIONE_BATCH = 5000
+
+
+def leggi_catalogo(conn: sqlite3.Connection) -> tuple[list[list], list[dict]]:
+    """Legge alimenti e valori dal DB e li riorganizza in forma compatta."""
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""
+        SELECT {", ".join(CAMPI_ALIMENTO)}
+        FROM alimenti
+        ORDER BY codice_alimento ASC
+        """
+    )
+    alimenti = {
+        row[0]: {**dict(zip(CAMPI_ALIMENTO, row)), "valori": []}
+        for row in cursor.fetchall()
+    }
+
+    nutrienti: list[list] = []
+    indice_nutrienti: dict[tuple, int] = {}
+    cursor.execute(
+        """
+        SELECT codice_alimento, macrocategoria, nutriente, unita_misura,
+               valore_100g, valore_porzione
+        FROM valori_nutrizionali
+        ORDER BY codice_alimento ASC, id ASC
+        """
+    )
+    for codice, macrocategoria, nutriente, unita, valore_100g, valore_porzione in cursor:
+        alimento = alimenti.get(codice)
+        if alimento is None:
+            continue
+        chiave = (macrocategoria, nutriente, unita)
+        indice = indice_nutrienti.get(chiave)
+        if indice is None:
+            indice = len(nutrienti)
+            indice_nutrienti[chiave] = indice
+            nutrienti.append(list(chiave))
+        alimento["valori"].append([indice, valore_100g, valore_porzione])
+
+    return nutrienti, list(alimenti.values())
+
+
+def calcola_versione_catalogo(nutrienti: list[list], alimenti: list[dict]) -> str:
+    """Ritorna un hash stabile del contenuto del catalogo (prime 16 cifre esadecimali)."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(nutrienti, ensure_ascii=False).encode("utf-8"))
+    for alimento in alimenti:
+        digest.update(json.dumps(alimento, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def esporta_catalogo(conn: sqlite3.Connection, percorso: str) -> dict:
+    """Esporta il catalogo nel file indicato e ritorna l'intestazione scritta."""
+    nutrienti, alimenti = leggi_catalogo(conn)
+    intestazione = {
+        "formato": FORMATO,
+        "versione_formato": VERSIONE_FORMATO,
+        "versione_catalogo": calcola_versione_catalogo(nutrienti, alimenti),
+        "esportato_il": datetime.now(timezone.utc).isoformat(),
+        "alimenti": len(alimenti),
+        "valori": sum(len(alimento["valori"]) for alimento in alimenti),
+        "nutrienti": nutrienti,
+    }
+
+    with gzip.open(percorso, "wt", encoding="utf-8") as file:
+        file.write(json.dumps(intestazione, ensure_ascii=False, separators=(",", ":")) + "\n")
+        for alimento in alimenti:
+            file.write(json.dumps(alimento, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    return intestazione
+
+
+def leggi_file_catalogo(percorso: str) -> tuple[dict, list[dict]]:
+    """Legge e valida un file di catalogo, ritornando intestazione e alimenti."""
+    with gzip.open(percorso, "rt", encoding="utf-8") as file:
+        intestazione = json.loads(file.readline() or "{}")
+        if intestazione.get("formato") != FORMATO:
+            raise ValueError(f"{percorso} non e' un file di catalogo valido")
+        if intestazione.get("versione_formato") != VERSIONE_FORMATO:
+            raise ValueError(
+                f"Versione formato non supportata: {intestazione.get('versione_formato')}"
+            )
+        alimenti = [json.loads(riga) for riga in file if riga.strip()]
+    return intestazione, alimenti
+
+
+def importa_catalogo(conn: sqlite3.Connection, percorso: str) -> dict:
+    """
+    Carica il catalogo dal file in transazione singola con insert a blocchi.
+    Gli indici del catalogo vengono rimossi prima del caricamento e ricreati alla fine;
+    i totali materializzati delle diete vengono ricalcolati con i nuovi valori.
+    """
+    intestazione, alimenti = leggi_file_catalogo(percorso)
+
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        elimina_indici_catalogo(cursor)
+        carica_catalogo(cursor, intestazione["nutrienti"], alimenti)
+        crea_indici_catalogo(cursor)
+        ricalcola_totali_nutrizionali(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    cursor.execute("ANALYZE")
+    return intestazione
+
+
+def carica_catalogo(cursor: sqlite3.Cursor, nutrienti: list[list], alimenti: list[dict]) -> None:
+    """Scrive alimenti e valori in forma compatta con insert a blocchi (senza commit)."""
+    cursor.executemany(
+        """
+        INSERT INTO alimenti
+        (codice_alimento, nome, categoria, nome_scientifico, english_name, parte_edibile, porzione)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(codice_alimento) DO UPDATE SET
+            nome = excluded.nome,
+            categoria = excluded.categoria,
+            nome_scientifico = excluded.nome_scientifico,
+            english_name = excluded.english_name,
+            parte_edibile = excluded.parte_edibile,
+            porzione = excluded.porzione
+        """,
+        [tuple(alimento.get(campo) for campo in CAMPI_ALIMENTO) for alimento in alimenti],
+    )
+    # Una sola DELETE in join con i codici importati: durante l'import l'indice su
+    # codice_alimento e' stato rimosso, e una DELETE per alimento scansionerebbe ogni volta
+    # l'intera tabella.
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS codici_importati (codice_alimento TEXT PRIMARY KEY)")
+    cursor.execute("DELETE FROM temp.codici_importati")
+    cursor.executemany(
+        "INSERT OR IGNORE INTO temp.codici_importati (codice_alimento) VALUES (?)",
+        [(alimento["codice_alimento"],) for alimento in alimenti],
+    )
+    cursor.execute(
+        """
+        DELETE FROM valori_nutrizionali
+        WHERE codice_alimento IN (SELECT codice_alimento FROM temp.codici_importati)
+        """
+    )
+    cursor.execute("DROP TABLE temp.codici_importati")
+
+    batch = []
+    for alimento in alimenti:
+        codice = alimento["codice_alimento"]
+        for indice, valore_100g, valore_porzione in alimento["valori"]:
+            macrocategoria, nutriente, unita = nutrienti[indice]
+            batch.append((codice, macrocategoria, nutriente, unita, valore_100g, valore_porzione))
+        if len(batch) >= DIMENSIONE_BATCH:
+            _inserisci_valori(cursor, batch)
+            batch = []
+    if batch:
+        _inserisci_valori(cursor, batch)
+
+
+def _inserisci_valori(cursor: sqlite3.Cursor, batch: list[tuple]) -> None:
+    cursor.executemany(
+        """
+        INSERT INTO valori_nutrizionali
+        (codice_alimento, macrocategoria, nutriente, unita_misura, valore_100g, valore_porzione)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        batch,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import/export offline del catalogo alimenti")
+    parser.add_argument("comando", choices=["esporta", "importa"])
+    parser.add_argument("file", help="Percorso del file .jsonl.gz")
+    parser.add_argument("--db", default=DB_PATH, help=f"Database SQLite (default: {DB_PATH})")
+    args = parser.parse_args()
+
+    conn = setup_database(args.db)
+    inizio = time.perf_counter()
+    try:
+        if args.comando == "esporta":
+            intestazione = esporta_catalogo(conn, args.file)
+            azione = "Esportati"
+        else:
+            intestazione = importa_catalogo(conn, args.file)
+            azione = "Importati"
+    finally:
+        conn.close()
+
+    durata = time.perf_counter() - inizio
+    print(
+        f"{azione} {intestazione['alimenti']} alimenti e {intestazione['valori']} valori "
+        f"(catalogo {intestazione['versione_catalogo']}) in {durata:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
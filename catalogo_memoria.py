@@ -0,0 +1,322 @@
+"""
+Catalogo alimenti in memoria, in sola lettura.
+
+Quando e' pubblicato uno snapshot del catalogo (immutabile per costruzione), anagrafica,
+valori per 100g e le strutture derivate (indice di ricerca, classifiche per nutriente,
+bitmap delle facette, indici di similarita') vengono caricati una volta per versione e
+condivisi da tutte le richieste; con ``server.py`` il caricamento avviene nel processo
+padre prima del fork, cosi' i worker condividono le stesse pagine copy-on-write.
+Senza snapshot il catalogo vive nel DB principale (modificabile) e le funzioni di
+``crud_manager`` restano sulle query SQL; dove una query non basta (similarita') si usa
+``RegistroCatalogo.da_db``, che rilegge il catalogo solo quando il contenuto cambia.
+"""
+import logging
+import sqlite3
+import threading
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+
+from catalogo_similarita import PROFILI_SIMILARITA, IndiceSimilarita, costruisci_indice
+from catalogo_snapshot import collega_snapshot
+
+logger = logging.getLogger("macro_micro.catalogo")
+
+RISULTATI_RICERCA = 20
+# Cambia a ogni import o scraping: gli id di valori_nutrizionali (AUTOINCREMENT) non vengono
+# riusati, quindi ogni riga inserita alza MAX(id) e ogni riga eliminata cambia il conteggio.
+FIRMA_CATALOGO = """
+    SELECT (SELECT COUNT(*) FROM alimenti), COUNT(*), MAX(id) FROM valori_nutrizionali
+"""
+
+
+@dataclass
+class CatalogoMemoria:
+    versione: str
+    # codice_alimento -> riga pronta per la ricerca (nome, categoria, macro per 100g)
+    alimenti: dict[str, dict] = field(default_factory=dict)
+    # codice_alimento -> {nutriente: valore_100g}
+    valori: dict[str, dict[str, float]] = field(default_factory=dict)
+    # (nome minuscolo, categoria minuscola, codice) nell'ordine dei risultati di ricerca
+    indice_ricerca: list[tuple[str, str, str]] = field(default_factory=list)
+    # nutriente -> unita' di misura
+    unita: dict[str, str] = field(default_factory=dict)
+    # nutriente -> codici in ordine decrescente di valore per 100g (solo valori > 0)
+    classifiche: dict[str, list[str]] = field(default_factory=dict)
+    # nutriente -> codici in ordine decrescente di valore per kcal (solo alimenti con kcal > 0)
+    classifiche_kcal: dict[str, list[str]] = field(default_factory=dict)
+    # Facette: i bit sono le posizioni degli alimenti in ``indice_ricerca`` (ordine per nome).
+    # categoria minuscola -> (categoria, bitmap degli alimenti della categoria)
+    facette_categorie: dict[str, tuple[str | None, int]] = field(default_factory=dict)
+    # chiave macro -> (valori per 100g crescenti, posizioni corrispondenti)
+    macro_ordinate: dict[str, tuple[list[float], list[int]]] = field(default_factory=dict)
+    # profilo ("macro", "completo") -> vettori normalizzati, costruiti al primo uso (vedi indice_similarita)
+    similarita: dict[str, IndiceSimilarita] = field(default_factory=dict)
+    # bundle per il client gia' serializzati, per variante (vedi catalogo_bundle)
+    bundle: dict = field(default_factory=dict)
+
+    def cerca(self, keyword: str, limite: int = RISULTATI_RICERCA) -> list[dict]:
+        """Stessa semantica di ``cerca_alimenti``: sottostringa su nome o categoria, ordine per nome."""
+        chiave = keyword.strip().lower()
+        risultati = []
+        for nome, categoria, codice in self.indice_ricerca:
+            if chiave in nome or chiave in categoria:
+                risultati.append(dict(self.alimenti[codice]))
+                if len(risultati) >= limite:
+                    break
+        return risultati
+
+    def piu_ricchi(
+        self,
+        nutriente: str,
+        limite: int = RISULTATI_RICERCA,
+        per_kcal: bool = False,
+        categoria: str | None = None,
+    ) -> list[dict] | None:
+        """Come ``alimenti_piu_ricchi``, scorrendo la classifica precalcolata; None se il nutriente non esiste."""
+        if nutriente not in self.unita:
+            return None
+        classifica = (self.classifiche_kcal if per_kcal else self.classifiche).get(nutriente, [])
+        categoria = categoria.strip().lower() if categoria else None
+        risultati = []
+        for codice in classifica:
+            riga = self.alimenti[codice]
+            if categoria is not None and (riga["categoria"] or "").lower() != categoria:
+                continue
+            valore = self.valori[codice][nutriente]
+            risultati.append(
+                {
+                    "codice_alimento": codice,
+                    "nome": riga["nome"],
+                    "categoria": riga["categoria"],
+                    "valore_100g": valore,
+                    "kcal": riga["kcal"],
+                    "valore": valore * 100 / riga["kcal"] if per_kcal else valore,
+                }
+            )
+            if len(risultati) >= limite:
+                break
+        return risultati
+
+    def simili(
+        self,
+        codice: str,
+        limite: int = RISULTATI_RICERCA,
+        categoria: str | None = None,
+        profilo: str = "macro",
+    ) -> list[dict] | None:
+        """Alimenti dal profilo nutrizionale piu' vicino a ``codice``; None se non e' nel catalogo."""
+        categoria = categoria.strip().lower() if categoria else None
+        vicini = self.indice_similarita(profilo).vicini(codice, limite, categoria)
+        if vicini is None:
+            return None
+        return [{**self.alimenti[vicino], "distanza": distanza} for vicino, distanza in vicini]
+
+    def indice_similarita(self, profilo: str) -> IndiceSimilarita:
+        """Indice del profilo, costruito al primo uso e poi riusato per la versione."""
+        from crud_manager import MACRO_NUTRIENTI
+
+        if profilo not in PROFILI_SIMILARITA:
+            raise ValueError(f"Profilo sconosciuto: {profilo}")
+        indice = self.similarita.get(profilo)
+        if indice is None:
+            nutrienti = list(MACRO_NUTRIENTI) if profilo == "macro" else sorted(self.unita)
+            indice = self.similarita[profilo] = costruisci_indice(self.alimenti, self.valori, nutrienti)
+        return indice
+
+    def _bitmap_intervallo(self, chiave: str, minimo: float | None, massimo: float | None) -> int:
+        """Bitmap degli alimenti con la macro ``chiave`` in [minimo, massimo] (estremi inclusi)."""
+        valori, posizioni = self.macro_ordinate[chiave]
+        inizio = bisect_left(valori, minimo) if minimo is not None else 0
+        fine = bisect_right(valori, massimo) if massimo is not None else len(valori)
+        bit = bytearray((len(self.indice_ricerca) + 7) // 8)
+        for posizione in posizioni[inizio:fine]:
+            bit[posizione >> 3] |= 1 << (posizione & 7)
+        return int.from_bytes(bit, "little")
+
+    def sfoglia(
+        self,
+        categoria: str | None = None,
+        intervalli: dict[str, tuple[float | None, float | None]] | None = None,
+        offset: int = 0,
+        limite: int = RISULTATI_RICERCA,
+    ) -> dict:
+        """Come ``sfoglia_alimenti``, con intersezioni di bitmap al posto delle query."""
+        filtro = (1 << len(self.indice_ricerca)) - 1
+        for chiave, (minimo, massimo) in (intervalli or {}).items():
+            filtro &= self._bitmap_intervallo(chiave, minimo, massimo)
+
+        facette = sorted(
+            ((nome, (bitmap & filtro).bit_count()) for nome, bitmap in self.facette_categorie.values()),
+            key=lambda voce: voce[0] or "",
+        )
+        if categoria:
+            voce = self.facette_categorie.get(categoria.strip().lower())
+            filtro &= voce[1] if voce else 0
+
+        totale = filtro.bit_count()
+        alimenti = []
+        saltati = 0
+        while filtro and len(alimenti) < limite:
+            bit_basso = filtro & -filtro
+            filtro ^= bit_basso
+            if saltati < offset:
+                saltati += 1
+                continue
+            codice = self.indice_ricerca[bit_basso.bit_length() - 1][2]
+            alimenti.append(dict(self.alimenti[codice]))
+        return {
+            "totale": totale,
+            "facette": [{"categoria": nome, "alimenti": conteggio} for nome, conteggio in facette],
+            "alimenti": alimenti,
+        }
+
+    def valori_alimenti(self, codici) -> dict[str, dict[str, float]]:
+        """Come ``_carica_valori_alimenti``: {codice: {nutriente: valore_100g}}, {} se sconosciuto."""
+        return {codice: self.valori.get(codice, {}) for codice in codici if codice}
+
+
+def carica_catalogo_memoria(conn: sqlite3.Connection, versione: str) -> CatalogoMemoria:
+    """Legge anagrafica e valori dalle tabelle ``alimenti``/``valori_nutrizionali`` di ``conn``."""
+    from crud_manager import MACRO_NUTRIENTI, _to_float_value
+
+    catalogo = CatalogoMemoria(versione=versione)
+    for codice, nome, categoria in conn.execute("SELECT codice_alimento, nome, categoria FROM alimenti"):
+        catalogo.alimenti[codice] = {
+            "codice_alimento": codice,
+            "nome": nome,
+            "categoria": categoria,
+            **{chiave: 0.0 for chiave in MACRO_NUTRIENTI.values()},
+        }
+        catalogo.valori[codice] = {}
+
+    for codice, nutriente, unita, valore_100g in conn.execute(
+        "SELECT codice_alimento, nutriente, unita_misura, valore_100g FROM valori_nutrizionali"
+    ):
+        catalogo.unita.setdefault(nutriente, unita)
+        valore = _to_float_value(valore_100g)
+        valori_alimento = catalogo.valori.setdefault(codice, {})
+        # Il catalogo puo' avere righe ripetute per (alimento, nutriente): vale la massima.
+        valore = valori_alimento[nutriente] = max(valore, valori_alimento.get(nutriente, valore))
+        chiave_macro = MACRO_NUTRIENTI.get(nutriente)
+        if chiave_macro and codice in catalogo.alimenti:
+            catalogo.alimenti[codice][chiave_macro] = valore
+
+    # Ordine di ORDER BY nome in SQLite (binario, maiuscole prima delle minuscole).
+    ordinati = sorted(catalogo.alimenti.items(), key=lambda voce: (voce[1]["nome"] or "", voce[0]))
+    catalogo.indice_ricerca = [
+        ((riga["nome"] or "").lower(), (riga["categoria"] or "").lower(), codice)
+        for codice, riga in ordinati
+    ]
+    _costruisci_classifiche(catalogo)
+    _costruisci_facette(catalogo)
+    return catalogo
+
+
+def _costruisci_facette(catalogo: CatalogoMemoria) -> None:
+    """Bitmap per categoria e macro ordinate per gli intervalli, sulle posizioni di ``indice_ricerca``."""
+    from crud_manager import MACRO_NUTRIENTI
+
+    posizioni_macro: dict[str, list[tuple[float, int]]] = {chiave: [] for chiave in MACRO_NUTRIENTI.values()}
+    for posizione, (_nome, categoria_minuscola, codice) in enumerate(catalogo.indice_ricerca):
+        riga = catalogo.alimenti[codice]
+        nome_categoria, bitmap = catalogo.facette_categorie.get(categoria_minuscola, (riga["categoria"], 0))
+        catalogo.facette_categorie[categoria_minuscola] = (nome_categoria, bitmap | (1 << posizione))
+        for chiave, voci in posizioni_macro.items():
+            voci.append((riga[chiave], posizione))
+
+    for chiave, voci in posizioni_macro.items():
+        voci.sort()
+        catalogo.macro_ordinate[chiave] = ([valore for valore, _ in voci], [posizione for _, posizione in voci])
+
+
+def _costruisci_classifiche(catalogo: CatalogoMemoria) -> None:
+    """Ordina una volta per versione gli alimenti di ogni nutriente, per 100g e per kcal."""
+    per_nutriente: dict[str, list[tuple[float, str]]] = {}
+    for codice, valori in catalogo.valori.items():
+        if codice not in catalogo.alimenti:
+            continue
+        for nutriente, valore in valori.items():
+            if valore > 0:
+                per_nutriente.setdefault(nutriente, []).append((valore, codice))
+
+    for nutriente, voci in per_nutriente.items():
+        voci.sort(key=lambda voce: (-voce[0], voce[1]))
+        catalogo.classifiche[nutriente] = [codice for _valore, codice in voci]
+        # Stessa espressione della query (valore per 100 kcal): a pari valore l'ordine e' per codice.
+        per_kcal = [
+            (valore * 100 / catalogo.alimenti[codice]["kcal"], codice)
+            for valore, codice in voci
+            if catalogo.alimenti[codice]["kcal"] > 0
+        ]
+        per_kcal.sort(key=lambda voce: (-voce[0], voce[1]))
+        catalogo.classifiche_kcal[nutriente] = [codice for _valore, codice in per_kcal]
+
+
+class RegistroCatalogo:
+    """
+    Tiene il catalogo in memoria allineato allo snapshot attivo del ``GestoreSnapshot``.
+    Se lo snapshot cambia dopo il fork, ogni worker ricarica la nuova versione al primo uso.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._gestore = None
+        self._catalogo: CatalogoMemoria | None = None
+        self._catalogo_db: tuple[tuple, CatalogoMemoria] | None = None
+
+    def configura(self, gestore_snapshot) -> None:
+        self._gestore = gestore_snapshot
+
+    def corrente(self) -> CatalogoMemoria | None:
+        """Catalogo della versione attiva, o None se non c'e' uno snapshot pubblicato."""
+        if self._gestore is None:
+            return None
+        catalogo = self._catalogo
+        versione = self._gestore.versione_corrente()
+        if versione is None:
+            return None
+        if catalogo is not None and catalogo.versione == versione:
+            return catalogo
+        return self._ricarica()
+
+    def da_db(self, conn: sqlite3.Connection) -> CatalogoMemoria:
+        """
+        Catalogo letto da ``conn`` quando non c'e' uno snapshot, riusato (con gli indici
+        costruiti al primo uso) finche' ``FIRMA_CATALOGO`` non cambia.
+        """
+        firma = tuple(conn.execute(FIRMA_CATALOGO).fetchone())
+        memorizzato = self._catalogo_db
+        if memorizzato is not None and memorizzato[0] == firma:
+            return memorizzato[1]
+        catalogo = carica_catalogo_memoria(conn, versione="")
+        self._catalogo_db = (firma, catalogo)
+        return catalogo
+
+    def precarica(self) -> CatalogoMemoria | None:
+        """Carica subito la versione attiva (da chiamare prima del fork dei worker)."""
+        return self.corrente()
+
+    def _ricarica(self) -> CatalogoMemoria | None:
+        with self._lock:
+            with self._gestore.acquisisci() as snapshot:
+                if snapshot is None:
+                    return None
+                if self._catalogo is not None and self._catalogo.versione == snapshot.versione:
+                    return self._catalogo
+                conn = sqlite3.connect(":memory:")
+                try:
+                    collega_snapshot(conn, snapshot)
+                    catalogo = carica_catalogo_memoria(conn, snapshot.versione)
+                finally:
+                    conn.close()
+            # Indici di similarita' subito, cosi' con server.py sono condivisi tra i worker.
+            for profilo in PROFILI_SIMILARITA:
+                catalogo.indice_similarita(profilo)
+            self._catalogo = catalogo
+        logger.info(
+            "Catalogo %s caricato in memoria (%d alimenti)", catalogo.versione, len(catalogo.alimenti)
+        )
+        return catalogo
+
+
+registro_catalogo = RegistroCatalogo()
@@ -0,0 +1,110 @@
+"""
+Indice di similarita' nutrizionale per i suggerimenti di sostituzione.
+
+Ogni alimento del catalogo e' un vettore dei valori per 100g, con ogni nutriente
+standardizzato sul catalogo (z-score) perche' grammi, milligrammi e kcal pesino allo
+stesso modo; la vicinanza e' la distanza euclidea tra i vettori. Profili:
+- ``macro``: energia, proteine, carboidrati e grassi;
+- ``completo``: tutti i nutrienti del catalogo (un valore mancante vale zero, come nel bundle).
+
+L'indice di un profilo e' costruito una volta per versione del catalogo (al caricamento
+di uno snapshot, altrimenti al primo uso) e normalizzato con NumPy se disponibile, in
+Python puro altrimenti. Con un migliaio di alimenti e fino a decine di dimensioni un
+KD-tree pota poco: le distanze si calcolano tutte in un colpo con NumPy, o con
+``math.dist`` se NumPy non e' installato.
+"""
+import heapq
+import math
+
+PROFILI_SIMILARITA = ("macro", "completo")
+
+
+def _numpy():
+    """NumPy se installato, importato al primo indice costruito e non all'import dell'app."""
+    try:
+        import numpy
+    except ImportError:  # pragma: no cover - dipende dall'ambiente
+        return None
+    return numpy
+
+
+class IndiceSimilarita:
+    """Vettori normalizzati degli alimenti, nell'ordine di ``codici``."""
+
+    def __init__(self, codici: list[str], categorie: list[str], righe: list[list[float]]) -> None:
+        self.codici = codici
+        self.posizioni = {codice: posizione for posizione, codice in enumerate(codici)}
+        per_categoria: dict[str, list[int]] = {}
+        for posizione, categoria in enumerate(categorie):
+            per_categoria.setdefault(categoria, []).append(posizione)
+
+        # Un catalogo vuoto non ha posizioni da cercare: basta il ramo in Python puro.
+        self.np = np = _numpy() if righe else None
+        if np is not None:
+            matrice = np.array(righe, dtype=np.float64).reshape(len(codici), len(righe[0]))
+            deviazioni = matrice.std(axis=0)
+            # Le dimensioni costanti su tutto il catalogo non distinguono nessun alimento.
+            tenute = deviazioni > 0
+            self.vettori = (matrice[:, tenute] - matrice[:, tenute].mean(axis=0)) / deviazioni[tenute]
+            self.per_categoria = {
+                categoria: np.array(posizioni, dtype=np.intp) for categoria, posizioni in per_categoria.items()
+            }
+            return
+
+        colonne = []
+        for valori in zip(*righe):
+            media = math.fsum(valori) / len(valori)
+            deviazione = math.sqrt(math.fsum((valore - media) ** 2 for valore in valori) / len(valori))
+            if deviazione > 0:
+                colonne.append([(valore - media) / deviazione for valore in valori])
+        self.vettori = list(zip(*colonne)) if colonne else [() for _ in codici]
+        self.per_categoria = per_categoria
+
+    def vicini(self, codice: str, limite: int, categoria: str | None = None) -> list[tuple[str, float]] | None:
+        """
+        I ``limite`` alimenti piu' vicini a ``codice`` (escluso), eventualmente della sola
+        ``categoria`` (minuscola), come (codice, distanza) per distanza crescente e codice.
+        None se ``codice`` non e' nell'indice.
+        """
+        posizione = self.posizioni.get(codice)
+        if posizione is None:
+            return None
+        if self.np is not None:
+            return self._vicini_numpy(posizione, limite, categoria)
+
+        candidati = range(len(self.codici)) if categoria is None else self.per_categoria.get(categoria, [])
+        riferimento = self.vettori[posizione]
+        migliori = heapq.nsmallest(
+            limite + 1, ((math.dist(self.vettori[i], riferimento), i) for i in candidati)
+        )
+        return [(self.codici[i], distanza) for distanza, i in migliori if i != posizione][:limite]
+
+    def _vicini_numpy(self, posizione: int, limite: int, categoria: str | None) -> list[tuple[str, float]]:
+        np = self.np
+        if categoria is None:
+            candidati = None
+            vettori = self.vettori
+        else:
+            candidati = self.per_categoria.get(categoria)
+            if candidati is None:
+                return []
+            vettori = self.vettori[candidati]
+        distanze = np.sqrt(((vettori - self.vettori[posizione]) ** 2).sum(axis=1))
+        # Ordinamento stabile: a parita' di distanza vince la posizione, cioe' il codice.
+        ordine = np.argsort(distanze, kind="stable")[: limite + 1]
+        posizioni = ordine if candidati is None else candidati[ordine]
+        return [
+            (self.codici[i], float(distanze[j]))
+            for i, j in zip(posizioni.tolist(), ordine.tolist())
+            if i != posizione
+        ][:limite]
+
+
+def costruisci_indice(
+    alimenti: dict[str, dict], valori: dict[str, dict[str, float]], nutrienti: list[str]
+) -> IndiceSimilarita:
+    """Indice sui ``nutrienti`` indicati, per gli alimenti dell'anagrafica in ordine di codice."""
+    codici = sorted(alimenti)
+    categorie = [(alimenti[codice]["categoria"] or "").lower() for codice in codici]
+    righe = [[valori.get(codice, {}).get(nutriente, 0.0) for nutriente in nutrienti] for codice in codici]
+    return IndiceSimilarita(codici, categorie, righe)
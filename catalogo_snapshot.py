@@ -0,0 +1,326 @@
+"""
+Snapshot immutabili e versionati del catalogo alimenti.
+
+Il catalogo viene pubblicato in un file SQLite separato (``catalogo-<versione>.db``)
+che l'API collega in sola lettura (``mode=ro&immutable=1``), cosi' le letture del
+catalogo non competono con le scritture delle diete. Il file ``CURRENT`` nella
+cartella degli snapshot indica lo snapshot attivo e viene sostituito atomicamente:
+le nuove richieste usano subito la nuova versione, quelle gia' in corso terminano
+sulla vecchia.
+
+Uso:
+    python catalogo_snapshot.py pubblica [--sorgente ingestione.db] [--db nutrizione.db] [--dir catalogo]
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Generator
+
+from catalogo_io import CAMPI_ALIMENTO, calcola_versione_catalogo, carica_catalogo, leggi_catalogo
+from database import (
+    DB_PATH,
+    crea_indici_catalogo,
+    crea_tabelle_catalogo,
+    elimina_indici_catalogo,
+    ricalcola_totali_nutrizionali,
+    setup_database,
+)
+
+CARTELLA_SNAPSHOT = os.environ.get("CATALOGO_SNAPSHOT_DIR", "catalogo")
+FILE_CORRENTE = "CURRENT"
+PREFISSO_SNAPSHOT = "catalogo-"
+SNAPSHOT_DA_MANTENERE = 3
+# Un worker puo' aver letto CURRENT poco prima della sostituzione e collegare il vecchio
+# snapshot subito dopo: uno snapshot sostituito non si elimina prima di questo intervallo.
+GRAZIA_SNAPSHOT_S = float(os.environ.get("CATALOGO_SNAPSHOT_GRAZIA_S", "300"))
+
+
+@dataclass
+class Snapshot:
+    versione: str
+    percorso: Path
+    lettori: int = 0
+
+
+def pubblica_snapshot(
+    conn_sorgente: sqlite3.Connection,
+    cartella: str = CARTELLA_SNAPSHOT,
+    conn_utenti: sqlite3.Connection | None = None,
+) -> str:
+    """
+    Crea (se non esiste) lo snapshot del catalogo presente in ``conn_sorgente``,
+    lo rende attivo e ritorna la versione pubblicata.
+    Se ``conn_utenti`` e' indicato, vi sincronizza l'anagrafica degli alimenti
+    in modo che le foreign key di ``dettaglio_pasti`` restino valide; in ogni caso
+    i totali materializzati delle diete vengono ricalcolati con i nuovi valori.
+    """
+    nutrienti, alimenti = leggi_catalogo(conn_sorgente)
+    versione = calcola_versione_catalogo(nutrienti, alimenti)
+
+    cartella_path = Path(cartella)
+    cartella_path.mkdir(parents=True, exist_ok=True)
+    nome_file = f"{PREFISSO_SNAPSHOT}{versione}.db"
+    percorso = cartella_path / nome_file
+
+    if not percorso.exists():
+        temporaneo = cartella_path / f"{nome_file}.tmp"
+        temporaneo.unlink(missing_ok=True)
+        conn = sqlite3.connect(temporaneo)
+        try:
+            cursor = conn.cursor()
+            crea_tabelle_catalogo(cursor)
+            elimina_indici_catalogo(cursor)
+            carica_catalogo(cursor, nutrienti, alimenti)
+            crea_indici_catalogo(cursor)
+            conn.commit()
+            cursor.execute("ANALYZE")
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(temporaneo, percorso)
+
+    if conn_utenti is not None:
+        sincronizza_anagrafica(conn_utenti, alimenti)
+        aggiorna_totali_con_snapshot(conn_utenti, Snapshot(versione=versione, percorso=percorso))
+    else:
+        _ricalcola_totali(conn_sorgente)
+
+    precedente = _leggi_corrente(cartella_path)
+    _scrivi_corrente(cartella_path, nome_file)
+    if precedente and precedente != nome_file:
+        # L'mtime di uno snapshot sostituito segna l'istante della sostituzione.
+        try:
+            os.utime(cartella_path / precedente)
+        except FileNotFoundError:
+            pass
+    _rimuovi_snapshot_vecchi(cartella_path, nome_file)
+    return versione
+
+
+def sincronizza_anagrafica(conn: sqlite3.Connection, alimenti: list[dict]) -> None:
+    """Allinea la tabella ``alimenti`` del DB utenti con l'anagrafica dello snapshot."""
+    # Tutti i campi non chiave seguono lo snapshot, non solo quelli mostrati nelle liste.
+    aggiornamenti = ", ".join(f"{campo} = excluded.{campo}" for campo in CAMPI_ALIMENTO[1:])
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.executemany(
+            f"""
+            INSERT INTO alimenti ({", ".join(CAMPI_ALIMENTO)})
+            VALUES ({", ".join("?" for _ in CAMPI_ALIMENTO)})
+            ON CONFLICT(codice_alimento) DO UPDATE SET {aggiornamenti}
+            """,
+            [tuple(alimento.get(campo) for campo in CAMPI_ALIMENTO) for alimento in alimenti],
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def aggiorna_totali_con_snapshot(conn: sqlite3.Connection, snapshot: Snapshot) -> None:
+    """Ricalcola i totali delle diete leggendo i valori dallo snapshot indicato."""
+    collega_snapshot(conn, snapshot)
+    try:
+        _ricalcola_totali(conn)
+    finally:
+        scollega_snapshot(conn)
+
+
+def _ricalcola_totali(conn: sqlite3.Connection) -> None:
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        ricalcola_totali_nutrizionali(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _leggi_corrente(cartella: Path) -> str | None:
+    try:
+        return (cartella / FILE_CORRENTE).read_text(encoding="utf-8").strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _scrivi_corrente(cartella: Path, nome_file: str) -> None:
+    """Aggiorna atomicamente il puntatore allo snapshot attivo."""
+    temporaneo = cartella / f"{FILE_CORRENTE}.tmp"
+    with temporaneo.open("w", encoding="utf-8") as file:
+        file.write(nome_file + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporaneo, cartella / FILE_CORRENTE)
+
+
+def _rimuovi_snapshot_vecchi(
+    cartella: Path, nome_corrente: str, grazia_s: float = GRAZIA_SNAPSHOT_S
+) -> None:
+    """
+    Mantiene solo gli snapshot piu' recenti. Quelli in eccesso si eliminano solo dopo
+    ``grazia_s`` secondi dalla sostituzione: i conteggi dei lettori di ``GestoreSnapshot``
+    sono per processo e da qui non si vedono i worker che stanno ancora collegando il file.
+    """
+    snapshot = sorted(
+        (p for p in cartella.glob(f"{PREFISSO_SNAPSHOT}*.db") if p.name != nome_corrente),
+        key=lambda p: p.stat().st_mtime,
+        reverse=True,
+    )
+    limite = time.time() - grazia_s
+    for percorso in snapshot[SNAPSHOT_DA_MANTENERE - 1:]:
+        if percorso.stat().st_mtime <= limite:
+            percorso.unlink(missing_ok=True)
+
+
+def collega_snapshot(conn: sqlite3.Connection, snapshot: Snapshot) -> None:
+    """
+    Collega lo snapshot in sola lettura e lo rende visibile con i nomi
+    ``alimenti``/``valori_nutrizionali`` tramite viste TEMP (che hanno precedenza su main).
+    """
+    collega_catalogo(conn, snapshot.percorso)
+
+
+def collega_catalogo(conn: sqlite3.Connection, percorso: Path, immutabile: bool = True) -> None:
+    """
+    Come ``collega_snapshot`` per un qualsiasi DB con le tabelle del catalogo. Con
+    ``immutabile=False`` (es. il DB principale, ancora scritto) SQLite non salta i lock.
+    """
+    parametri = "mode=ro&immutable=1" if immutabile else "mode=ro"
+    uri = f"{Path(percorso).resolve().as_uri()}?{parametri}"
+    conn.execute("ATTACH DATABASE ? AS catalogo", (uri,))
+    conn.execute("CREATE TEMP VIEW alimenti AS SELECT * FROM catalogo.alimenti")
+    conn.execute("CREATE TEMP VIEW valori_nutrizionali AS SELECT * FROM catalogo.valori_nutrizionali")
+
+
+def scollega_snapshot(conn: sqlite3.Connection) -> None:
+    """Annulla ``collega_snapshot``/``collega_catalogo``: le tabelle di main tornano visibili."""
+    conn.execute("DROP VIEW temp.alimenti")
+    conn.execute("DROP VIEW temp.valori_nutrizionali")
+    conn.execute("DETACH DATABASE catalogo")
+
+
+class CatalogoCollegato:
+    """
+    Catalogo collegato a una connessione persistente (writer, lettori): prima di ogni uso
+    va riallineato con ``allinea`` allo snapshot attivo, che nel frattempo puo' cambiare.
+    Senza snapshot, ``catalogo_principale`` (per gli shard) e' il DB da collegare.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, catalogo_principale: str | None = None) -> None:
+        self.conn = conn
+        self.catalogo_principale = catalogo_principale
+        self._versione: str | None = None
+        self._collegato = False
+
+    def allinea(self, snapshot: Snapshot | None) -> None:
+        """Ricollega lo snapshot del catalogo se nel frattempo ne e' stato pubblicato uno nuovo."""
+        versione = snapshot.versione if snapshot else None
+        da_collegare = snapshot is not None or self.catalogo_principale is not None
+        if versione == self._versione and da_collegare == self._collegato:
+            return
+        if self._collegato:
+            scollega_snapshot(self.conn)
+        if snapshot is not None:
+            collega_snapshot(self.conn, snapshot)
+        elif self.catalogo_principale is not None:
+            collega_catalogo(self.conn, self.catalogo_principale, immutabile=False)
+        self._versione = versione
+        self._collegato = da_collegare
+
+
+class GestoreSnapshot:
+    """
+    Tiene traccia dello snapshot attivo e dei lettori che lo stanno usando.
+    Il cambio di versione avviene al primo accesso successivo all'aggiornamento di ``CURRENT``.
+    """
+
+    def __init__(self, cartella: str = CARTELLA_SNAPSHOT) -> None:
+        self.cartella = Path(cartella)
+        self._lock = threading.Lock()
+        self._corrente: Snapshot | None = None
+        self._firma_corrente: tuple | None = None
+        self._in_drenaggio: list[Snapshot] = []
+
+    def _aggiorna(self) -> None:
+        file_corrente = self.cartella / FILE_CORRENTE
+        try:
+            stat = file_corrente.stat()
+            firma = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            firma = None
+        if firma == self._firma_corrente:
+            return
+        self._firma_corrente = firma
+
+        nuovo = None
+        if firma is not None:
+            nome_file = file_corrente.read_text(encoding="utf-8").strip()
+            if self._corrente and self._corrente.percorso.name == nome_file:
+                return
+            versione = nome_file.removeprefix(PREFISSO_SNAPSHOT).removesuffix(".db")
+            nuovo = Snapshot(versione=versione, percorso=self.cartella / nome_file)
+
+        vecchio = self._corrente
+        self._corrente = nuovo
+        if vecchio and vecchio.lettori > 0:
+            self._in_drenaggio.append(vecchio)
+
+    @contextmanager
+    def acquisisci(self) -> Generator[Snapshot | None, None, None]:
+        """Ritorna lo snapshot attivo (o None) mantenendolo in uso fino all'uscita."""
+        with self._lock:
+            self._aggiorna()
+            snapshot = self._corrente
+            if snapshot:
+                snapshot.lettori += 1
+        try:
+            yield snapshot
+        finally:
+            if snapshot:
+                with self._lock:
+                    snapshot.lettori -= 1
+                    self._in_drenaggio = [s for s in self._in_drenaggio if s.lettori > 0]
+
+    def versione_corrente(self) -> str | None:
+        with self._lock:
+            self._aggiorna()
+            return self._corrente.versione if self._corrente else None
+
+    def stato(self) -> dict:
+        with self._lock:
+            self._aggiorna()
+            return {
+                "versione": self._corrente.versione if self._corrente else None,
+                "lettori": self._corrente.lettori if self._corrente else 0,
+                "in_drenaggio": {s.versione: s.lettori for s in self._in_drenaggio},
+            }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pubblicazione snapshot del catalogo alimenti")
+    parser.add_argument("comando", choices=["pubblica"])
+    parser.add_argument("--sorgente", default=DB_PATH, help="DB con il catalogo da pubblicare")
+    parser.add_argument("--db", default=DB_PATH, help="DB utenti da allineare")
+    parser.add_argument("--dir", default=CARTELLA_SNAPSHOT, help="Cartella degli snapshot")
+    args = parser.parse_args()
+
+    conn_sorgente = setup_database(args.sorgente)
+    conn_utenti = setup_database(args.db) if args.db != args.sorgente else None
+    try:
+        versione = pubblica_snapshot(conn_sorgente, args.dir, conn_utenti)
+    finally:
+        conn_sorgente.close()
+        if conn_utenti is not None:
+            conn_utenti.close()
+    print(f"Snapshot del catalogo {versione} pubblicato in '{args.dir}'")
+
+
+if __name__ == "__main__":
+    main()
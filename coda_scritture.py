@@ -0,0 +1,76 @@
+"""
+Coda di scrittura serializzata.
+
+Tutte le transazioni di scrittura dell'API passano da un unico thread che possiede
+una sola connessione SQLite: i writer del processo non competono mai tra loro per il
+lock del DB (niente ``database is locked``), mentre le letture restano concorrenti
+grazie al journal WAL. La contesa tra processi diversi e' gestita da
+``BEGIN IMMEDIATE`` e dal busy timeout impostati in ``database.py``.
+"""
+import contextvars
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from catalogo_snapshot import CatalogoCollegato
+from database import DB_PATH, setup_database
+
+
+class CodaScritture:
+    """
+    Esegue funzioni ``funzione(conn, *args)`` (es. quelle di crud_manager) una alla
+    volta sulla connessione del writer, in ordine di arrivo.
+
+    ``setup`` apre la connessione (``setup_database`` o ``setup_shard``); per uno shard,
+    ``catalogo_principale`` e' il DB da cui leggere il catalogo se non c'e' uno snapshot.
+    """
+
+    def __init__(
+        self,
+        db_name: str = DB_PATH,
+        factory: type[sqlite3.Connection] = sqlite3.Connection,
+        gestore_snapshot=None,
+        setup: Callable[..., sqlite3.Connection] = setup_database,
+        catalogo_principale: str | None = None,
+    ) -> None:
+        self.db_name = db_name
+        self.factory = factory
+        self.gestore_snapshot = gestore_snapshot
+        self.setup = setup
+        self.catalogo_principale = catalogo_principale
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer-sqlite")
+        self._conn: sqlite3.Connection | None = None
+        self._catalogo: CatalogoCollegato | None = None
+
+    def esegui(self, funzione: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Accoda la scrittura, attende il completamento e ne ritorna il risultato (o rilancia l'errore)."""
+        # Il contesto del chiamante (es. statistiche della richiesta) segue la scrittura nel writer.
+        contesto = contextvars.copy_context()
+        futuro = self._executor.submit(contesto.run, self._esegui, funzione, args, kwargs)
+        return futuro.result()
+
+    def _esegui(self, funzione: Callable[..., Any], args: tuple, kwargs: dict) -> Any:
+        if self._conn is None:
+            self._conn = self.setup(self.db_name, factory=self.factory)
+            self._catalogo = CatalogoCollegato(self._conn, self.catalogo_principale)
+        try:
+            if self.gestore_snapshot is None:
+                return funzione(self._conn, *args, **kwargs)
+            with self.gestore_snapshot.acquisisci() as snapshot:
+                self._catalogo.allinea(snapshot)
+                return funzione(self._conn, *args, **kwargs)
+        finally:
+            # La connessione e' condivisa: una scrittura fallita non deve lasciare transazioni aperte.
+            if self._conn.in_transaction:
+                self._conn.rollback()
+
+    def chiudi(self) -> None:
+        """Attende le scritture in coda e chiude la connessione del writer."""
+        self._executor.submit(self._chiudi_connessione).result()
+        self._executor.shutdown(wait=True)
+
+    def _chiudi_connessione(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            self._catalogo = None
@@ -1,7 +1,24 @@
 import sqlite3
+from datetime import date, timedelta
 
-from nutritional_targets import LARN_DICT
-from schemas import DietaCompletaCreate
+from catalogo_memoria import registro_catalogo
+from database import COLONNE_TOTALI, ricalcola_totali_nutrizionali, ricalcola_valori_ricette
+from nutritional_targets import LARN_DICT, assicura_larn_caricati
+from schemas import DiarioCreate, DietaCompletaCreate, RicettaCreate
+
+MACRO_NUTRIENTI = {
+    "Energia (kcal)": "kcal",
+    "Proteine (g)": "proteine",
+    "Carboidrati disponibili (g)": "carboidrati",
+    "Lipidi (g)": "grassi",
+}
+# Nutrienti esclusi dal calcolo dei micronutrienti (macro, acqua, alcol).
+PREFISSI_NON_MICRO = ("Energia", "Proteine", "Lipidi", "Carboidrati", "Acqua", "Alcol")
+# Limite prudente di parametri per singola query IN (...) in SQLite.
+DIMENSIONE_BLOCCO_IN = 500
+# Le ricette sono usabili ovunque si accetti un codice_alimento con il codice RIC-<id>.
+PREFISSO_RICETTA = "RIC-"
+PERIODI_DIARIO = ("giorno", "settimana", "mese")
 
 
 def _to_float_value(value: object) -> float:
@@ -17,21 +34,27 @@ def _to_float_value(value: object) -> float:
         return 0.0
 
 
+def _totali_materializzati(valori) -> dict[str, float]:
+    """Converte le colonne totale_* di pasti/diete nel dizionario macro usato dalle API."""
+    return {chiave: float(valore or 0.0) for chiave, valore in zip(MACRO_NUTRIENTI.values(), valori)}
+
+
 def crea_utente(
     conn: sqlite3.Connection,
     nome: str,
     email: str,
     password_hash: str,
     sesso: str,
+    shard: int | None = None,
 ) -> int:
-    """Inserisce un utente e ritorna l'id creato."""
+    """Inserisce un utente (con lo shard delle sue diete, None = DB principale) e ritorna l'id creato."""
     cursor = conn.cursor()
     cursor.execute(
         """
-        INSERT INTO utenti (nome, email, password_hash, sesso)
-        VALUES (?, ?, ?, ?)
+        INSERT INTO utenti (nome, email, password_hash, sesso, shard)
+        VALUES (?, ?, ?, ?, ?)
         """,
-        (nome, email, password_hash, sesso),
+        (nome, email, password_hash, sesso, shard),
     )
     conn.commit()
     return cursor.lastrowid
@@ -51,6 +74,103 @@ def crea_dieta(conn: sqlite3.Connection, utente_id: int, nome_dieta: str) -> int
     return cursor.lastrowid
 
 
+def _codici_esistenti(conn: sqlite3.Connection, sql: str, codici: list[str], *parametri) -> set[str]:
+    """Esegue ``sql`` (con un segnaposto ``{placeholders}``) a blocchi e raccoglie la prima colonna."""
+    esistenti: set[str] = set()
+    for inizio in range(0, len(codici), DIMENSIONE_BLOCCO_IN):
+        blocco = codici[inizio:inizio + DIMENSIONE_BLOCCO_IN]
+        placeholders = ", ".join("?" for _ in blocco)
+        righe = conn.execute(sql.format(placeholders=placeholders), (*blocco, *parametri))
+        esistenti.update(row[0] for row in righe)
+    return esistenti
+
+
+def codici_alimento_sconosciuti(
+    conn: sqlite3.Connection,
+    codici_alimento,
+    utente_id: int | None = None,
+) -> set[str]:
+    """
+    Ritorna i codici (tra quelli richiesti) assenti dal catalogo, confrontandoli con
+    l'insieme dei codici del catalogo in memoria (dallo snapshot o, senza snapshot, riletto
+    dal DB solo quando cambia). I codici delle ricette sono validi solo se la ricetta
+    appartiene a ``utente_id`` (mai se e' None).
+    """
+    richiesti = set(codici_alimento)
+    ricette = {codice for codice in richiesti if codice.startswith(PREFISSO_RICETTA)}
+    alimenti = richiesti - ricette
+
+    ricette_valide: set[str] = set()
+    if ricette and utente_id is not None:
+        ricette_valide = _codici_esistenti(
+            conn,
+            "SELECT codice FROM ricette WHERE codice IN ({placeholders}) AND utente_id = ?",
+            sorted(ricette),
+            utente_id,
+        )
+
+    catalogo = registro_catalogo.corrente() or registro_catalogo.da_db(conn)
+    return (alimenti - catalogo.alimenti.keys()) | (ricette - ricette_valide)
+
+
+def _errori_codici(codici_per_posizione, sconosciuti: set[str]) -> list[dict]:
+    """Errori in formato FastAPI per le posizioni (loc) con codice in ``sconosciuti``."""
+    return [
+        {
+            "type": "codice_alimento_inesistente",
+            "loc": ["body", *posizione, "codice_alimento"],
+            "msg": f"Alimento {codice} inesistente",
+            "input": codice,
+        }
+        for posizione, codice in codici_per_posizione
+        if codice in sconosciuti
+    ]
+
+
+def valida_codici_dieta(
+    conn: sqlite3.Connection,
+    dati_dieta: DietaCompletaCreate,
+    utente_id: int | None = None,
+) -> list[dict]:
+    """
+    Verifica in un solo passaggio tutti i codici_alimento del payload (le ricette devono
+    essere di ``utente_id``), prima di aprire la transazione di scrittura. Ritorna un errore
+    per ogni voce con codice inesistente, nello stesso formato degli errori di validazione
+    di FastAPI ([] se tutto e' valido).
+    """
+    sconosciuti = codici_alimento_sconosciuti(
+        conn,
+        (alimento.codice_alimento for pasto in dati_dieta.pasti for alimento in pasto.alimenti),
+        utente_id,
+    )
+    if not sconosciuti:
+        return []
+    return _errori_codici(
+        (
+            (("pasti", indice_pasto, "alimenti", indice_alimento), alimento.codice_alimento)
+            for indice_pasto, pasto in enumerate(dati_dieta.pasti)
+            for indice_alimento, alimento in enumerate(pasto.alimenti)
+        ),
+        sconosciuti,
+    )
+
+
+def valida_ricetta(conn: sqlite3.Connection, dati_ricetta: RicettaCreate) -> list[dict]:
+    """Come ``valida_codici_dieta`` per gli ingredienti: solo alimenti del catalogo."""
+    sconosciuti = codici_alimento_sconosciuti(
+        conn, (ingrediente.codice_alimento for ingrediente in dati_ricetta.ingredienti)
+    )
+    if not sconosciuti:
+        return []
+    return _errori_codici(
+        (
+            (("ingredienti", indice), ingrediente.codice_alimento)
+            for indice, ingrediente in enumerate(dati_ricetta.ingredienti)
+        ),
+        sconosciuti,
+    )
+
+
 def crea_dieta_completa(
     conn: sqlite3.Connection,
     utente_id: int,
@@ -58,7 +178,7 @@ def crea_dieta_completa(
 ) -> int:
     """Crea dieta, pasti e alimenti in transazione singola."""
     cursor = conn.cursor()
-    cursor.execute("BEGIN")
+    cursor.execute("BEGIN IMMEDIATE")
     try:
         cursor.execute(
             """
@@ -91,6 +211,7 @@ def crea_dieta_completa(
                     (pasto_id, alimento.codice_alimento, alimento.grammi),
                 )
 
+        ricalcola_totali_nutrizionali(cursor, [dieta_id])
         conn.commit()
         return dieta_id
     except Exception:
@@ -106,7 +227,7 @@ def aggiorna_dieta_completa(
 ) -> bool:
     """Aggiorna una dieta esistente con approccio wipe-and-replace."""
     cursor = conn.cursor()
-    cursor.execute("BEGIN")
+    cursor.execute("BEGIN IMMEDIATE")
     try:
         cursor.execute(
             """
@@ -174,6 +295,7 @@ def aggiorna_dieta_completa(
                     (pasto_id, alimento.codice_alimento, alimento.grammi),
                 )
 
+        ricalcola_totali_nutrizionali(cursor, [dieta_id])
         conn.commit()
         return True
     except Exception:
@@ -184,7 +306,7 @@ def aggiorna_dieta_completa(
 def elimina_dieta(conn: sqlite3.Connection, dieta_id: int, utente_id: int) -> bool:
     """Elimina una dieta (solo se appartiene all'utente) con cleanup dei figli."""
     cursor = conn.cursor()
-    cursor.execute("BEGIN")
+    cursor.execute("BEGIN IMMEDIATE")
     try:
         cursor.execute(
             """
@@ -230,7 +352,7 @@ def ottieni_dieta_completa(conn: sqlite3.Connection, dieta_id: int, utente_id: i
     cursor = conn.cursor()
     cursor.execute(
         """
-        SELECT id, nome_dieta
+        SELECT id, nome_dieta, revisione
         FROM diete
         WHERE id = ? AND utente_id = ?
         """,
@@ -243,8 +365,8 @@ def ottieni_dieta_completa(conn: sqlite3.Connection, dieta_id: int, utente_id: i
     week_plan = [{"meals": []} for _ in range(7)]
 
     cursor.execute(
-        """
-        SELECT id, giorno_settimana, nome_pasto, ordine
+        f"""
+        SELECT id, giorno_settimana, nome_pasto, ordine, {", ".join(COLONNE_TOTALI)}
         FROM pasti
         WHERE dieta_id = ?
         ORDER BY giorno_settimana ASC, ordine ASC, id ASC
@@ -253,19 +375,26 @@ def ottieni_dieta_completa(conn: sqlite3.Connection, dieta_id: int, utente_id: i
     )
     pasti_rows = cursor.fetchall()
 
-    for pasto_id, giorno_settimana, nome_pasto, _ordine in pasti_rows:
+    for pasto_id, giorno_settimana, nome_pasto, _ordine, *totali_pasto in pasti_rows:
         cursor.execute(
             """
-            SELECT dp.id, dp.codice_alimento, a.nome, dp.quantita_grammi,
-                   MAX(CASE WHEN v.nutriente = 'Energia (kcal)' THEN v.valore_100g END) AS kcal,
-                   MAX(CASE WHEN v.nutriente = 'Proteine (g)' THEN v.valore_100g END) AS proteine,
-                   MAX(CASE WHEN v.nutriente = 'Carboidrati disponibili (g)' THEN v.valore_100g END) AS carboidrati,
-                   MAX(CASE WHEN v.nutriente = 'Lipidi (g)' THEN v.valore_100g END) AS grassi
+            SELECT dp.id, dp.codice_alimento, COALESCE(a.nome, r.nome), dp.quantita_grammi,
+                   MAX(CASE WHEN v.nutriente = 'Energia (kcal)' THEN v.valore_100g
+                            WHEN vr.nutriente = 'Energia (kcal)' THEN vr.valore_100g END) AS kcal,
+                   MAX(CASE WHEN v.nutriente = 'Proteine (g)' THEN v.valore_100g
+                            WHEN vr.nutriente = 'Proteine (g)' THEN vr.valore_100g END) AS proteine,
+                   MAX(CASE WHEN v.nutriente = 'Carboidrati disponibili (g)' THEN v.valore_100g
+                            WHEN vr.nutriente = 'Carboidrati disponibili (g)' THEN vr.valore_100g END) AS carboidrati,
+                   MAX(CASE WHEN v.nutriente = 'Lipidi (g)' THEN v.valore_100g
+                            WHEN vr.nutriente = 'Lipidi (g)' THEN vr.valore_100g END) AS grassi
             FROM dettaglio_pasti dp
             LEFT JOIN alimenti a ON a.codice_alimento = dp.codice_alimento
+            LEFT JOIN ricette r ON r.codice = dp.codice_alimento
+            -- Un codice e' di un alimento del catalogo o di una ricetta: solo una delle due join trova righe.
             LEFT JOIN valori_nutrizionali v ON v.codice_alimento = dp.codice_alimento
+            LEFT JOIN valori_ricette vr ON vr.codice_ricetta = dp.codice_alimento
             WHERE dp.pasto_id = ?
-            GROUP BY dp.id, dp.codice_alimento, a.nome, dp.quantita_grammi
+            GROUP BY dp.id, dp.codice_alimento, a.nome, r.nome, dp.quantita_grammi
             ORDER BY dp.id ASC
             """,
             (pasto_id,),
@@ -306,22 +435,39 @@ def ottieni_dieta_completa(conn: sqlite3.Connection, dieta_id: int, utente_id: i
                     "ordine": _ordine,
                     "open": True,
                     "foods": foods,
+                    "totali": _totali_materializzati(totali_pasto),
                 }
             )
 
     return {
         "id": dieta_row[0],
         "nome": dieta_row[1],
+        "revisione": dieta_row[2],
         "week_plan": week_plan,
     }
 
 
+def revisione_dieta(conn: sqlite3.Connection, dieta_id: int, utente_id: int) -> int | None:
+    """Revisione corrente della dieta (None se non esiste o non e' dell'utente)."""
+    row = conn.execute(
+        "SELECT revisione FROM diete WHERE id = ? AND utente_id = ?", (dieta_id, utente_id)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def revisioni_diete_utente(conn: sqlite3.Connection, utente_id: int) -> list[tuple[int, int]]:
+    """Coppie (id, revisione) delle diete dell'utente: cambiano a ogni scrittura o eliminazione."""
+    return conn.execute(
+        "SELECT id, revisione FROM diete WHERE utente_id = ? ORDER BY id", (utente_id,)
+    ).fetchall()
+
+
 def ottieni_diete_utente(conn: sqlite3.Connection, utente_id: int) -> list[dict]:
     """Ritorna tutte le diete associate a un utente come lista di dizionari."""
     cursor = conn.cursor()
     cursor.execute(
-        """
-        SELECT id, utente_id, nome_dieta, data_creazione
+        f"""
+        SELECT id, utente_id, nome_dieta, data_creazione, revisione, {", ".join(COLONNE_TOTALI)}
         FROM diete
         WHERE utente_id = ?
         ORDER BY data_creazione DESC, id DESC
@@ -336,6 +482,8 @@ def ottieni_diete_utente(conn: sqlite3.Connection, utente_id: int) -> list[dict]
             "utente_id": row[1],
             "nome_dieta": row[2],
             "data_creazione": row[3],
+            "revisione": row[4],
+            "totali": _totali_materializzati(row[5:]),
         }
         for row in rows
     ]
@@ -360,6 +508,8 @@ def aggiungi_pasto(
         """,
         (dieta_id, giorno_settimana, nome_pasto, ordine),
     )
+    # Nessun alimento, totali invariati: la revisione va incrementata qui.
+    cursor.execute("UPDATE diete SET revisione = revisione + 1 WHERE id = ?", (dieta_id,))
     conn.commit()
     return cursor.lastrowid
 
@@ -370,16 +520,23 @@ def aggiungi_alimento_a_pasto(
     codice_alimento: str,
     quantita_grammi: int,
 ) -> None:
-    """Associa un alimento a un pasto."""
+    """Associa un alimento a un pasto aggiornando i totali di pasto e dieta."""
     cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT INTO dettaglio_pasti (pasto_id, codice_alimento, quantita_grammi)
-        VALUES (?, ?, ?)
-        """,
-        (pasto_id, codice_alimento, quantita_grammi),
-    )
-    conn.commit()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute(
+            """
+            INSERT INTO dettaglio_pasti (pasto_id, codice_alimento, quantita_grammi)
+            VALUES (?, ?, ?)
+            """,
+            (pasto_id, codice_alimento, quantita_grammi),
+        )
+        cursor.execute("SELECT dieta_id FROM pasti WHERE id = ?", (pasto_id,))
+        ricalcola_totali_nutrizionali(cursor, [row[0] for row in cursor.fetchall()])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
 
 def copia_giorno_dieta(
@@ -398,7 +555,7 @@ def copia_giorno_dieta(
         raise ValueError("giorno_destinazione deve essere compreso tra 1 e 7")
 
     cursor = conn.cursor()
-    cursor.execute("BEGIN")
+    cursor.execute("BEGIN IMMEDIATE")
     try:
         cursor.execute(
             """
@@ -440,17 +597,276 @@ def copia_giorno_dieta(
                     (nuovo_pasto_id, codice_alimento, quantita_grammi),
                 )
 
+        ricalcola_totali_nutrizionali(cursor, [dieta_id])
         conn.commit()
     except Exception:
         conn.rollback()
         raise
 
 
+def crea_ricetta(conn: sqlite3.Connection, utente_id: int, dati_ricetta: RicettaCreate) -> dict:
+    """
+    Salva una ricetta con i suoi ingredienti e ne precalcola il vettore per 100g.
+    Ritorna id e codice_alimento con cui usarla nei pasti.
+    """
+    grammi_totali = dati_ricetta.grammi_totali or sum(i.grammi for i in dati_ricetta.ingredienti)
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute(
+            """
+            INSERT INTO ricette (utente_id, nome, grammi_totali)
+            VALUES (?, ?, ?)
+            """,
+            (utente_id, dati_ricetta.nome, grammi_totali),
+        )
+        ricetta_id = cursor.lastrowid
+        codice = f"{PREFISSO_RICETTA}{ricetta_id}"
+        cursor.execute("UPDATE ricette SET codice = ? WHERE id = ?", (codice, ricetta_id))
+
+        for ingrediente in dati_ricetta.ingredienti:
+            cursor.execute(
+                """
+                INSERT INTO ingredienti_ricetta (ricetta_id, codice_alimento, grammi)
+                VALUES (?, ?, ?)
+                """,
+                (ricetta_id, ingrediente.codice_alimento, ingrediente.grammi),
+            )
+
+        ricalcola_valori_ricette(cursor, [ricetta_id])
+        conn.commit()
+        return {"id": ricetta_id, "codice_alimento": codice}
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def ottieni_ricette_utente(conn: sqlite3.Connection, utente_id: int) -> list[dict]:
+    """Ritorna le ricette dell'utente con ingredienti e macro per 100g."""
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT id, codice, nome, grammi_totali, data_creazione
+        FROM ricette
+        WHERE utente_id = ?
+        ORDER BY id
+        """,
+        (utente_id,),
+    )
+    ricette = {
+        codice: {
+            "id": ricetta_id,
+            "codice_alimento": codice,
+            "nome": nome,
+            "grammi_totali": grammi_totali,
+            "data_creazione": data_creazione,
+            "ingredienti": [],
+            **{chiave: 0.0 for chiave in MACRO_NUTRIENTI.values()},
+        }
+        for ricetta_id, codice, nome, grammi_totali, data_creazione in cursor.fetchall()
+    }
+    if not ricette:
+        return []
+
+    cursor.execute(
+        """
+        SELECT r.codice, i.codice_alimento, a.nome, i.grammi
+        FROM ricette r
+        JOIN ingredienti_ricetta i ON i.ricetta_id = r.id
+        LEFT JOIN alimenti a ON a.codice_alimento = i.codice_alimento
+        WHERE r.utente_id = ?
+        ORDER BY i.id
+        """,
+        (utente_id,),
+    )
+    for codice, codice_alimento, nome_alimento, grammi in cursor.fetchall():
+        ricette[codice]["ingredienti"].append(
+            {"codice_alimento": codice_alimento, "nome": nome_alimento or codice_alimento, "grammi": grammi}
+        )
+
+    cursor.execute(
+        f"""
+        SELECT v.codice_ricetta, v.nutriente, v.valore_100g
+        FROM valori_ricette v
+        JOIN ricette r ON r.codice = v.codice_ricetta
+        WHERE r.utente_id = ? AND v.nutriente IN ({", ".join("?" for _ in MACRO_NUTRIENTI)})
+        """,
+        (utente_id, *MACRO_NUTRIENTI),
+    )
+    for codice, nutriente, valore_100g in cursor.fetchall():
+        ricette[codice][MACRO_NUTRIENTI[nutriente]] = float(valore_100g or 0.0)
+    return list(ricette.values())
+
+
+def elimina_ricetta(conn: sqlite3.Connection, ricetta_id: int, utente_id: int) -> bool:
+    """
+    Elimina una ricetta dell'utente con ingredienti e valori. Solleva ValueError
+    se la ricetta e' ancora usata in qualche pasto.
+    """
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute("SELECT codice FROM ricette WHERE id = ? AND utente_id = ?", (ricetta_id, utente_id))
+        row = cursor.fetchone()
+        if not row:
+            conn.rollback()
+            return False
+        codice = row[0]
+
+        cursor.execute("SELECT 1 FROM dettaglio_pasti WHERE codice_alimento = ? LIMIT 1", (codice,))
+        if cursor.fetchone():
+            raise ValueError("La ricetta e' usata in una dieta: rimuovila dai pasti prima di eliminarla")
+        # Il diario non si modifica: i riepiloghi ricostruiti avrebbero bisogno del suo vettore.
+        cursor.execute("SELECT 1 FROM diario_alimenti WHERE codice_alimento = ? LIMIT 1", (codice,))
+        if cursor.fetchone():
+            raise ValueError("La ricetta e' registrata nel diario e non puo' essere eliminata")
+
+        cursor.execute("DELETE FROM valori_ricette WHERE codice_ricetta = ?", (codice,))
+        cursor.execute("DELETE FROM ingredienti_ricetta WHERE ricetta_id = ?", (ricetta_id,))
+        cursor.execute("DELETE FROM ricette WHERE id = ?", (ricetta_id,))
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def valida_diario(conn: sqlite3.Connection, dati_diario: DiarioCreate, utente_id: int) -> list[dict]:
+    """Come ``valida_codici_dieta`` per le voci del diario (alimenti o ricette dell'utente)."""
+    sconosciuti = codici_alimento_sconosciuti(
+        conn, (voce.codice_alimento for voce in dati_diario.alimenti), utente_id
+    )
+    if not sconosciuti:
+        return []
+    return _errori_codici(
+        ((("alimenti", indice), voce.codice_alimento) for indice, voce in enumerate(dati_diario.alimenti)),
+        sconosciuti,
+    )
+
+
+def inizio_periodo(periodo: str, giorno: date) -> date:
+    """Primo giorno del periodo del diario che contiene ``giorno`` (settimane dal lunedi')."""
+    if periodo == "settimana":
+        return giorno - timedelta(days=giorno.weekday())
+    if periodo == "mese":
+        return giorno.replace(day=1)
+    return giorno
+
+
+def registra_diario(conn: sqlite3.Connection, utente_id: int, dati_diario: DiarioCreate) -> list[int]:
+    """
+    Aggiunge le voci al diario e, nella stessa transazione, somma i loro nutrienti ai
+    riepiloghi di giorno, settimana e mese (valori correnti del catalogo e delle ricette).
+    Ritorna gli id delle voci.
+    """
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        data = dati_diario.data.isoformat()
+        voce_ids = []
+        for voce in dati_diario.alimenti:
+            cursor.execute(
+                """
+                INSERT INTO diario_alimenti (utente_id, data, nome_pasto, codice_alimento, quantita_grammi)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (utente_id, data, dati_diario.nome_pasto, voce.codice_alimento, voce.grammi),
+            )
+            voce_ids.append(cursor.lastrowid)
+
+        vettori = _carica_valori_alimenti(cursor, {voce.codice_alimento for voce in dati_diario.alimenti})
+        totali: dict[str, float] = {}
+        for voce in dati_diario.alimenti:
+            _somma_vettori(totali, vettori.get(voce.codice_alimento, {}), voce.grammi / 100.0)
+        cursor.executemany(
+            """
+            INSERT INTO riepiloghi_diario (utente_id, periodo, inizio, nutriente, totale)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (utente_id, periodo, inizio, nutriente)
+            DO UPDATE SET totale = totale + excluded.totale
+            """,
+            [
+                (utente_id, periodo, inizio_periodo(periodo, dati_diario.data).isoformat(), nutriente, valore)
+                for periodo in PERIODI_DIARIO
+                for nutriente, valore in totali.items()
+            ],
+        )
+        conn.commit()
+        return voce_ids
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def ottieni_diario(conn: sqlite3.Connection, utente_id: int, dal: date, al: date) -> list[dict]:
+    """Voci del diario dell'utente tra ``dal`` e ``al`` (inclusi), in ordine di registrazione."""
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT d.id, d.data, d.nome_pasto, d.codice_alimento, COALESCE(a.nome, r.nome), d.quantita_grammi,
+               d.registrato_il
+        FROM diario_alimenti d
+        LEFT JOIN alimenti a ON a.codice_alimento = d.codice_alimento
+        LEFT JOIN ricette r ON r.codice = d.codice_alimento
+        WHERE d.utente_id = ? AND d.data BETWEEN ? AND ?
+        ORDER BY d.data, d.id
+        """,
+        (utente_id, dal.isoformat(), al.isoformat()),
+    )
+    return [
+        {
+            "id": voce_id,
+            "data": data,
+            "nome_pasto": nome_pasto,
+            "codice_alimento": codice,
+            "nome": nome or codice,
+            "grammi": grammi,
+            "registrato_il": registrato_il,
+        }
+        for voce_id, data, nome_pasto, codice, nome, grammi, registrato_il in cursor.fetchall()
+    ]
+
+
+def riepiloghi_diario(
+    conn: sqlite3.Connection,
+    utente_id: int,
+    periodo: str,
+    dal: date,
+    al: date,
+    nutrienti: list[str] | None = None,
+) -> list[dict]:
+    """
+    Totali per ``periodo`` (giorno, settimana o mese) dei periodi che intersecano
+    ``dal``-``al``, letti dai riepiloghi precalcolati: una riga per periodo e nutriente.
+    Senza ``nutrienti`` ritorna i macro. I periodi senza voci sono omessi.
+    """
+    nutrienti = list(dict.fromkeys(nutrienti or MACRO_NUTRIENTI))
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""
+        SELECT inizio, nutriente, totale
+        FROM riepiloghi_diario
+        WHERE utente_id = ? AND periodo = ? AND inizio BETWEEN ? AND ?
+          AND nutriente IN ({", ".join("?" for _ in nutrienti)})
+        ORDER BY inizio
+        """,
+        (utente_id, periodo, inizio_periodo(periodo, dal).isoformat(), al.isoformat(), *nutrienti),
+    )
+    serie: dict[str, dict[str, float]] = {}
+    for inizio, nutriente, totale in cursor.fetchall():
+        serie.setdefault(inizio, dict.fromkeys(nutrienti, 0.0))[nutriente] = totale
+    return [{"inizio": inizio, "totali": totali} for inizio, totali in serie.items()]
+
+
 def cerca_alimenti(conn: sqlite3.Connection, keyword: str) -> list[dict]:
     """
     Cerca alimenti per parola chiave su nome o categoria (case-insensitive).
     Ritorna al massimo 20 risultati.
     """
+    catalogo = registro_catalogo.corrente()
+    if catalogo is not None:
+        return catalogo.cerca(keyword)
+
     cursor = conn.cursor()
     pattern = f"%{keyword.strip()}%"
     cursor.execute(
@@ -488,60 +904,135 @@ def cerca_alimenti(conn: sqlite3.Connection, keyword: str) -> list[dict]:
     return results
 
 
-def calcola_micronutrienti_lista(
+def sfoglia_alimenti(
     conn: sqlite3.Connection,
-    alimenti_richiesti: list,
-    sesso_utente: str,
-) -> dict[str, dict[str, float]]:
+    categoria: str | None = None,
+    intervalli: dict[str, tuple[float | None, float | None]] | None = None,
+    offset: int = 0,
+    limite: int = 20,
+) -> dict:
     """
-    Calcola i micronutrienti totali per una lista di alimenti/grammature
-    e li confronta con i target LARN in base al sesso dell'utente.
+    Navigazione del catalogo per categoria con filtri sulle macro per 100g.
+    ``intervalli`` e' {chiave macro (kcal, proteine, ...): (minimo, massimo)}, estremi
+    inclusi e None per nessun limite. Ritorna il totale e una pagina di alimenti
+    (ordine per nome) della categoria, e per ogni categoria il numero di alimenti che
+    rispettano i filtri sulle macro (le facette ignorano il filtro sulla categoria).
     """
-    cursor = conn.cursor()
-    totali: dict[str, float] = {}
+    for chiave in intervalli or {}:
+        if chiave not in MACRO_NUTRIENTI.values():
+            raise ValueError(f"Macro sconosciuta: {chiave}")
+    catalogo = registro_catalogo.corrente() or registro_catalogo.da_db(conn)
+    return catalogo.sfoglia(categoria, intervalli, offset, limite)
+
+
+def alimenti_piu_ricchi(
+    conn: sqlite3.Connection,
+    nutriente: str,
+    limite: int = 20,
+    per_kcal: bool = False,
+    categoria: str | None = None,
+) -> dict | None:
+    """
+    Alimenti con il valore piu' alto del nutriente, per 100g o (``per_kcal``) per
+    100 kcal, eventualmente della sola ``categoria``. Ritorna None se il nutriente
+    non esiste nel catalogo.
+    """
+    catalogo = registro_catalogo.corrente() or registro_catalogo.da_db(conn)
+    risultati = catalogo.piu_ricchi(nutriente, limite, per_kcal, categoria)
+    if risultati is None:
+        return None
+    return {"nutriente": nutriente, "unita": catalogo.unita[nutriente], "risultati": risultati}
+
+
+def alimenti_simili(
+    conn: sqlite3.Connection,
+    codice_alimento: str,
+    limite: int = 10,
+    categoria: str | None = None,
+    profilo: str = "macro",
+) -> dict | None:
+    """
+    Alimenti dal profilo nutrizionale piu' vicino a ``codice_alimento`` (vedi
+    ``catalogo_similarita``), eventualmente della sola ``categoria``, da proporre come
+    sostituti. Ritorna None se l'alimento non e' nel catalogo.
+    """
+    catalogo = registro_catalogo.corrente() or registro_catalogo.da_db(conn)
+    simili = catalogo.simili(codice_alimento, limite, categoria, profilo)
+    if simili is None:
+        return None
+    return {"alimento": dict(catalogo.alimenti[codice_alimento]), "profilo": profilo, "simili": simili}
+
+
+def _normalizza_sesso(sesso_utente: str | None) -> str:
     sesso = (sesso_utente or "M").strip().upper()
-    if sesso not in {"M", "F"}:
-        sesso = "M"
+    return sesso if sesso in {"M", "F"} else "M"
 
-    for alimento in alimenti_richiesti:
-        if isinstance(alimento, dict):
-            codice_alimento = alimento.get("codice_alimento")
-            grammi = alimento.get("grammi", 0)
-        else:
-            codice_alimento = getattr(alimento, "codice_alimento", None)
-            grammi = getattr(alimento, "grammi", 0)
 
-        if not codice_alimento:
-            continue
+def _carica_valori_alimenti(
+    cursor: sqlite3.Cursor,
+    codici_alimento,
+) -> dict[str, dict[str, float]]:
+    """
+    Carica in blocco i valori per 100g di tutti gli alimenti richiesti.
+    Ritorna {codice_alimento: {nutriente: valore_100g}}.
+    """
+    codici = sorted({codice for codice in codici_alimento if codice})
+    ricette = [codice for codice in codici if codice.startswith(PREFISSO_RICETTA)]
+    if ricette:
+        codici = [codice for codice in codici if not codice.startswith(PREFISSO_RICETTA)]
+        valori_ricette = _carica_valori_ricette(cursor, ricette)
+    else:
+        valori_ricette = {}
 
-        try:
-            grammi_float = float(grammi or 0)
-        except (TypeError, ValueError):
-            grammi_float = 0.0
-        if grammi_float <= 0:
-            continue
+    catalogo = registro_catalogo.corrente()
+    if catalogo is not None:
+        return {**catalogo.valori_alimenti(codici), **valori_ricette}
 
-        ratio = grammi_float / 100.0
+    valori: dict[str, dict[str, float]] = {codice: {} for codice in codici}
+    valori.update(valori_ricette)
+
+    for inizio in range(0, len(codici), DIMENSIONE_BLOCCO_IN):
+        blocco = codici[inizio:inizio + DIMENSIONE_BLOCCO_IN]
+        placeholders = ", ".join("?" for _ in blocco)
         cursor.execute(
-            """
-            SELECT nutriente, valore_100g
+            f"""
+            SELECT codice_alimento, nutriente, valore_100g
             FROM valori_nutrizionali
-            WHERE codice_alimento = ?
-              AND nutriente NOT LIKE 'Energia%'
-              AND nutriente NOT LIKE 'Proteine%'
-              AND nutriente NOT LIKE 'Lipidi%'
-              AND nutriente NOT LIKE 'Carboidrati%'
-              AND nutriente NOT LIKE 'Acqua%'
-              AND nutriente NOT LIKE 'Alcol%'
+            WHERE codice_alimento IN ({placeholders})
             """,
-            (codice_alimento,),
+            blocco,
         )
-        rows = cursor.fetchall()
+        for codice_alimento, nutriente, valore_100g in cursor.fetchall():
+            # Righe ripetute per (alimento, nutriente): vale la massima, come nel catalogo in memoria.
+            valore = _to_float_value(valore_100g)
+            valori_alimento = valori[codice_alimento]
+            valori_alimento[nutriente] = max(valore, valori_alimento.get(nutriente, valore))
+
+    return valori
 
-        for nutriente, valore_100g in rows:
-            valore = _to_float_value(valore_100g) * ratio
-            totali[nutriente] = totali.get(nutriente, 0.0) + valore
 
+def _carica_valori_ricette(cursor: sqlite3.Cursor, codici: list[str]) -> dict[str, dict[str, float]]:
+    """Vettori per 100g precalcolati delle ricette: una riga per nutriente, non per ingrediente."""
+    valori: dict[str, dict[str, float]] = {codice: {} for codice in codici}
+    for inizio in range(0, len(codici), DIMENSIONE_BLOCCO_IN):
+        blocco = codici[inizio:inizio + DIMENSIONE_BLOCCO_IN]
+        placeholders = ", ".join("?" for _ in blocco)
+        cursor.execute(
+            f"""
+            SELECT codice_ricetta, nutriente, valore_100g
+            FROM valori_ricette
+            WHERE codice_ricetta IN ({placeholders})
+            """,
+            blocco,
+        )
+        for codice_ricetta, nutriente, valore_100g in cursor.fetchall():
+            valori[codice_ricetta][nutriente] = float(valore_100g or 0.0)
+    return valori
+
+
+def _confronta_con_larn(totali: dict[str, float], sesso: str) -> dict[str, dict[str, float]]:
+    """Affianca ai totali dei micronutrienti il target LARN e la percentuale raggiunta."""
+    assicura_larn_caricati()
     risultati: dict[str, dict[str, float]] = {}
     for nutriente in sorted(totali):
         assunto = float(totali[nutriente])
@@ -561,3 +1052,200 @@ def calcola_micronutrienti_lista(
         }
 
     return risultati
+
+
+def _riepilogo_nutrienti(totali: dict[str, float], sesso: str, divisore: float = 1.0) -> dict:
+    """Separa macro e micro di un vettore di totali, confrontando i micro con i LARN."""
+    macro = {chiave: 0.0 for chiave in MACRO_NUTRIENTI.values()}
+    micro: dict[str, float] = {}
+    for nutriente, valore in totali.items():
+        valore = valore / divisore if divisore else 0.0
+        if nutriente in MACRO_NUTRIENTI:
+            macro[MACRO_NUTRIENTI[nutriente]] = valore
+        elif not nutriente.startswith(PREFISSI_NON_MICRO):
+            micro[nutriente] = valore
+    return {"macro": macro, "micro": _confronta_con_larn(micro, sesso)}
+
+
+def _somma_vettori(destinazione: dict[str, float], sorgente: dict[str, float], fattore: float = 1.0) -> None:
+    for nutriente, valore in sorgente.items():
+        destinazione[nutriente] = destinazione.get(nutriente, 0.0) + valore * fattore
+
+
+def calcola_report_dieta(
+    conn: sqlite3.Connection,
+    dieta_id: int,
+    utente_id: int,
+    sesso_utente: str,
+) -> dict | None:
+    """
+    Calcola in un solo passaggio i totali macro/micro per pasto, per giorno e la
+    media settimanale di una dieta dell'utente, con le percentuali LARN.
+    La media e' calcolata sui giorni che contengono almeno un pasto.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT id, nome_dieta
+        FROM diete
+        WHERE id = ? AND utente_id = ?
+        """,
+        (dieta_id, utente_id),
+    )
+    dieta_row = cursor.fetchone()
+    if not dieta_row:
+        return None
+
+    cursor.execute(
+        """
+        SELECT p.id, p.giorno_settimana, p.nome_pasto, p.ordine,
+               dp.codice_alimento, dp.quantita_grammi
+        FROM pasti p
+        LEFT JOIN dettaglio_pasti dp ON dp.pasto_id = p.id
+        WHERE p.dieta_id = ?
+        ORDER BY p.giorno_settimana ASC, p.ordine ASC, p.id ASC, dp.id ASC
+        """,
+        (dieta_id,),
+    )
+    righe = cursor.fetchall()
+    valori = _carica_valori_alimenti(cursor, (riga[4] for riga in righe))
+    sesso = _normalizza_sesso(sesso_utente)
+
+    totali_giorni: list[dict[str, float]] = [{} for _ in range(7)]
+    pasti_giorni: list[list[dict]] = [[] for _ in range(7)]
+    totali_pasti: dict[int, dict[str, float]] = {}
+
+    for pasto_id, giorno_settimana, nome_pasto, ordine, codice_alimento, grammi in righe:
+        day_index = int(giorno_settimana) - 1
+        if not 0 <= day_index < 7:
+            continue
+        totali_pasto = totali_pasti.get(pasto_id)
+        if totali_pasto is None:
+            totali_pasto = totali_pasti[pasto_id] = {}
+            pasti_giorni[day_index].append({"id": pasto_id, "nome": nome_pasto, "ordine": ordine})
+
+        ratio = float(grammi or 0) / 100.0
+        if codice_alimento and ratio > 0:
+            _somma_vettori(totali_pasto, valori.get(codice_alimento, {}), ratio)
+
+    totali_settimana: dict[str, float] = {}
+    giorni = []
+    for day_index in range(7):
+        pasti = []
+        for pasto in pasti_giorni[day_index]:
+            totali_pasto = totali_pasti[pasto["id"]]
+            _somma_vettori(totali_giorni[day_index], totali_pasto)
+            pasti.append({**pasto, **_riepilogo_nutrienti(totali_pasto, sesso)})
+        _somma_vettori(totali_settimana, totali_giorni[day_index])
+        giorni.append(
+            {
+                "giorno": day_index + 1,
+                "pasti": pasti,
+                **_riepilogo_nutrienti(totali_giorni[day_index], sesso),
+            }
+        )
+
+    giorni_pianificati = sum(1 for pasti in pasti_giorni if pasti)
+    return {
+        "id": dieta_row[0],
+        "nome": dieta_row[1],
+        "giorni": giorni,
+        "media_settimanale": {
+            "giorni_pianificati": giorni_pianificati,
+            **_riepilogo_nutrienti(totali_settimana, sesso, float(giorni_pianificati)),
+        },
+    }
+
+
+def _porzioni_valide(alimenti_richiesti: list) -> list[tuple[str, float]]:
+    """Normalizza la lista alimenti/grammature in coppie (codice_alimento, grammi/100)."""
+    porzioni = []
+    for alimento in alimenti_richiesti:
+        if isinstance(alimento, dict):
+            codice_alimento = alimento.get("codice_alimento")
+            grammi = alimento.get("grammi", 0)
+        else:
+            codice_alimento = getattr(alimento, "codice_alimento", None)
+            grammi = getattr(alimento, "grammi", 0)
+
+        if not codice_alimento:
+            continue
+
+        try:
+            grammi_float = float(grammi or 0)
+        except (TypeError, ValueError):
+            grammi_float = 0.0
+        if grammi_float <= 0:
+            continue
+
+        porzioni.append((codice_alimento, grammi_float / 100.0))
+    return porzioni
+
+
+def _totali_micro(
+    porzioni: list[tuple[str, float]],
+    valori: dict[str, dict[str, float]],
+) -> dict[str, float]:
+    totali: dict[str, float] = {}
+    for codice_alimento, ratio in porzioni:
+        for nutriente, valore_100g in valori.get(codice_alimento, {}).items():
+            if nutriente.startswith(PREFISSI_NON_MICRO):
+                continue
+            totali[nutriente] = totali.get(nutriente, 0.0) + valore_100g * ratio
+    return totali
+
+
+def _valori_porzioni(
+    conn: sqlite3.Connection,
+    codici_alimento,
+    utente_id: int | None,
+) -> dict[str, dict[str, float]]:
+    """
+    Come ``_carica_valori_alimenti`` per codici non validati: le ricette che non sono di
+    ``utente_id`` restano senza valori, come un codice sconosciuto.
+    """
+    codici = set(codici_alimento)
+    ricette = {codice for codice in codici if codice and codice.startswith(PREFISSO_RICETTA)}
+    if ricette:
+        codici -= codici_alimento_sconosciuti(conn, ricette, utente_id)
+    return _carica_valori_alimenti(conn.cursor(), codici)
+
+
+def calcola_micronutrienti_lista(
+    conn: sqlite3.Connection,
+    alimenti_richiesti: list,
+    sesso_utente: str,
+    utente_id: int | None = None,
+) -> dict[str, dict[str, float]]:
+    """
+    Calcola i micronutrienti totali per una lista di alimenti/grammature
+    e li confronta con i target LARN in base al sesso dell'utente.
+    Le ricette contano solo se sono di ``utente_id``.
+    """
+    porzioni = _porzioni_valide(alimenti_richiesti)
+    valori = _valori_porzioni(conn, (codice for codice, _ratio in porzioni), utente_id)
+    return _confronta_con_larn(_totali_micro(porzioni, valori), _normalizza_sesso(sesso_utente))
+
+
+def calcola_micronutrienti_gruppi(
+    conn: sqlite3.Connection,
+    gruppi: list,
+    sesso_utente: str,
+    utente_id: int | None = None,
+) -> dict[str, dict[str, dict[str, float]]]:
+    """
+    Calcola i micronutrienti di piu' gruppi (giorni o pasti) con un'unica lettura
+    del catalogo per l'unione degli alimenti. Ritorna {nome_gruppo: risultato}.
+    Le ricette contano solo se sono di ``utente_id``.
+    """
+    porzioni_gruppi = [(gruppo.nome, _porzioni_valide(gruppo.alimenti)) for gruppo in gruppi]
+    valori = _valori_porzioni(
+        conn,
+        (codice for _nome, porzioni in porzioni_gruppi for codice, _ratio in porzioni),
+        utente_id,
+    )
+    sesso = _normalizza_sesso(sesso_utente)
+    return {
+        nome: _confronta_con_larn(_totali_micro(porzioni, valori), sesso)
+        for nome, porzioni in porzioni_gruppi
+    }
@@ -1,38 +1,56 @@
+import os
 import sqlite3
-from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Percorso del DB applicativo, sovrascrivibile (es. per benchmark o ambienti di test).
+DB_PATH = os.environ.get('NUTRIZIONE_DB', 'nutrizione.db')
 
-def setup_database(db_name='nutrizione.db'):
-    """Crea le tabelle se non esistono e ritorna la connessione."""
-    conn = sqlite3.connect(db_name)
-    conn.execute("PRAGMA foreign_keys = ON;")
-    cursor = conn.cursor()
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS alimenti (
-            codice_alimento TEXT PRIMARY KEY,
-            nome TEXT,
-            categoria TEXT,
-            nome_scientifico TEXT,
-            english_name TEXT,
-            parte_edibile TEXT,
-            porzione TEXT
-        )
-    ''')
+# Nutriente del catalogo -> colonna dei totali materializzati su pasti/diete
+NUTRIENTI_TOTALI = {
+    'Energia (kcal)': 'totale_kcal',
+    'Proteine (g)': 'totale_proteine',
+    'Carboidrati disponibili (g)': 'totale_carboidrati',
+    'Lipidi (g)': 'totale_grassi',
+}
+COLONNE_TOTALI = tuple(NUTRIENTI_TOTALI.values())
+# Tabelle di proprieta' degli utenti con id AUTOINCREMENT (sequenze iniziali degli shard).
+TABELLE_DIETE_AUTOINCREMENT = (
+    "diete", "pasti", "dettaglio_pasti", "ricette", "ingredienti_ricetta", "diario_alimenti",
+)
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS valori_nutrizionali (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            codice_alimento TEXT,
-            macrocategoria TEXT,
-            nutriente TEXT,
-            unita_misura TEXT,
-            valore_100g TEXT,
-            valore_porzione TEXT,
-            FOREIGN KEY (codice_alimento) REFERENCES alimenti (codice_alimento)
-        )
-        ''')
+# Attesa massima (secondi) quando un altro writer detiene il lock del DB.
+BUSY_TIMEOUT_S = float(os.environ.get('SQLITE_BUSY_TIMEOUT_S', '15'))
+# PRAGMA di connessione: WAL permette letture concorrenti alle scritture,
+# synchronous=NORMAL e' sicuro in WAL e riduce le fsync per commit.
+PRAGMA_CONNESSIONE = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -32000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA foreign_keys = ON',
+)
+
+def setup_database(db_name=DB_PATH, factory=sqlite3.Connection):
+    """
+    Crea le tabelle se non esistono e ritorna la connessione.
+    ``factory`` permette di usare una sottoclasse di sqlite3.Connection (es. tracciata).
+    """
+    # uri=True permette di collegare lo snapshot del catalogo in sola lettura (ATTACH 'file:...?mode=ro').
+    # check_same_thread=False: FastAPI apre e chiude la connessione di get_db in thread
+    # diversi del threadpool; la connessione resta comunque usata da una richiesta alla volta.
+    conn = sqlite3.connect(
+        db_name,
+        uri=True,
+        factory=factory,
+        check_same_thread=False,
+        timeout=BUSY_TIMEOUT_S,
+    )
+    for pragma in PRAGMA_CONNESSIONE:
+        conn.execute(pragma)
+    cursor = conn.cursor()
+
+    crea_tabelle_catalogo(cursor)
 
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS utenti (
@@ -41,7 +59,8 @@ def setup_database(db_name='nutrizione.db'):
             email TEXT UNIQUE,
             password_hash TEXT,
             sesso TEXT NOT NULL DEFAULT 'M',
-            ruolo TEXT DEFAULT 'user'
+            ruolo TEXT DEFAULT 'user',
+            shard INTEGER
         )
     ''')
 
@@ -52,14 +71,100 @@ def setup_database(db_name='nutrizione.db'):
         cursor.execute("ALTER TABLE utenti ADD COLUMN ruolo TEXT DEFAULT 'user'")
     if "sesso" not in utenti_columns:
         cursor.execute("ALTER TABLE utenti ADD COLUMN sesso TEXT NOT NULL DEFAULT 'M'")
+    if "shard" not in utenti_columns:
+        cursor.execute("ALTER TABLE utenti ADD COLUMN shard INTEGER")
 
-    cursor.execute('''
+    crea_tabelle_diete(cursor)
+    _migra_revisione_diete(cursor)
+    _migra_dettaglio_pasti_senza_fk_alimenti(conn)
+
+    # Migrazione: totali macro materializzati su pasti e diete (ricalcolati sotto se aggiunti ora).
+    totali_aggiunti = False
+    for tabella in ("pasti", "diete"):
+        cursor.execute(f"PRAGMA table_info({tabella})")
+        colonne = {row[1] for row in cursor.fetchall()}
+        for colonna in COLONNE_TOTALI:
+            if colonna not in colonne:
+                cursor.execute(f"ALTER TABLE {tabella} ADD COLUMN {colonna} REAL NOT NULL DEFAULT 0")
+                totali_aggiunti = True
+
+    crea_indici_diete(cursor)
+
+    if totali_aggiunti:
+        ricalcola_totali_nutrizionali(cursor)
+
+    # Se non esistono utenti, crea l'admin di default per il primo accesso.
+    cursor.execute("SELECT COUNT(*) FROM utenti")
+    utenti_count = cursor.fetchone()[0]
+    if utenti_count == 0:
+        from security import hash_password
+
+        admin_password_hash = hash_password("admin123")
+        cursor.execute(
+            """
+            INSERT INTO utenti (nome, email, password_hash, ruolo)
+            VALUES (?, ?, ?, ?)
+            """,
+            ("Admin", "admin@admin.com", admin_password_hash, "admin"),
+        )
+    conn.commit()
+    return conn
+
+
+def setup_shard(percorso, factory=sqlite3.Connection, primo_id=1):
+    """
+    Crea (se non esistono) le tabelle delle diete in un DB shard e ritorna la connessione.
+    Gli id generati nello shard partono da ``primo_id``, cosi' restano unici tra tutti i DB.
+    Il catalogo non e' nello shard: va collegato in sola lettura sulla connessione.
+    """
+    conn = sqlite3.connect(
+        percorso,
+        uri=True,
+        factory=factory,
+        check_same_thread=False,
+        timeout=BUSY_TIMEOUT_S,
+    )
+    for pragma in PRAGMA_CONNESSIONE:
+        conn.execute(pragma)
+    cursor = conn.cursor()
+    # Utenti e catalogo vivono in altri DB: niente foreign key verso di loro.
+    crea_tabelle_diete(cursor, vincoli_esterni=False)
+    _migra_revisione_diete(cursor)
+    crea_indici_diete(cursor)
+    # Solo alla creazione: una connessione su uno shard esistente non deve scrivere.
+    cursor.execute("SELECT name FROM sqlite_sequence")
+    tabelle_inizializzate = {row[0] for row in cursor.fetchall()}
+    for tabella in TABELLE_DIETE_AUTOINCREMENT:
+        if tabella not in tabelle_inizializzate:
+            cursor.execute(
+                "INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (tabella, primo_id - 1)
+            )
+    conn.commit()
+    return conn
+
+
+def crea_tabelle_diete(cursor, vincoli_esterni=True):
+    """
+    Crea le tabelle di proprieta' degli utenti: diete (diete, pasti, dettaglio_pasti),
+    ricette (ricette, ingredienti_ricetta, valori_ricette) e diario alimentare
+    (diario_alimenti, riepiloghi_diario).
+    Con ``vincoli_esterni=False`` omette le foreign key verso utenti (DB shard).
+
+    ``dettaglio_pasti.codice_alimento`` puo' essere un alimento del catalogo o il codice
+    di una ricetta: non ha foreign key, i codici sono validati prima della scrittura.
+    """
+    fk_utenti = ",\n            FOREIGN KEY (utente_id) REFERENCES utenti (id)" if vincoli_esterni else ""
+    cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS diete (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             utente_id INTEGER,
             nome_dieta TEXT,
             data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (utente_id) REFERENCES utenti (id)
+            totale_kcal REAL NOT NULL DEFAULT 0,
+            totale_proteine REAL NOT NULL DEFAULT 0,
+            totale_carboidrati REAL NOT NULL DEFAULT 0,
+            totale_grassi REAL NOT NULL DEFAULT 0,
+            revisione INTEGER NOT NULL DEFAULT 1{fk_utenti}
         )
     ''')
 
@@ -70,6 +175,10 @@ def setup_database(db_name='nutrizione.db'):
             giorno_settimana INTEGER CHECK(giorno_settimana BETWEEN 1 AND 7),
             nome_pasto TEXT,
             ordine INTEGER,
+            totale_kcal REAL NOT NULL DEFAULT 0,
+            totale_proteine REAL NOT NULL DEFAULT 0,
+            totale_carboidrati REAL NOT NULL DEFAULT 0,
+            totale_grassi REAL NOT NULL DEFAULT 0,
             FOREIGN KEY (dieta_id) REFERENCES diete (id)
         )
     ''')
@@ -80,25 +189,359 @@ def setup_database(db_name='nutrizione.db'):
             pasto_id INTEGER,
             codice_alimento TEXT,
             quantita_grammi INTEGER,
-            FOREIGN KEY (pasto_id) REFERENCES pasti (id),
-            FOREIGN KEY (codice_alimento) REFERENCES alimenti (codice_alimento)
+            FOREIGN KEY (pasto_id) REFERENCES pasti (id)
         )
     ''')
 
-    # Se non esistono utenti, crea l'admin di default per il primo accesso.
-    cursor.execute("SELECT COUNT(*) FROM utenti")
-    utenti_count = cursor.fetchone()[0]
-    if utenti_count == 0:
-        admin_password_hash = pwd_context.hash("admin123")
-        cursor.execute(
-            """
-            INSERT INTO utenti (nome, email, password_hash, ruolo)
-            VALUES (?, ?, ?, ?)
-            """,
-            ("Admin", "admin@admin.com", admin_password_hash, "admin"),
+    # Ricette: il vettore per 100g (valori_ricette) e' calcolato al salvataggio.
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS ricette (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            utente_id INTEGER,
+            codice TEXT UNIQUE,
+            nome TEXT,
+            grammi_totali REAL NOT NULL,
+            data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP{fk_utenti}
         )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ingredienti_ricetta (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ricetta_id INTEGER,
+            codice_alimento TEXT,
+            grammi REAL,
+            FOREIGN KEY (ricetta_id) REFERENCES ricette (id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS valori_ricette (
+            codice_ricetta TEXT,
+            nutriente TEXT,
+            valore_100g REAL,
+            PRIMARY KEY (codice_ricetta, nutriente)
+        ) WITHOUT ROWID
+    ''')
+
+    # Diario di quanto mangiato davvero, in sola aggiunta: le correzioni sono voci con
+    # grammi negativi. ``data`` e' ISO (YYYY-MM-DD).
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS diario_alimenti (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            utente_id INTEGER,
+            data TEXT NOT NULL,
+            nome_pasto TEXT,
+            codice_alimento TEXT,
+            quantita_grammi REAL NOT NULL,
+            registrato_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP{fk_utenti}
+        )
+    ''')
+
+    # Totali per nutriente del diario per giorno, settimana (dal lunedi') e mese,
+    # aggiornati a ogni registrazione. ``inizio`` e' il primo giorno del periodo.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS riepiloghi_diario (
+            utente_id INTEGER,
+            periodo TEXT CHECK(periodo IN ('giorno', 'settimana', 'mese')),
+            inizio TEXT,
+            nutriente TEXT,
+            totale REAL NOT NULL,
+            PRIMARY KEY (utente_id, periodo, inizio, nutriente)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _migra_revisione_diete(cursor):
+    """Migrazione: numero di revisione delle diete (ETag delle risposte)."""
+    cursor.execute("PRAGMA table_info(diete)")
+    if "revisione" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE diete ADD COLUMN revisione INTEGER NOT NULL DEFAULT 1")
+
+
+def _migra_dettaglio_pasti_senza_fk_alimenti(conn):
+    """
+    Migrazione: ricrea ``dettaglio_pasti`` senza la foreign key verso ``alimenti``
+    (che rifiuterebbe i codici delle ricette), mantenendo righe, id e sequenza.
+    """
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA foreign_key_list(dettaglio_pasti)")
+    if not any(row[2] == "alimenti" for row in cursor.fetchall()):
+        return
+
     conn.commit()
-    return conn
+    # Va disattivato fuori transazione, altrimenti il DROP verificherebbe le foreign key.
+    cursor.execute("PRAGMA foreign_keys = OFF")
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        # Un altro processo puo' aver completato la migrazione nel frattempo.
+        cursor.execute("PRAGMA foreign_key_list(dettaglio_pasti)")
+        if not any(row[2] == "alimenti" for row in cursor.fetchall()):
+            conn.rollback()
+            return
+        cursor.execute("ALTER TABLE dettaglio_pasti RENAME TO dettaglio_pasti_migrazione")
+        crea_tabelle_diete(cursor)
+        cursor.execute('''
+            INSERT INTO dettaglio_pasti (id, pasto_id, codice_alimento, quantita_grammi)
+            SELECT id, pasto_id, codice_alimento, quantita_grammi FROM dettaglio_pasti_migrazione
+        ''')
+        cursor.execute('''
+            UPDATE sqlite_sequence
+            SET seq = (SELECT seq FROM sqlite_sequence WHERE name = 'dettaglio_pasti_migrazione')
+            WHERE name = 'dettaglio_pasti'
+        ''')
+        cursor.execute("DROP TABLE dettaglio_pasti_migrazione")
+        crea_indici_diete(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("PRAGMA foreign_keys = ON")
+
+
+def ricalcola_valori_ricette(cursor, ricetta_ids=None):
+    """
+    Ricalcola il vettore per 100g delle ricette indicate (tutte se ricetta_ids e' None)
+    dai valori del catalogo degli ingredienti. Non esegue commit.
+    """
+    if ricetta_ids is not None:
+        ricetta_ids = sorted(set(ricetta_ids))
+        if not ricetta_ids:
+            return
+        blocchi = [ricetta_ids[i:i + 500] for i in range(0, len(ricetta_ids), 500)]
+    else:
+        blocchi = [None]
+
+    for blocco in blocchi:
+        filtro, parametri = "", ()
+        if blocco is not None:
+            filtro = f"WHERE r.id IN ({', '.join('?' for _ in blocco)})"
+            parametri = tuple(blocco)
+        cursor.execute(f'''
+            DELETE FROM valori_ricette
+            WHERE codice_ricetta IN (SELECT r.codice FROM ricette r {filtro})
+        ''', parametri)
+        cursor.execute(f'''
+            INSERT INTO valori_ricette (codice_ricetta, nutriente, valore_100g)
+            SELECT codice, nutriente, SUM(grammi * valore) / grammi_totali
+            FROM (
+                -- Righe ripetute per (alimento, nutriente) contano una volta, con il valore massimo.
+                SELECT r.id AS ricetta_id, r.codice, r.grammi_totali, i.grammi, v.nutriente,
+                       MAX(CAST(REPLACE(v.valore_100g, ',', '.') AS REAL)) AS valore
+                FROM ricette r
+                JOIN ingredienti_ricetta i ON i.ricetta_id = r.id
+                JOIN valori_nutrizionali v ON v.codice_alimento = i.codice_alimento
+                {filtro}
+                GROUP BY i.id, v.nutriente
+            )
+            GROUP BY ricetta_id, nutriente
+        ''', parametri)
+
+
+def ricalcola_riepiloghi_diario(cursor, utente_id=None):
+    """
+    Ricostruisce dal diario i riepiloghi dell'utente (di tutti se utente_id e' None)
+    con i valori correnti del catalogo e delle ricette. Non esegue commit.
+    """
+    filtro, filtro_diario, parametri = "", "", ()
+    if utente_id is not None:
+        filtro, filtro_diario, parametri = "WHERE utente_id = ?", "WHERE d.utente_id = ?", (utente_id,)
+    cursor.execute(f"DELETE FROM riepiloghi_diario {filtro}", parametri)
+    cursor.execute(f'''
+        INSERT INTO riepiloghi_diario (utente_id, periodo, inizio, nutriente, totale)
+        SELECT utente_id, 'giorno', data, nutriente, SUM(totale)
+        FROM (
+            -- Righe ripetute per (alimento, nutriente) contano una volta, con il valore massimo
+            -- (come i vettori usati da registra_diario).
+            SELECT d.utente_id, d.data, v.nutriente,
+                   d.quantita_grammi * MAX(CAST(REPLACE(v.valore_100g, ',', '.') AS REAL)) / 100.0 AS totale
+            FROM diario_alimenti d
+            JOIN valori_nutrizionali v ON v.codice_alimento = d.codice_alimento
+            {filtro_diario}
+            GROUP BY d.id, v.nutriente
+            UNION ALL
+            SELECT d.utente_id, d.data, v.nutriente, d.quantita_grammi * v.valore_100g / 100.0
+            FROM diario_alimenti d
+            JOIN valori_ricette v ON v.codice_ricetta = d.codice_alimento
+            {filtro_diario}
+        )
+        GROUP BY utente_id, data, nutriente
+    ''', parametri * 2)
+    # Settimane e mesi si ottengono dai giorni (lunedi' = strftime('%w') 1).
+    inizio_periodo = {
+        "settimana": "date(inizio, '-' || ((CAST(strftime('%w', inizio) AS INTEGER) + 6) % 7) || ' days')",
+        "mese": "strftime('%Y-%m-01', inizio)",
+    }
+    for periodo, espressione in inizio_periodo.items():
+        cursor.execute(f'''
+            INSERT INTO riepiloghi_diario (utente_id, periodo, inizio, nutriente, totale)
+            SELECT utente_id, ?, {espressione} AS inizio_periodo, nutriente, SUM(totale)
+            FROM riepiloghi_diario
+            WHERE periodo = 'giorno' {"AND utente_id = ?" if utente_id is not None else ""}
+            GROUP BY utente_id, inizio_periodo, nutriente
+        ''', (periodo, *parametri))
+
+
+def ricalcola_totali_nutrizionali(cursor, dieta_ids=None):
+    """
+    Ricalcola i totali macro materializzati dei pasti e delle diete indicate
+    (tutte se dieta_ids e' None) e ne incrementa la revisione. Il ricalcolo completo
+    ricostruisce anche vettori delle ricette e riepiloghi del diario. Non esegue commit:
+    va chiamata nella transazione della scrittura che ha modificato i dati.
+    """
+    if dieta_ids is not None:
+        dieta_ids = sorted(set(dieta_ids))
+        if not dieta_ids:
+            return
+        blocchi = [dieta_ids[i:i + 500] for i in range(0, len(dieta_ids), 500)]
+    else:
+        # Ricalcolo completo (es. nuovo catalogo): prima i vettori delle ricette, che
+        # servono anche ai riepiloghi del diario.
+        ricalcola_valori_ricette(cursor)
+        ricalcola_riepiloghi_diario(cursor)
+        blocchi = [None]
+
+    cursor.execute("SELECT 1 FROM valori_ricette LIMIT 1")
+    con_ricette = cursor.fetchone() is not None
+
+    valori_voce = ", ".join(
+        f"MAX(CASE WHEN v.nutriente = '{nutriente}' "
+        f"THEN CAST(REPLACE(v.valore_100g, ',', '.') AS REAL) END) AS {colonna}"
+        for nutriente, colonna in NUTRIENTI_TOTALI.items()
+    )
+    somme_pasto = ", ".join(
+        f"COALESCE(SUM(voci.quantita_grammi * voci.{colonna}), 0) / 100.0" for colonna in COLONNE_TOTALI
+    )
+    somme_ricette = ", ".join(
+        f"pasti.{colonna} + COALESCE(SUM(CASE WHEN v.nutriente = '{nutriente}' "
+        f"THEN dp.quantita_grammi * v.valore_100g END), 0) / 100.0"
+        for nutriente, colonna in NUTRIENTI_TOTALI.items()
+    )
+    somme_dieta = ", ".join(f"COALESCE(SUM({colonna}), 0)" for colonna in COLONNE_TOTALI)
+    nutrienti_placeholders = ", ".join("?" for _ in NUTRIENTI_TOTALI)
+
+    for blocco in blocchi:
+        filtro_pasti, filtro_diete, filtro_ricette, parametri = "", "", "", ()
+        if blocco is not None:
+            placeholders = ", ".join("?" for _ in blocco)
+            filtro_pasti = f"WHERE dieta_id IN ({placeholders})"
+            filtro_diete = f"WHERE id IN ({placeholders})"
+            filtro_ricette = f"AND dieta_id IN ({placeholders})"
+            parametri = tuple(blocco)
+
+        cursor.execute(f'''
+            UPDATE pasti
+            SET ({", ".join(COLONNE_TOTALI)}) = (
+                SELECT {somme_pasto}
+                -- Una riga per voce: le righe ripetute del catalogo valgono la massima, come
+                -- in vettori delle ricette, riepiloghi e catalogo in memoria.
+                FROM (
+                    SELECT dp.quantita_grammi, {valori_voce}
+                    FROM dettaglio_pasti dp
+                    JOIN valori_nutrizionali v
+                      ON v.codice_alimento = dp.codice_alimento
+                     AND v.nutriente IN ({nutrienti_placeholders})
+                    WHERE dp.pasto_id = pasti.id
+                    GROUP BY dp.id
+                ) voci
+            )
+            {filtro_pasti}
+        ''', (*NUTRIENTI_TOTALI, *parametri))
+        if con_ricette:
+            # Le ricette nei pasti contano con il loro vettore precalcolato (una riga, non N ingredienti).
+            cursor.execute(f'''
+                UPDATE pasti
+                SET ({", ".join(COLONNE_TOTALI)}) = (
+                    SELECT {somme_ricette}
+                    FROM dettaglio_pasti dp
+                    JOIN valori_ricette v
+                      ON v.codice_ricetta = dp.codice_alimento
+                     AND v.nutriente IN ({nutrienti_placeholders})
+                    WHERE dp.pasto_id = pasti.id
+                )
+                WHERE id IN (
+                    SELECT dp.pasto_id
+                    FROM dettaglio_pasti dp
+                    JOIN ricette r ON r.codice = dp.codice_alimento
+                )
+                {filtro_ricette}
+            ''', (*NUTRIENTI_TOTALI, *parametri))
+        cursor.execute(f'''
+            UPDATE diete
+            SET ({", ".join(COLONNE_TOTALI)}) = (
+                SELECT {somme_dieta}
+                FROM pasti
+                WHERE pasti.dieta_id = diete.id
+            ),
+            revisione = revisione + 1
+            {filtro_diete}
+        ''', parametri)
+
+
+def crea_tabelle_catalogo(cursor):
+    """Crea le tabelle del catalogo alimenti e i relativi indici."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS alimenti (
+            codice_alimento TEXT PRIMARY KEY,
+            nome TEXT,
+            categoria TEXT,
+            nome_scientifico TEXT,
+            english_name TEXT,
+            parte_edibile TEXT,
+            porzione TEXT
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS valori_nutrizionali (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codice_alimento TEXT,
+            macrocategoria TEXT,
+            nutriente TEXT,
+            unita_misura TEXT,
+            valore_100g TEXT,
+            valore_porzione TEXT,
+            FOREIGN KEY (codice_alimento) REFERENCES alimenti (codice_alimento)
+        )
+        ''')
+    crea_indici_catalogo(cursor)
+
+
+def crea_indici_catalogo(cursor):
+    """Crea gli indici sulle tabelle del catalogo (idempotente)."""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_valori_nutrizionali_alimento
+        ON valori_nutrizionali (codice_alimento, nutriente)
+    ''')
+
+
+def elimina_indici_catalogo(cursor):
+    """Rimuove gli indici del catalogo (usato prima dei caricamenti massivi)."""
+    cursor.execute('DROP INDEX IF EXISTS idx_valori_nutrizionali_alimento')
+
+
+def crea_indici_diete(cursor):
+    """Crea gli indici sulle tabelle delle diete (idempotente)."""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_diete_utente ON diete (utente_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_pasti_dieta ON pasti (dieta_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_dettaglio_pasti_pasto ON dettaglio_pasti (pasto_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ricette_utente ON ricette (utente_id)')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_ingredienti_ricetta ON ingredienti_ricetta (ricetta_id)'
+    )
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_diario_utente_data ON diario_alimenti (utente_id, data)')
+
+
+def elimina_indici_diete(cursor):
+    """Rimuove gli indici delle diete (usato prima dei caricamenti massivi)."""
+    cursor.execute('DROP INDEX IF EXISTS idx_diete_utente')
+    cursor.execute('DROP INDEX IF EXISTS idx_pasti_dieta')
+    cursor.execute('DROP INDEX IF EXISTS idx_dettaglio_pasti_pasto')
+    cursor.execute('DROP INDEX IF EXISTS idx_ricette_utente')
+    cursor.execute('DROP INDEX IF EXISTS idx_ingredienti_ricetta')
+    cursor.execute('DROP INDEX IF EXISTS idx_diario_utente_data')
+
 
 def salva_dati(conn, anagrafica, valori):
     """Salva l'anagrafica e i relativi valori nutrizionali nel DB."""
@@ -0,0 +1,143 @@
+"""
+Esecutore delle letture per gli endpoint ``async``.
+
+Gli endpoint di sola lettura piu' frequenti sono ``async def``: mentre attendono il DB
+non occupano un thread del threadpool di Starlette. La lettura viene accodata a un pool
+dedicato di thread lettori, ognuno con una connessione persistente per DB (principale e
+shard) e il catalogo collegato, riallineato allo snapshot attivo come nel writer
+(``CodaScritture``). Cosi' un worker tiene in volo molte richieste con pochi thread e
+senza riaprire il DB (``setup_database``) a ogni richiesta.
+
+La coda e' esplicita e limitata: oltre ``LETTURE_IN_CODA_MAX`` letture in attesa o in
+corso ``esegui`` rilancia ``CodaLetturePiena`` (503 per l'API) invece di accumulare
+latenza. Il tempo di attesa in coda e' registrato nella fase ``coda_letture``.
+
+Con ``LETTURE_MODALITA=threadpool`` ogni lettura apre una connessione nel threadpool di
+Starlette, come gli endpoint sincroni: serve a confrontare le due modalita' con
+``benchmark.py --modalita-letture``.
+"""
+import asyncio
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+from starlette.concurrency import run_in_threadpool
+
+from catalogo_snapshot import CatalogoCollegato
+from metriche import registra_durata
+from shard_diete import RouterShard
+
+LETTORI_SQLITE = int(os.environ.get("LETTORI_SQLITE", "8"))
+LETTURE_IN_CODA_MAX = int(os.environ.get("LETTURE_IN_CODA_MAX", "512"))
+MODALITA_LETTURE = ("lettori", "threadpool")
+MODALITA_PREDEFINITA = os.environ.get("LETTURE_MODALITA", "lettori")
+
+
+class CodaLetturePiena(RuntimeError):
+    """Troppe letture in attesa: la richiesta va rifiutata e ripetuta piu' tardi."""
+
+
+class EsecutoreLetture:
+    """
+    Esegue funzioni di sola lettura ``funzione(conn, *args)`` (es. quelle di crud_manager)
+    sul DB indicato da ``shard`` e ne restituisce il risultato a chi le attende con ``await``.
+    """
+
+    def __init__(
+        self,
+        router: RouterShard,
+        lettori: int = LETTORI_SQLITE,
+        massimo_in_coda: int = LETTURE_IN_CODA_MAX,
+        modalita: str = MODALITA_PREDEFINITA,
+    ) -> None:
+        if modalita not in MODALITA_LETTURE:
+            raise ValueError(f"Modalita' di lettura sconosciuta: {modalita}")
+        self.router = router
+        self.lettori = lettori
+        self.massimo_in_coda = massimo_in_coda
+        self.modalita = modalita
+        self._executor = self._nuovo_executor()
+        self._locale = threading.local()
+        self._lock = threading.Lock()
+        self._in_coda = 0
+        self._connessioni: list[sqlite3.Connection] = []
+
+    async def esegui(
+        self, funzione: Callable[..., Any], *args: Any, shard: int | None = None, **kwargs: Any
+    ) -> Any:
+        """Accoda la lettura e ne attende il risultato (o rilancia l'errore)."""
+        if self.modalita == "threadpool":
+            return await run_in_threadpool(self._esegui_connessione_nuova, shard, funzione, args, kwargs)
+
+        with self._lock:
+            if self._in_coda >= self.massimo_in_coda:
+                raise CodaLetturePiena(f"Piu' di {self.massimo_in_coda} letture in coda")
+            self._in_coda += 1
+        # Il contesto del chiamante (es. statistiche della richiesta) segue la lettura nel thread.
+        contesto = contextvars.copy_context()
+        try:
+            futuro = self._executor.submit(
+                contesto.run, self._esegui, time.perf_counter(), shard, funzione, args, kwargs
+            )
+        except BaseException:
+            self._rilascia()
+            raise
+        # Rilasciato a lettura conclusa, anche se chi attende e' stato cancellato.
+        futuro.add_done_callback(self._rilascia)
+        return await asyncio.wrap_future(futuro)
+
+    def _nuovo_executor(self) -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(max_workers=self.lettori, thread_name_prefix="lettore-sqlite")
+
+    def _rilascia(self, _futuro: Future | None = None) -> None:
+        with self._lock:
+            self._in_coda -= 1
+
+    def _esegui(
+        self, accodata: float, shard: int | None, funzione: Callable[..., Any], args: tuple, kwargs: dict
+    ) -> Any:
+        registra_durata("coda_letture", time.perf_counter() - accodata)
+        conn, catalogo = self._connessione(shard)
+        try:
+            with self.router.snapshot_attivo() as snapshot:
+                catalogo.allinea(snapshot)
+                return funzione(conn, *args, **kwargs)
+        finally:
+            # La connessione resta al thread: nessuna transazione deve restare aperta.
+            if conn.in_transaction:
+                conn.rollback()
+
+    def _connessione(self, shard: int | None) -> tuple[sqlite3.Connection, CatalogoCollegato]:
+        """Connessione del thread corrente al DB dello ``shard``, aperta al primo uso."""
+        connessioni = getattr(self._locale, "connessioni", None)
+        if connessioni is None:
+            connessioni = self._locale.connessioni = {}
+        voce = connessioni.get(shard)
+        if voce is None:
+            conn = self.router.apri(shard)
+            voce = connessioni[shard] = (conn, CatalogoCollegato(conn, self.router.catalogo_principale(shard)))
+            with self._lock:
+                self._connessioni.append(conn)
+        return voce
+
+    def _esegui_connessione_nuova(
+        self, shard: int | None, funzione: Callable[..., Any], args: tuple, kwargs: dict
+    ) -> Any:
+        with self.router.connessione(shard) as conn:
+            return funzione(conn, *args, **kwargs)
+
+    def chiudi(self) -> None:
+        """
+        Attende le letture in corso e chiude le connessioni dei lettori; le letture
+        successive partono con nuovi thread e nuove connessioni.
+        """
+        executor, self._executor = self._executor, self._nuovo_executor()
+        executor.shutdown(wait=True)
+        with self._lock:
+            connessioni, self._connessioni = self._connessioni, []
+        for conn in connessioni:
+            conn.close()
@@ -0,0 +1,150 @@
+"""
+Export in streaming delle diete (NDJSON o CSV).
+
+Le righe sono lette con un unico cursore in ordine di id (dieta, pasto, dettaglio),
+ordine che SQLite ottiene dagli indici senza sort temporanei, e consumate a blocchi
+con ``fetchmany``: in memoria resta al piu' una dieta alla volta, qualunque sia la
+dimensione del DB. L'output e' prodotto a chunk di testo adatti a una StreamingResponse.
+"""
+import csv
+import io
+import json
+import sqlite3
+from typing import Iterator
+
+from crud_manager import _totali_materializzati
+from database import COLONNE_TOTALI
+
+DIMENSIONE_FETCH = 1000
+DIMENSIONE_CHUNK = 64 * 1024
+CAMPI_CSV = (
+    "dieta_id",
+    "utente_id",
+    "nome_dieta",
+    "data_creazione",
+    "giorno_settimana",
+    "pasto_id",
+    "nome_pasto",
+    "ordine",
+    "codice_alimento",
+    "nome_alimento",
+    "quantita_grammi",
+)
+
+
+def itera_diete(conn: sqlite3.Connection, utente_id: int | None = None) -> Iterator[dict]:
+    """
+    Produce una dieta completa alla volta (tutte, o solo quelle di ``utente_id``),
+    con i pasti ordinati per giorno e ordine come in ``ottieni_dieta_completa``.
+    """
+    filtro = "WHERE d.utente_id = ?" if utente_id is not None else ""
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""
+        SELECT d.id, d.utente_id, d.nome_dieta, d.data_creazione,
+               {", ".join(f"d.{colonna}" for colonna in COLONNE_TOTALI)},
+               p.id, p.giorno_settimana, p.nome_pasto, p.ordine,
+               dp.codice_alimento, COALESCE(a.nome, r.nome), dp.quantita_grammi
+        FROM diete d
+        LEFT JOIN pasti p ON p.dieta_id = d.id
+        LEFT JOIN dettaglio_pasti dp ON dp.pasto_id = p.id
+        LEFT JOIN alimenti a ON a.codice_alimento = dp.codice_alimento
+        LEFT JOIN ricette r ON r.codice = dp.codice_alimento
+        {filtro}
+        ORDER BY d.id, p.id, dp.id
+        """,
+        (utente_id,) if utente_id is not None else (),
+    )
+
+    n_totali = len(COLONNE_TOTALI)
+    dieta: dict | None = None
+    pasti: dict[int, dict] = {}
+    while righe := cursor.fetchmany(DIMENSIONE_FETCH):
+        for riga in righe:
+            dieta_id, utente, nome_dieta, data_creazione = riga[:4]
+            pasto_id, giorno, nome_pasto, ordine, codice, nome_alimento, grammi = riga[4 + n_totali:]
+            if dieta is None or dieta["id"] != dieta_id:
+                if dieta is not None:
+                    yield _completa_dieta(dieta, pasti)
+                dieta = {
+                    "id": dieta_id,
+                    "utente_id": utente,
+                    "nome_dieta": nome_dieta,
+                    "data_creazione": data_creazione,
+                    "totali": _totali_materializzati(riga[4:4 + n_totali]),
+                }
+                pasti = {}
+            if pasto_id is None:
+                continue
+            pasto = pasti.get(pasto_id)
+            if pasto is None:
+                pasto = pasti[pasto_id] = {
+                    "id": pasto_id,
+                    "giorno_settimana": giorno,
+                    "nome_pasto": nome_pasto,
+                    "ordine": ordine,
+                    "alimenti": [],
+                }
+            if codice is not None:
+                pasto["alimenti"].append(
+                    {"codice_alimento": codice, "nome": nome_alimento or codice, "grammi": grammi}
+                )
+    if dieta is not None:
+        yield _completa_dieta(dieta, pasti)
+
+
+def _completa_dieta(dieta: dict, pasti: dict[int, dict]) -> dict:
+    dieta["pasti"] = sorted(
+        pasti.values(), key=lambda p: (p["giorno_settimana"], p["ordine"] or 0, p["id"])
+    )
+    return dieta
+
+
+def esporta_ndjson(conn: sqlite3.Connection, utente_id: int | None = None) -> Iterator[str]:
+    """Una riga JSON per dieta, raggruppate in chunk di circa ``DIMENSIONE_CHUNK`` caratteri."""
+    buffer: list[str] = []
+    dimensione = 0
+    for dieta in itera_diete(conn, utente_id):
+        riga = json.dumps(dieta, ensure_ascii=False, separators=(",", ":")) + "\n"
+        buffer.append(riga)
+        dimensione += len(riga)
+        if dimensione >= DIMENSIONE_CHUNK:
+            yield "".join(buffer)
+            buffer, dimensione = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def esporta_csv(
+    conn: sqlite3.Connection,
+    utente_id: int | None = None,
+    intestazione: bool = True,
+) -> Iterator[str]:
+    """
+    Una riga per alimento (pasti senza alimenti e diete senza pasti hanno i campi
+    vuoti), con intestazione ``CAMPI_CSV`` (omessa accodando l'export di un altro shard).
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if intestazione:
+        writer.writerow(CAMPI_CSV)
+    for dieta in itera_diete(conn, utente_id):
+        campi_dieta = (dieta["id"], dieta["utente_id"], dieta["nome_dieta"], dieta["data_creazione"])
+        if not dieta["pasti"]:
+            writer.writerow(campi_dieta + ("",) * 7)
+        for pasto in dieta["pasti"]:
+            campi_pasto = (pasto["giorno_settimana"], pasto["id"], pasto["nome_pasto"], pasto["ordine"])
+            if not pasto["alimenti"]:
+                writer.writerow(campi_dieta + campi_pasto + ("",) * 3)
+            for alimento in pasto["alimenti"]:
+                writer.writerow(
+                    campi_dieta
+                    + campi_pasto
+                    + (alimento["codice_alimento"], alimento["nome"], alimento["grammi"])
+                )
+        if buffer.tell() >= DIMENSIONE_CHUNK:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -88,6 +88,9 @@ function Dashboard() {
               <article key={dieta.id} style={styles.card}>
                 <h2 style={styles.cardTitle}>{dieta.nome_dieta}</h2>
                 <p style={styles.cardMeta}>Creata: {dieta.data_creazione}</p>
+                <p style={styles.cardMeta}>
+                  Totale settimanale: {Math.round(dieta.totali?.kcal ?? 0)} kcal
+                </p>
                 <div style={styles.cardActions}>
                   <button
                     type="button"
@@ -0,0 +1,61 @@
+import api from "./api";
+
+const RISULTATI_RICERCA = 20;
+
+let catalogoPromise = null;
+
+function decodificaBundle(bundle) {
+  const macro = bundle.nutrienti.map((nutriente) => nutriente[2]);
+  const alimenti = bundle.alimenti.map(([codice, nome, categoria, valori]) => {
+    const alimento = {
+      codice_alimento: codice,
+      nome,
+      categoria: bundle.categorie[categoria],
+      kcal: 0,
+      proteine: 0,
+      carboidrati: 0,
+      grassi: 0,
+    };
+    for (let i = 0; i < valori.length; i += 2) {
+      const chiave = macro[valori[i]];
+      if (chiave) {
+        alimento[chiave] = valori[i + 1];
+      }
+    }
+    return alimento;
+  });
+  alimenti.sort((a, b) => (a.nome < b.nome ? -1 : a.nome > b.nome ? 1 : 0));
+  return { versione: bundle.versione_catalogo, alimenti };
+}
+
+// Il bundle e' rivalidato dal browser con l'ETag: scaricato di nuovo solo se cambia il catalogo.
+export function caricaCatalogo() {
+  if (!catalogoPromise) {
+    catalogoPromise = api
+      .get("/catalogo/bundle")
+      .then((response) => decodificaBundle(response.data))
+      .catch((err) => {
+        catalogoPromise = null;
+        throw err;
+      });
+  }
+  return catalogoPromise;
+}
+
+// Stessa semantica di /api/alimenti/search: sottostringa su nome o categoria, ordine per nome.
+export function cercaAlimentiLocale(catalogo, query) {
+  const chiave = query.trim().toLowerCase();
+  const risultati = [];
+  for (const alimento of catalogo.alimenti) {
+    if (
+      (alimento.nome || "").toLowerCase().includes(chiave) ||
+      (alimento.categoria || "").toLowerCase().includes(chiave)
+    ) {
+      risultati.push(alimento);
+      if (risultati.length >= RISULTATI_RICERCA) {
+        break;
+      }
+    }
+  }
+  return risultati;
+}
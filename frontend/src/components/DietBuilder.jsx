@@ -1,4 +1,4 @@
-import { useEffect, useMemo, useState } from "react";
+import { useEffect, useMemo, useRef, useState } from "react";
 import { DragDropContext, Draggable, Droppable } from "@hello-pangea/dnd";
 import { Cell, Pie, PieChart, ResponsiveContainer, Tooltip } from "recharts";
 import { useNavigate, useParams } from "react-router-dom";
@@ -9,6 +9,8 @@ import api, {
   calcolaMicroGiornalieri,
   salvaDietaCompleta,
 } from "../api";
+import { caricaCatalogo, cercaAlimentiLocale } from "../catalogo";
+import { apriSessioneLive } from "../sessioneLive";
 import "./DietBuilder.css";
 
 const DAY_NAMES = [
@@ -80,6 +82,41 @@ function getMicroProgressColor(percentuale) {
   return { className: "bg-green-500", color: "#22c55e" };
 }
 
+// Assegna a pasti e alimenti gli id della sessione live (pasto_id e voce), che il server
+// numera nello stesso ordine di /completa; null se il piano non corrisponde alla sessione.
+function allineaSessioneLive(weekPlan, stato) {
+  const pastiPerGiorno = DAY_NAMES.map(() => []);
+  stato.pasti.forEach((pasto) => pastiPerGiorno[pasto.giorno_settimana - 1].push(pasto));
+
+  let allineato = true;
+  const piano = weekPlan.map((day, dayIndex) => {
+    const pastiSessione = pastiPerGiorno[dayIndex];
+    if (pastiSessione.length !== day.meals.length) {
+      allineato = false;
+      return day;
+    }
+    return {
+      ...day,
+      meals: day.meals.map((meal, mealIndex) => {
+        const pasto = pastiSessione[mealIndex];
+        const stessiAlimenti =
+          pasto.alimenti.length === meal.foods.length &&
+          pasto.alimenti.every((alimento, i) => alimento.codice_alimento === meal.foods[i].codice_alimento);
+        if (!stessiAlimenti) {
+          allineato = false;
+          return meal;
+        }
+        return {
+          ...meal,
+          pastoLive: pasto.id,
+          foods: meal.foods.map((food, i) => ({ ...food, voce: pasto.alimenti[i].voce })),
+        };
+      }),
+    };
+  });
+  return allineato ? piano : null;
+}
+
 function DietBuilder() {
   const navigate = useNavigate();
   const { id } = useParams();
@@ -102,6 +139,11 @@ function DietBuilder() {
   const [showMicroOverlay, setShowMicroOverlay] = useState(false);
   const [microData, setMicroData] = useState(null);
   const [isMicroLoading, setIsMicroLoading] = useState(false);
+  // Con una dieta salvata le modifiche vanno anche alla sessione live (WebSocket), che tiene i
+  // micronutrienti di ogni giorno: giorno (1-7) -> {nutriente: {assunto, target, percentuale}}.
+  const sessioneLive = useRef(null);
+  const weekPlanRef = useRef(weekPlan);
+  const [microLive, setMicroLive] = useState(null);
 
   const activeMeals = weekPlan[activeDay].meals;
 
@@ -163,9 +205,15 @@ function DietBuilder() {
       setIsSearching(true);
       setSearchError("");
       try {
-        const response = await api.get("/alimenti/search", { params: { q: query } });
+        let risultati;
+        try {
+          risultati = cercaAlimentiLocale(await caricaCatalogo(), query);
+        } catch (_err) {
+          const response = await api.get("/alimenti/search", { params: { q: query } });
+          risultati = response.data || [];
+        }
         if (!cancelled) {
-          setSearchResults(response.data || []);
+          setSearchResults(risultati);
         }
       } catch (_err) {
         if (!cancelled) {
@@ -218,6 +266,80 @@ function DietBuilder() {
     };
   }, [id]);
 
+  useEffect(() => {
+    weekPlanRef.current = weekPlan;
+  }, [weekPlan]);
+
+  useEffect(() => {
+    if (!id || isLoading) {
+      return;
+    }
+
+    const sessione = apriSessioneLive(id, {
+      onStato: (stato) => {
+        const piano = allineaSessioneLive(weekPlanRef.current, stato);
+        if (!piano) {
+          // Piano modificato prima dell'apertura: si resta sul calcolo via REST.
+          sessione.chiudi();
+          return;
+        }
+        sessioneLive.current = sessione;
+        setWeekPlan(piano);
+        setMicroLive(Object.fromEntries(stato.giorni.map((giorno) => [giorno.id, giorno.micro])));
+      },
+      onChiusa: () => {
+        sessioneLive.current = null;
+        setMicroLive(null);
+      },
+    });
+    return () => {
+      sessione.chiudi();
+      sessioneLive.current = null;
+      setMicroLive(null);
+    };
+  }, [id, isLoading]);
+
+  const disattivaSessioneLive = () => {
+    sessioneLive.current?.chiudi();
+    sessioneLive.current = null;
+    setMicroLive(null);
+  };
+
+  // Invia un delta alla sessione live. Se non e' applicabile (messaggio null, es. pasto non
+  // ancora noto al server) o il server lo rifiuta, piano e sessione divergerebbero: la sessione
+  // viene chiusa e i micronutrienti tornano al calcolo via REST.
+  const inviaDelta = (messaggio, onRisposta) => {
+    const sessione = sessioneLive.current;
+    if (!sessione) {
+      return;
+    }
+    const inviato =
+      messaggio &&
+      sessione.invia(messaggio, (risposta) => {
+        if (risposta.tipo === "errore") {
+          disattivaSessioneLive();
+          return;
+        }
+        if (risposta.tipo === "aggiornamento") {
+          const giorno = risposta.giorno;
+          setMicroLive((prev) => prev && { ...prev, [giorno.id]: { ...prev[giorno.id], ...giorno.micro } });
+        }
+        onRisposta?.(risposta);
+      });
+    if (!inviato) {
+      disattivaSessioneLive();
+    }
+  };
+
+  const aggiornaInPiano = (trasforma) => {
+    setWeekPlan((prev) =>
+      prev.map((day) => ({
+        ...day,
+        meals: day.meals.map((meal) => trasforma(meal)),
+      })),
+    );
+  };
+
   const toggleMeal = (mealId) => {
     setWeekPlan((prev) =>
       prev.map((day, index) =>
@@ -234,24 +356,29 @@ function DietBuilder() {
   };
 
   const handleAddMeal = () => {
+    const newMeal = {
+      id: Math.random().toString(36).slice(2),
+      name: `Pasto ${activeMeals.length + 1}`,
+      open: true,
+      foods: [],
+    };
     setWeekPlan((prev) =>
       prev.map((day, index) =>
-        index !== activeDay
-          ? day
-          : {
-              ...day,
-              meals: [
-                ...day.meals,
-                {
-                  id: Math.random().toString(36).slice(2),
-                  name: `Pasto ${day.meals.length + 1}`,
-                  open: true,
-                  foods: [],
-                },
-              ],
-            },
+        index !== activeDay ? day : { ...day, meals: [...day.meals, newMeal] },
       ),
     );
+    inviaDelta(
+      {
+        op: "aggiungi_pasto",
+        giorno_settimana: activeDay + 1,
+        nome_pasto: newMeal.name,
+        ordine: activeMeals.length + 1,
+      },
+      (risposta) =>
+        aggiornaInPiano((meal) =>
+          meal.id === newMeal.id ? { ...meal, pastoLive: risposta.pasto.id } : meal,
+        ),
+    );
   };
 
   const handleMealNameChange = (mealId, newName) => {
@@ -307,6 +434,25 @@ function DietBuilder() {
       ),
     );
     setModalOpen(false);
+
+    const pastoLive = activeMeals.find((meal) => meal.id === targetMealId)?.pastoLive;
+    inviaDelta(
+      pastoLive === undefined
+        ? null
+        : {
+            op: "aggiungi",
+            pasto_id: pastoLive,
+            codice_alimento: newFood.codice_alimento,
+            grammi: Math.round(newFood.grams),
+          },
+      (risposta) =>
+        aggiornaInPiano((meal) => ({
+          ...meal,
+          foods: meal.foods.map((food) =>
+            food.id === newFood.id ? { ...food, voce: risposta.voce.voce } : food,
+          ),
+        })),
+    );
   };
 
   const handleSelectFood = (food) => {
@@ -316,6 +462,8 @@ function DietBuilder() {
   };
 
   const rimuoviAlimento = (pastoId, indiceAlimento) => {
+    const voce = activeMeals.find((meal) => meal.id === pastoId)?.foods[indiceAlimento]?.voce;
+    inviaDelta(voce === undefined ? null : { op: "rimuovi", voce });
     setWeekPlan((prev) =>
       prev.map((day, index) =>
         index !== activeDay
@@ -484,6 +632,19 @@ function DietBuilder() {
       return;
     }
 
+    const microGiorno = microLive?.[activeDay + 1];
+    if (microGiorno) {
+      // Totali gia' aggiornati dalla sessione live: nessuna richiesta.
+      setMicroData(
+        Object.fromEntries(
+          Object.entries(microGiorno).filter(([, valori]) => Math.abs(valori.assunto) > 1e-9),
+        ),
+      );
+      setIsMicroLoading(false);
+      setShowMicroOverlay(true);
+      return;
+    }
+
     setIsMicroLoading(true);
     setShowMicroOverlay(true);
     setMicroData(null);
@@ -0,0 +1,42 @@
+import api from "./api";
+
+// Protocollo in sessione_live.py: ogni messaggio inviato riceve esattamente una risposta,
+// nell'ordine di invio; "stato" arriva da solo all'apertura della sessione.
+export function apriSessioneLive(dietaId, { onStato, onChiusa }) {
+  const token = localStorage.getItem("token") || "";
+  const base = api.defaults.baseURL.replace(/^http/, "ws");
+  const socket = new WebSocket(`${base}/diete/${dietaId}/live?token=${encodeURIComponent(token)}`);
+  const inAttesa = [];
+
+  socket.onmessage = (event) => {
+    const messaggio = JSON.parse(event.data);
+    if (messaggio.tipo === "stato") {
+      onStato(messaggio);
+      return;
+    }
+    const risposta = inAttesa.shift();
+    if (risposta) {
+      risposta(messaggio);
+    }
+  };
+  socket.onclose = () => {
+    inAttesa.length = 0;
+    onChiusa();
+  };
+
+  return {
+    // Invia un delta; false se la sessione non e' aperta (il chiamante resta sul calcolo locale).
+    invia(messaggio, onRisposta) {
+      if (socket.readyState !== WebSocket.OPEN) {
+        return false;
+      }
+      inAttesa.push(onRisposta);
+      socket.send(JSON.stringify(messaggio));
+      return true;
+    },
+    chiudi() {
+      socket.onclose = null;
+      socket.close();
+    },
+  };
+}
@@ -0,0 +1,179 @@
+"""
+Generatore di dati sintetici per test di scala.
+
+Riempie lo schema di ``database.py`` con utenti, diete settimanali, pasti e
+``dettaglio_pasti`` usando i codici reali presenti in ``alimenti``. Le righe sono
+scritte con insert a blocchi (id assegnati in anticipo, indici delle diete
+ricostruiti a fine caricamento) e la generazione e' riproducibile dato il seme.
+
+Uso:
+    python genera_dati.py --db staging.db --utenti 10000 --diete-per-utente 5 --seme 42
+"""
+import argparse
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from database import (
+    DB_PATH,
+    crea_indici_diete,
+    elimina_indici_diete,
+    ricalcola_totali_nutrizionali,
+    setup_database,
+)
+from security import hash_password
+
+DOMINIO_EMAIL = "sintetico.local"
+NOMI_PASTI = ("Colazione", "Spuntino", "Pranzo", "Merenda", "Cena", "Dopocena")
+DIMENSIONE_BATCH = 20000
+
+
+def _prossimo_id(cursor: sqlite3.Cursor, tabella: str) -> int:
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {tabella}")
+    return cursor.fetchone()[0]
+
+
+def genera_dati(
+    conn: sqlite3.Connection,
+    utenti: int,
+    diete_per_utente: int,
+    pasti_per_giorno: tuple[int, int] = (4, 5),
+    alimenti_per_pasto: tuple[int, int] = (2, 6),
+    seme: int = 42,
+    password: str = "password123",
+) -> dict:
+    """
+    Genera i dati in transazione singola e ritorna il numero di righe create per tabella.
+    Le email sono ``sintetico<id>@sintetico.local`` e tutti gli utenti hanno la stessa password.
+    """
+    rng = random.Random(seme)
+    cursor = conn.cursor()
+    cursor.execute("SELECT codice_alimento FROM alimenti ORDER BY codice_alimento")
+    codici = [row[0] for row in cursor.fetchall()]
+    if not codici:
+        raise ValueError("Il catalogo alimenti e' vuoto: importalo prima di generare i dati")
+
+    password_hash = hash_password(password)
+    oggi = datetime(2026, 1, 1)
+    conteggi = {"utenti": 0, "diete": 0, "pasti": 0, "dettaglio_pasti": 0}
+
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        elimina_indici_diete(cursor)
+        utente_id = _prossimo_id(cursor, "utenti")
+        dieta_id = primo_dieta_id = _prossimo_id(cursor, "diete")
+        pasto_id = _prossimo_id(cursor, "pasti")
+        dettaglio_id = _prossimo_id(cursor, "dettaglio_pasti")
+
+        righe_utenti, righe_diete, righe_pasti, righe_dettagli = [], [], [], []
+        for _ in range(utenti):
+            righe_utenti.append(
+                (
+                    utente_id,
+                    f"Utente sintetico {utente_id}",
+                    f"sintetico{utente_id}@{DOMINIO_EMAIL}",
+                    password_hash,
+                    rng.choice("MF"),
+                )
+            )
+            for numero_dieta in range(1, diete_per_utente + 1):
+                creazione = oggi - timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+                righe_diete.append(
+                    (dieta_id, utente_id, f"Dieta {numero_dieta}", creazione.strftime("%Y-%m-%d %H:%M:%S"))
+                )
+                for giorno in range(1, 8):
+                    for ordine in range(1, rng.randint(*pasti_per_giorno) + 1):
+                        nome_pasto = NOMI_PASTI[(ordine - 1) % len(NOMI_PASTI)]
+                        righe_pasti.append((pasto_id, dieta_id, giorno, nome_pasto, ordine))
+                        for _ in range(rng.randint(*alimenti_per_pasto)):
+                            righe_dettagli.append(
+                                (dettaglio_id, pasto_id, rng.choice(codici), rng.randint(2, 50) * 5)
+                            )
+                            dettaglio_id += 1
+                        pasto_id += 1
+                dieta_id += 1
+            utente_id += 1
+
+            if len(righe_dettagli) >= DIMENSIONE_BATCH:
+                _scrivi_blocco(cursor, righe_utenti, righe_diete, righe_pasti, righe_dettagli, conteggi)
+                righe_utenti, righe_diete, righe_pasti, righe_dettagli = [], [], [], []
+
+        _scrivi_blocco(cursor, righe_utenti, righe_diete, righe_pasti, righe_dettagli, conteggi)
+        crea_indici_diete(cursor)
+        ricalcola_totali_nutrizionali(cursor, range(primo_dieta_id, dieta_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    cursor.execute("ANALYZE")
+    return conteggi
+
+
+def _scrivi_blocco(
+    cursor: sqlite3.Cursor,
+    righe_utenti: list[tuple],
+    righe_diete: list[tuple],
+    righe_pasti: list[tuple],
+    righe_dettagli: list[tuple],
+    conteggi: dict,
+) -> None:
+    cursor.executemany(
+        "INSERT INTO utenti (id, nome, email, password_hash, sesso) VALUES (?, ?, ?, ?, ?)",
+        righe_utenti,
+    )
+    cursor.executemany(
+        "INSERT INTO diete (id, utente_id, nome_dieta, data_creazione) VALUES (?, ?, ?, ?)",
+        righe_diete,
+    )
+    cursor.executemany(
+        "INSERT INTO pasti (id, dieta_id, giorno_settimana, nome_pasto, ordine) VALUES (?, ?, ?, ?, ?)",
+        righe_pasti,
+    )
+    cursor.executemany(
+        "INSERT INTO dettaglio_pasti (id, pasto_id, codice_alimento, quantita_grammi) VALUES (?, ?, ?, ?)",
+        righe_dettagli,
+    )
+    conteggi["utenti"] += len(righe_utenti)
+    conteggi["diete"] += len(righe_diete)
+    conteggi["pasti"] += len(righe_pasti)
+    conteggi["dettaglio_pasti"] += len(righe_dettagli)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generatore di dati sintetici per test di scala")
+    parser.add_argument("--db", default=DB_PATH, help=f"Database da riempire (default: {DB_PATH})")
+    parser.add_argument("--utenti", type=int, default=1000)
+    parser.add_argument("--diete-per-utente", type=int, default=3)
+    parser.add_argument("--pasti-per-giorno", type=int, nargs=2, default=(4, 5), metavar=("MIN", "MAX"))
+    parser.add_argument("--alimenti-per-pasto", type=int, nargs=2, default=(2, 6), metavar=("MIN", "MAX"))
+    parser.add_argument("--seme", type=int, default=42)
+    parser.add_argument("--password", default="password123", help="Password comune degli utenti generati")
+    args = parser.parse_args()
+
+    conn = setup_database(args.db)
+    # Solo per il caricamento: durabilita' ridotta in cambio di velocita'.
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -200000")
+    inizio = time.perf_counter()
+    try:
+        conteggi = genera_dati(
+            conn,
+            args.utenti,
+            args.diete_per_utente,
+            tuple(args.pasti_per_giorno),
+            tuple(args.alimenti_per_pasto),
+            args.seme,
+            args.password,
+        )
+    finally:
+        conn.close()
+
+    durata = time.perf_counter() - inizio
+    riepilogo = ", ".join(f"{quanti} {tabella}" for tabella, quanti in conteggi.items())
+    print(f"Generati {riepilogo} in {durata:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
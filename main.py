@@ -1,4 +1,7 @@
-from database import setup_database, salva_dati
+import argparse
+
+from catalogo_snapshot import CARTELLA_SNAPSHOT, pubblica_snapshot
+from database import DB_PATH, ricalcola_totali_nutrizionali, setup_database, salva_dati
 from scraper import ottieni_link_alimenti, analizza_pagina_alimento
 import time
 
@@ -6,9 +9,16 @@ import time
 URL_ELENCO = "https://www.alimentinutrizione.it/tabelle-nutrizionali/ricerca-per-ordine-alfabetico"
 
 def main():
+    parser = argparse.ArgumentParser(description="Scraping del catalogo alimenti")
+    parser.add_argument("--db", default=DB_PATH,
+                        help="DB in cui salvare il catalogo (es. un DB di ingestione separato)")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="Al termine pubblica uno snapshot del catalogo per l'API")
+    args = parser.parse_args()
+
     # 1. Inizializza DB
     print("Inizializzazione database...")
-    conn = setup_database()
+    conn = setup_database(args.db)
 
     # 2. Ottieni tutti gli URL con Selenium
     links = ottieni_link_alimenti(URL_ELENCO)
@@ -38,8 +48,20 @@ def main():
         # Una piccola pausa per non bombardare il server di richieste (buona pratica)
         time.sleep(0.5)
 
+    # 4. Pubblica il nuovo snapshot: l'API lo adotta senza riavvio
+    #    (altrimenti aggiorna subito i totali delle diete con i nuovi valori)
+    if not args.snapshot:
+        ricalcola_totali_nutrizionali(conn.cursor())
+        conn.commit()
+    else:
+        conn_utenti = setup_database() if args.db != DB_PATH else None
+        versione = pubblica_snapshot(conn, CARTELLA_SNAPSHOT, conn_utenti)
+        if conn_utenti is not None:
+            conn_utenti.close()
+        print(f"Snapshot del catalogo {versione} pubblicato in '{CARTELLA_SNAPSHOT}'")
+
     conn.close()
-    print("\nOperazione completata con successo! Dati salvati in 'nutrizione.db'")
+    print(f"\nOperazione completata con successo! Dati salvati in '{args.db}'")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,37 +1,88 @@
-import uvicorn
+import hashlib
 import sqlite3
-from typing import Generator
+from datetime import date
+from typing import Callable, ContextManager, Generator, Iterator, Literal
 
 import jwt
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import (
+    Depends,
+    FastAPI,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
+from avvio import AVVIO_RAPIDO, riscaldamento
+from cache_risposte import CacheRisposte
 from calcolatore import calcola_macro_pasto
+from catalogo_bundle import bundle_catalogo
+from catalogo_memoria import registro_catalogo
+from catalogo_snapshot import GestoreSnapshot
+from coda_scritture import CodaScritture
+from esecutore_letture import CodaLetturePiena, EsecutoreLetture
 from crud_manager import (
     aggiungi_alimento_a_pasto,
     aggiungi_pasto,
     aggiorna_dieta_completa,
+    alimenti_piu_ricchi,
+    alimenti_simili,
+    calcola_micronutrienti_gruppi,
     calcola_micronutrienti_lista,
+    calcola_report_dieta,
     cerca_alimenti,
     copia_giorno_dieta,
     crea_dieta,
+    codici_alimento_sconosciuti,
     crea_dieta_completa,
+    crea_ricetta,
     crea_utente,
     elimina_dieta,
+    elimina_ricetta,
     ottieni_dieta_completa,
+    ottieni_diario,
     ottieni_diete_utente,
+    ottieni_ricette_utente,
+    registra_diario,
+    revisione_dieta,
+    revisioni_diete_utente,
+    riepiloghi_diario,
+    sfoglia_alimenti,
+    valida_codici_dieta,
+    valida_diario,
+    valida_ricetta,
+)
+from export_diete import esporta_csv, esporta_ndjson
+from metriche import ConnessioneTracciata, middleware_metriche, misura, registro
+from sessione_live import SessioneDieta, carica_vettori_alimenti
+from shard_diete import RouterShard
+from serializzazione import (
+    SOGLIA_COMPRESSIONE,
+    CompressioneMiddleware,
+    RispostaJSON,
+    codifica_preferita,
+    comprimi,
+    etag_codificato,
+    serializza_json,
 )
-from database import setup_database
-from nutritional_targets import load_larn_data
 from security import ALGORITHM, SECRET_KEY, crea_access_token, hash_password, verify_password
 from schemas import (
     AlimentoPastoCreate,
+    CalcoloMicroBatchRequest,
     CalcoloMicroRequest,
+    DiarioCreate,
     DietaCompletaCreate,
     DietaCreate,
     PastoCreate,
+    RicettaCreate,
     UtenteCreate,
 )
 
@@ -42,8 +93,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "ETag", "X-Catalogo-Versione"],
 )
+app.add_middleware(CompressioneMiddleware)
+app.middleware("http")(middleware_metriche)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/token")
+gestore_snapshot = GestoreSnapshot()
+registro_catalogo.configura(gestore_snapshot)
+# Le scritture di ogni DB (principale e shard delle diete) passano da un unico writer:
+# niente contesa sul lock del DB nel processo.
+router_shard = RouterShard(factory=ConnessioneTracciata, gestore_snapshot=gestore_snapshot)
+coda_scritture = router_shard.coda()
+# Le letture degli endpoint async passano da un pool di lettori con coda limitata.
+letture = EsecutoreLetture(router_shard)
+# Corpi JSON di diete e liste di diete, per ETag (che contiene la revisione).
+cache_risposte = CacheRisposte()
 
 
 class CopiaGiornoRequest(BaseModel):
@@ -52,42 +116,59 @@ class CopiaGiornoRequest(BaseModel):
 
 
 @app.on_event("startup")
-def startup_load_targets() -> None:
-    load_larn_data()
+def startup_riscaldamento() -> None:
+    # Con server.py il riscaldamento e' gia' avvenuto nel processo padre prima del fork.
+    if AVVIO_RAPIDO:
+        riscaldamento.avvia_in_background()
+    else:
+        riscaldamento.esegui()
+
+
+@app.on_event("shutdown")
+def shutdown_coda_scritture() -> None:
+    router_shard.chiudi()
+    letture.chiudi()
+
+
+@app.exception_handler(CodaLetturePiena)
+def coda_letture_piena_handler(request: Request, exc: CodaLetturePiena) -> JSONResponse:
+    return JSONResponse(
+        {"detail": "Server sovraccarico, riprovare"},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
+
+
+def apri_connessione(shard: int | None = None) -> ContextManager[sqlite3.Connection]:
+    """
+    Apre una connessione al DB principale (o allo ``shard`` delle diete) e la chiude
+    all'uscita. Se e' stato pubblicato uno snapshot del catalogo, lo collega in sola
+    lettura e lo mantiene in uso fino alla chiusura della connessione.
+    """
+    return router_shard.connessione(shard)
 
 
 def get_db() -> Generator[sqlite3.Connection, None, None]:
     """Apre e chiude automaticamente la connessione DB per richiesta."""
-    conn = setup_database()
-    try:
+    with apri_connessione() as conn:
         yield conn
-    finally:
-        conn.close()
 
 
-def get_utente_corrente(
-    token: str = Depends(oauth2_scheme),
-    conn: sqlite3.Connection = Depends(get_db),
-) -> dict:
-    """Valida il token JWT e ritorna l'utente corrente."""
-    credenziali_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Token non valido",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-
+def _utente_da_token(token: str, conn: sqlite3.Connection) -> dict | None:
+    """Valida il token JWT e ritorna l'utente, o None se token o utente non sono validi."""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if not user_id:
-            raise credenziali_exception
+        with misura("jwt_decode"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except jwt.InvalidTokenError:
-        raise credenziali_exception
+        return None
+    user_id = payload.get("sub")
+    if not user_id:
+        return None
 
     cursor = conn.cursor()
     cursor.execute(
         """
-        SELECT id, nome, email, ruolo, sesso
+        SELECT id, nome, email, ruolo, sesso, shard
         FROM utenti
         WHERE id = ?
         """,
@@ -95,7 +176,7 @@ def get_utente_corrente(
     )
     user = cursor.fetchone()
     if not user:
-        raise credenziali_exception
+        return None
 
     return {
         "id": user[0],
@@ -103,9 +184,54 @@ def get_utente_corrente(
         "email": user[2],
         "ruolo": user[3],
         "sesso": user[4],
+        "shard": user[5],
     }
 
 
+def get_utente_corrente(
+    token: str = Depends(oauth2_scheme),
+    conn: sqlite3.Connection = Depends(get_db),
+) -> dict:
+    """Valida il token JWT e ritorna l'utente corrente."""
+    utente = _utente_da_token(token, conn)
+    if utente is None:
+        raise _token_non_valido()
+    return utente
+
+
+async def get_utente_corrente_async(token: str = Depends(oauth2_scheme)) -> dict:
+    """Come ``get_utente_corrente`` per gli endpoint async: la lettura passa da ``letture``."""
+    utente = await letture.esegui(lambda conn: _utente_da_token(token, conn))
+    if utente is None:
+        raise _token_non_valido()
+    return utente
+
+
+def _token_non_valido() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Token non valido",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def get_db_diete(
+    conn: sqlite3.Connection = Depends(get_db),
+    current_user: dict = Depends(get_utente_corrente),
+) -> Generator[sqlite3.Connection, None, None]:
+    """Connessione al DB che contiene le diete dell'utente corrente (principale o shard)."""
+    if current_user["shard"] is None:
+        yield conn
+        return
+    with apri_connessione(current_user["shard"]) as conn_diete:
+        yield conn_diete
+
+
+def coda_utente(utente: dict) -> CodaScritture:
+    """Writer del DB che contiene le diete dell'utente."""
+    return router_shard.coda(utente["shard"])
+
+
 def get_utente_admin(utente_corrente: dict = Depends(get_utente_corrente)) -> dict:
     """Permette accesso solo ad utenti admin."""
     if utente_corrente.get("ruolo") != "admin":
@@ -122,8 +248,16 @@ def crea_utente_endpoint(
     conn: sqlite3.Connection = Depends(get_db),
     admin_user: dict = Depends(get_utente_admin),
 ) -> dict:
-    password_hash = hash_password(payload.password)
-    utente_id = crea_utente(conn, payload.nome, payload.email, password_hash, payload.sesso)
+    with misura("bcrypt"):
+        password_hash = hash_password(payload.password)
+    utente_id = coda_scritture.esegui(
+        crea_utente,
+        payload.nome,
+        payload.email,
+        password_hash,
+        payload.sesso,
+        router_shard.shard_nuovo_utente(payload.email),
+    )
     return {"id": utente_id}
 
 
@@ -133,17 +267,29 @@ def crea_dieta_endpoint(
     conn: sqlite3.Connection = Depends(get_db),
     current_user: dict = Depends(get_utente_corrente),
 ) -> dict:
-    dieta_id = crea_dieta(conn, current_user["id"], payload.nome_dieta)
+    dieta_id = coda_utente(current_user).esegui(crea_dieta, current_user["id"], payload.nome_dieta)
     return {"id": dieta_id}
 
 
+def _verifica_codici_alimento(
+    conn: sqlite3.Connection,
+    payload: DietaCompletaCreate,
+    utente_id: int,
+) -> None:
+    """Rifiuta il payload con 422 elencando tutti i codici inesistenti, prima di accodare la scrittura."""
+    errori = valida_codici_dieta(conn, payload, utente_id)
+    if errori:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail=errori)
+
+
 @app.post("/api/diete/completa", status_code=201)
 def crea_dieta_completa_endpoint(
     payload: DietaCompletaCreate,
-    conn: sqlite3.Connection = Depends(get_db),
+    conn: sqlite3.Connection = Depends(get_db_diete),
     current_user: dict = Depends(get_utente_corrente),
 ) -> dict:
-    dieta_id = crea_dieta_completa(conn, current_user["id"], payload)
+    _verifica_codici_alimento(conn, payload, current_user["id"])
+    dieta_id = coda_utente(current_user).esegui(crea_dieta_completa, current_user["id"], payload)
     return {"status": "ok", "id": dieta_id, "message": "Dieta salvata con successo"}
 
 
@@ -151,41 +297,229 @@ def crea_dieta_completa_endpoint(
 def aggiorna_dieta_completa_endpoint(
     dieta_id: int,
     payload: DietaCompletaCreate,
-    conn: sqlite3.Connection = Depends(get_db),
+    conn: sqlite3.Connection = Depends(get_db_diete),
     current_user: dict = Depends(get_utente_corrente),
 ) -> dict:
-    updated = aggiorna_dieta_completa(conn, dieta_id, current_user["id"], payload)
+    _verifica_codici_alimento(conn, payload, current_user["id"])
+    updated = coda_utente(current_user).esegui(
+        aggiorna_dieta_completa, dieta_id, current_user["id"], payload
+    )
     if not updated:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dieta non trovata")
     return {"status": "ok", "id": dieta_id, "message": "Dieta aggiornata con successo"}
 
 
+def _etag_corrisponde(if_none_match: str | None, etag: str) -> bool:
+    """Confronto di If-None-Match (lista di ETag o ``*``) con l'ETag della risorsa."""
+    if not if_none_match:
+        return False
+    candidati = {valore.strip().removeprefix("W/") for valore in if_none_match.split(",")}
+    return "*" in candidati or etag in candidati
+
+
+async def _risposta_condizionale(
+    request: Request,
+    etag: str,
+    produci: Callable[[sqlite3.Connection], object],
+    shard: int | None,
+) -> Response:
+    """
+    304 se il client ha gia' la versione ``etag``, altrimenti il corpo JSON prodotto da
+    ``produci`` sul DB dello ``shard`` (o gia' in ``cache_risposte`` per lo stesso ETag).
+    Sopra la soglia il corpo e' compresso qui, e messo in cache, con un ETag distinto
+    per codifica.
+    """
+    codifica = codifica_preferita(request.headers.get("accept-encoding"))
+    intestazioni = {"Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match")
+    # Qualunque variante della stessa revisione e' ancora valida per il client.
+    for candidato in dict.fromkeys((etag_codificato(etag, codifica), etag)):
+        if _etag_corrisponde(if_none_match, candidato):
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED, headers={**intestazioni, "ETag": candidato}
+            )
+
+    corpo = cache_risposte.cerca(etag)
+    if corpo is None:
+        corpo = await letture.esegui(lambda conn: serializza_json(produci(conn)), shard=shard)
+        cache_risposte.memorizza(etag, corpo)
+    if len(corpo) < SOGLIA_COMPRESSIONE:
+        return Response(corpo, media_type="application/json", headers={**intestazioni, "ETag": etag})
+    if codifica is None:
+        # Sopra la soglia Vary viene aggiunto da CompressioneMiddleware.
+        del intestazioni["Vary"]
+        return Response(corpo, media_type="application/json", headers={**intestazioni, "ETag": etag})
+    compresso = cache_risposte.cerca((etag, codifica))
+    if compresso is None:
+        compresso = await run_in_threadpool(comprimi, corpo, codifica)
+        cache_risposte.memorizza((etag, codifica), compresso)
+    intestazioni.update({"ETag": etag_codificato(etag, codifica), "Content-Encoding": codifica})
+    return Response(compresso, media_type="application/json", headers=intestazioni)
+
+
+async def _risposta_diete_utente(request: Request, utente: dict) -> Response:
+    utente_id, shard = utente["id"], utente["shard"]
+    # Le coppie (id, revisione) cambiano con ogni creazione, modifica o eliminazione.
+    revisioni = await letture.esegui(revisioni_diete_utente, utente_id, shard=shard)
+    impronta = hashlib.sha256(repr(revisioni).encode("utf-8")).hexdigest()[:16]
+    return await _risposta_condizionale(
+        request, f'"u{utente_id}-{impronta}"', lambda conn: ottieni_diete_utente(conn, utente_id), shard
+    )
+
+
 @app.get("/api/utenti/me/diete")
-def ottieni_diete_utente_endpoint(
-    conn: sqlite3.Connection = Depends(get_db),
-    current_user: dict = Depends(get_utente_corrente),
-) -> list[dict]:
-    return ottieni_diete_utente(conn, current_user["id"])
+async def ottieni_diete_utente_endpoint(
+    request: Request,
+    current_user: dict = Depends(get_utente_corrente_async),
+) -> Response:
+    return await _risposta_diete_utente(request, current_user)
 
 
 @app.get("/api/diete")
-def ottieni_mie_diete_endpoint(
-    conn: sqlite3.Connection = Depends(get_db),
+async def ottieni_mie_diete_endpoint(
+    request: Request,
+    current_user: dict = Depends(get_utente_corrente_async),
+) -> Response:
+    return await _risposta_diete_utente(request, current_user)
+
+
+def _risposta_export(
+    formato: str,
+    utente_id: int | None,
+    shard: list[int | None],
+    nome_file: str,
+) -> StreamingResponse:
+    def contenuto() -> Iterator[str]:
+        # Connessioni proprie: quella della dipendenza get_db e' gia' chiusa durante lo streaming.
+        for indice, shard_corrente in enumerate(shard):
+            with apri_connessione(shard_corrente) as conn:
+                if formato == "csv":
+                    yield from esporta_csv(conn, utente_id, intestazione=indice == 0)
+                else:
+                    yield from esporta_ndjson(conn, utente_id)
+
+    media_type = "text/csv; charset=utf-8" if formato == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        contenuto(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{nome_file}.{formato}"'},
+    )
+
+
+@app.get("/api/diete/export")
+def esporta_mie_diete_endpoint(
+    formato: Literal["ndjson", "csv"] = "ndjson",
     current_user: dict = Depends(get_utente_corrente),
-) -> list[dict]:
-    return ottieni_diete_utente(conn, current_user["id"])
+) -> StreamingResponse:
+    return _risposta_export(formato, current_user["id"], [current_user["shard"]], "diete")
+
+
+@app.get("/api/admin/diete/export")
+def esporta_tutte_diete_endpoint(
+    formato: Literal["ndjson", "csv"] = "ndjson",
+    admin_user: dict = Depends(get_utente_admin),
+) -> StreamingResponse:
+    return _risposta_export(formato, None, [None, *router_shard.shard_esistenti()], "diete-tutte")
 
 
 @app.get("/api/diete/{dieta_id}/completa")
-def ottieni_dieta_completa_endpoint(
+async def ottieni_dieta_completa_endpoint(
     dieta_id: int,
-    conn: sqlite3.Connection = Depends(get_db),
-    current_user: dict = Depends(get_utente_corrente),
-) -> dict:
-    dieta = ottieni_dieta_completa(conn, dieta_id, current_user["id"])
-    if not dieta:
+    request: Request,
+    current_user: dict = Depends(get_utente_corrente_async),
+) -> Response:
+    revisione = await letture.esegui(
+        revisione_dieta, dieta_id, current_user["id"], shard=current_user["shard"]
+    )
+    if revisione is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dieta non trovata")
-    return dieta
+
+    def produci(conn: sqlite3.Connection) -> dict:
+        dieta = ottieni_dieta_completa(conn, dieta_id, current_user["id"])
+        if not dieta:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dieta non trovata")
+        return dieta
+
+    # I valori per alimento sono letti dal catalogo: l'ETag include anche la sua versione.
+    versione_catalogo = gestore_snapshot.versione_corrente() or "db"
+    return await _risposta_condizionale(
+        request, f'"d{dieta_id}-r{revisione}-{versione_catalogo}"', produci, current_user["shard"]
+    )
+
+
+@app.websocket("/api/diete/{dieta_id}/live")
+async def sessione_live_endpoint(websocket: WebSocket, dieta_id: int, token: str = "") -> None:
+    """
+    Sessione di modifica live (protocollo in ``sessione_live``). Il token JWT va passato
+    come query string ``?token=`` perche' i browser non permettono header sui WebSocket.
+    """
+
+    def apri_sessione() -> tuple[dict, SessioneDieta] | tuple[None, None]:
+        with apri_connessione() as conn:
+            utente = _utente_da_token(token, conn)
+        if utente is None:
+            return None, None
+        with apri_connessione(utente["shard"]) as conn:
+            return utente, SessioneDieta.carica(conn, dieta_id, utente["id"], utente["sesso"])
+
+    def carica_vettore(codice: str) -> dict:
+        with apri_connessione(utente["shard"]) as conn:
+            return carica_vettori_alimenti(conn, [codice], utente["id"])
+
+    utente, sessione = await run_in_threadpool(apri_sessione)
+    if sessione is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Token o dieta non validi")
+        return
+
+    await websocket.accept()
+    await websocket.send_json(sessione.stato())
+    try:
+        while True:
+            try:
+                messaggio = await websocket.receive_json()
+                if not isinstance(messaggio, dict):
+                    raise ValueError("Il messaggio deve essere un oggetto JSON")
+                if messaggio.get("op") == "salva":
+                    salvata = await run_in_threadpool(
+                        coda_utente(utente).esegui,
+                        aggiorna_dieta_completa,
+                        sessione.dieta_id,
+                        sessione.utente_id,
+                        sessione.come_payload(),
+                    )
+                    if not salvata:
+                        # Dieta eliminata nel frattempo: non c'e' niente da ricaricare.
+                        await websocket.send_json({"tipo": "errore", "messaggio": "Dieta non trovata"})
+                        continue
+                    # Il salvataggio riscrive pasti e dettagli: si riparte dagli id del DB.
+                    sessione = (await run_in_threadpool(apri_sessione))[1] or sessione
+                    await websocket.send_json({**sessione.stato(), "salvato": True})
+                    continue
+                codice = sessione.codice_da_caricare(messaggio)
+                if codice is not None:
+                    sessione.vettori.update(await run_in_threadpool(carica_vettore, codice))
+                await websocket.send_json(sessione.applica(messaggio))
+            except (ValueError, sqlite3.Error) as exc:
+                # Anche un errore del DB (es. "database is locked") non chiude la sessione:
+                # le modifiche restano in memoria e il client puo' ritentare il salvataggio.
+                await websocket.send_json({"tipo": "errore", "messaggio": str(exc)})
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/api/diete/{dieta_id}/report")
+async def report_dieta_endpoint(
+    dieta_id: int,
+    current_user: dict = Depends(get_utente_corrente_async),
+) -> RispostaJSON:
+    def calcola(conn: sqlite3.Connection) -> dict | None:
+        with misura("calcolo_nutrienti"):
+            return calcola_report_dieta(conn, dieta_id, current_user["id"], current_user["sesso"])
+
+    report = await letture.esegui(calcola, shard=current_user["shard"])
+    if not report:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dieta non trovata")
+    return RispostaJSON(report)
 
 
 @app.delete("/api/diete/{dieta_id}")
@@ -194,7 +528,7 @@ def elimina_dieta_endpoint(
     conn: sqlite3.Connection = Depends(get_db),
     current_user: dict = Depends(get_utente_corrente),
 ) -> dict:
-    deleted = elimina_dieta(conn, dieta_id, current_user["id"])
+    deleted = coda_utente(current_user).esegui(elimina_dieta, dieta_id, current_user["id"])
     if not deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dieta non trovata")
     return {"status": "ok"}
@@ -206,8 +540,8 @@ def aggiungi_pasto_endpoint(
     conn: sqlite3.Connection = Depends(get_db),
     current_user: dict = Depends(get_utente_corrente),
 ) -> dict:
-    pasto_id = aggiungi_pasto(
-        conn,
+    pasto_id = coda_utente(current_user).esegui(
+        aggiungi_pasto,
         payload.dieta_id,
         payload.giorno_settimana,
         payload.nome_pasto,
@@ -220,10 +554,14 @@ def aggiungi_pasto_endpoint(
 def aggiungi_alimento_a_pasto_endpoint(
     pasto_id: int,
     payload: AlimentoPastoCreate,
-    conn: sqlite3.Connection = Depends(get_db),
+    conn: sqlite3.Connection = Depends(get_db_diete),
     current_user: dict = Depends(get_utente_corrente),
 ) -> dict:
-    aggiungi_alimento_a_pasto(conn, pasto_id, payload.codice_alimento, payload.quantita_grammi)
+    if codici_alimento_sconosciuti(conn, [payload.codice_alimento], current_user["id"]):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Alimento non trovato")
+    coda_utente(current_user).esegui(
+        aggiungi_alimento_a_pasto, pasto_id, payload.codice_alimento, payload.quantita_grammi
+    )
     return {"status": "ok"}
 
 
@@ -234,26 +572,209 @@ def copia_giorno_dieta_endpoint(
     conn: sqlite3.Connection = Depends(get_db),
     current_user: dict = Depends(get_utente_corrente),
 ) -> dict:
-    copia_giorno_dieta(conn, dieta_id, payload.giorno_origine, payload.giorno_destinazione)
+    coda_utente(current_user).esegui(
+        copia_giorno_dieta, dieta_id, payload.giorno_origine, payload.giorno_destinazione
+    )
     return {"status": "ok"}
 
 
-@app.get("/api/alimenti/search")
-def cerca_alimenti_endpoint(
-    q: str,
+@app.post("/api/ricette", status_code=201)
+def crea_ricetta_endpoint(
+    payload: RicettaCreate,
+    conn: sqlite3.Connection = Depends(get_db_diete),
+    current_user: dict = Depends(get_utente_corrente),
+) -> dict:
+    errori = valida_ricetta(conn, payload)
+    if errori:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail=errori)
+    return coda_utente(current_user).esegui(crea_ricetta, current_user["id"], payload)
+
+
+@app.get("/api/ricette")
+async def ottieni_ricette_endpoint(current_user: dict = Depends(get_utente_corrente_async)) -> list[dict]:
+    return await letture.esegui(ottieni_ricette_utente, current_user["id"], shard=current_user["shard"])
+
+
+@app.delete("/api/ricette/{ricetta_id}")
+def elimina_ricetta_endpoint(
+    ricetta_id: int,
+    current_user: dict = Depends(get_utente_corrente),
+) -> dict:
+    try:
+        deleted = coda_utente(current_user).esegui(elimina_ricetta, ricetta_id, current_user["id"])
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc)) from exc
+    if not deleted:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Ricetta non trovata")
+    return {"status": "ok"}
+
+
+@app.post("/api/diario", status_code=201)
+def registra_diario_endpoint(
+    payload: DiarioCreate,
+    conn: sqlite3.Connection = Depends(get_db_diete),
+    current_user: dict = Depends(get_utente_corrente),
+) -> dict:
+    """Registra quanto mangiato in ``data``; grammi negativi stornano una voce precedente."""
+    errori = valida_diario(conn, payload, current_user["id"])
+    if errori:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail=errori)
+    voce_ids = coda_utente(current_user).esegui(registra_diario, current_user["id"], payload)
+    return {"status": "ok", "ids": voce_ids}
+
+
+def _verifica_intervallo(dal: date, al: date) -> None:
+    if dal > al:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail="dal deve precedere o coincidere con al"
+        )
+
+
+@app.get("/api/diario")
+async def ottieni_diario_endpoint(
+    dal: date,
+    al: date,
+    current_user: dict = Depends(get_utente_corrente_async),
+) -> list[dict]:
+    _verifica_intervallo(dal, al)
+    return await letture.esegui(ottieni_diario, current_user["id"], dal, al, shard=current_user["shard"])
+
+
+@app.get("/api/diario/riepiloghi")
+async def riepiloghi_diario_endpoint(
+    dal: date,
+    al: date,
+    periodo: Literal["giorno", "settimana", "mese"] = "giorno",
+    nutriente: list[str] | None = Query(None),
+    current_user: dict = Depends(get_utente_corrente_async),
+) -> dict:
+    """
+    Andamento dei totali per giorno, settimana o mese dai riepiloghi precalcolati
+    (``nutriente`` ripetibile, nomi come nel catalogo; di default i macro).
+    """
+    _verifica_intervallo(dal, al)
+    serie = await letture.esegui(
+        riepiloghi_diario, current_user["id"], periodo, dal, al, nutriente, shard=current_user["shard"]
+    )
+    return {"periodo": periodo, "serie": serie}
+
+
+@app.get("/api/catalogo/bundle")
+def bundle_catalogo_endpoint(
+    request: Request,
+    micro: bool = False,
+    versione: str | None = None,
     conn: sqlite3.Connection = Depends(get_db),
     current_user: dict = Depends(get_utente_corrente),
+) -> Response:
+    """
+    Catalogo completo per il calcolo lato client (formato in ``catalogo_bundle``),
+    compresso con gzip se il client lo accetta. Chiamato con ``?versione=`` uguale a
+    quella corrente e' cacheabile senza scadenza; altrimenti va rivalidato (304).
+    """
+    with misura("catalogo_bundle"):
+        # Senza snapshot il catalogo (e il bundle con il suo ETag) si rilegge dal DB solo se cambia.
+        catalogo = registro_catalogo.corrente() or registro_catalogo.da_db(conn)
+        bundle = bundle_catalogo(catalogo, micro)
+
+    compresso = "gzip" in request.headers.get("accept-encoding", "").lower()
+    etag = bundle.etag(compresso)
+    intestazioni = {
+        "ETag": etag,
+        "Vary": "Accept-Encoding",
+        "X-Catalogo-Versione": bundle.versione,
+        "Cache-Control": (
+            "private, max-age=31536000, immutable" if versione == bundle.versione else "private, no-cache"
+        ),
+    }
+    if _etag_corrisponde(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=intestazioni)
+    if compresso:
+        intestazioni["Content-Encoding"] = "gzip"
+    return Response(
+        bundle.corpo_gzip if compresso else bundle.corpo,
+        media_type="application/json",
+        headers=intestazioni,
+    )
+
+
+@app.get("/api/alimenti/search")
+async def cerca_alimenti_endpoint(
+    q: str,
+    current_user: dict = Depends(get_utente_corrente_async),
 ) -> list[dict]:
-    return cerca_alimenti(conn, q)
+    return await letture.esegui(cerca_alimenti, q)
+
+
+@app.get("/api/alimenti/sfoglia")
+async def sfoglia_alimenti_endpoint(
+    categoria: str | None = None,
+    kcal_min: float | None = None,
+    kcal_max: float | None = None,
+    proteine_min: float | None = None,
+    proteine_max: float | None = None,
+    carboidrati_min: float | None = None,
+    carboidrati_max: float | None = None,
+    grassi_min: float | None = None,
+    grassi_max: float | None = None,
+    offset: int = Query(0, ge=0),
+    limite: int = Query(20, ge=1, le=200),
+    current_user: dict = Depends(get_utente_corrente_async),
+) -> dict:
+    """Catalogo per categoria con conteggi per facetta e filtri sulle macro per 100g (estremi inclusi)."""
+    limiti = {
+        "kcal": (kcal_min, kcal_max),
+        "proteine": (proteine_min, proteine_max),
+        "carboidrati": (carboidrati_min, carboidrati_max),
+        "grassi": (grassi_min, grassi_max),
+    }
+    intervalli = {chiave: limite_macro for chiave, limite_macro in limiti.items() if limite_macro != (None, None)}
+    return await letture.esegui(sfoglia_alimenti, categoria, intervalli, offset, limite)
+
+
+@app.get("/api/alimenti/piu-ricchi")
+async def alimenti_piu_ricchi_endpoint(
+    nutriente: str,
+    per: Literal["100g", "kcal"] = "100g",
+    categoria: str | None = None,
+    limite: int = Query(20, ge=1, le=200),
+    current_user: dict = Depends(get_utente_corrente_async),
+) -> dict:
+    """Classifica degli alimenti per contenuto di ``nutriente`` (nome come in LARN, es. "Ferro (mg)")."""
+    classifica = await letture.esegui(alimenti_piu_ricchi, nutriente, limite, per == "kcal", categoria)
+    if classifica is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nutriente non trovato")
+    return {**classifica, "per": per}
+
+
+@app.get("/api/alimenti/{codice_alimento}/simili")
+async def alimenti_simili_endpoint(
+    codice_alimento: str,
+    categoria: str | None = None,
+    profilo: Literal["macro", "completo"] = "macro",
+    limite: int = Query(10, ge=1, le=100),
+    current_user: dict = Depends(get_utente_corrente_async),
+) -> dict:
+    """
+    Sostituti per un alimento: i piu' vicini per valori per 100g delle macro o, con
+    ``profilo=completo``, di tutti i nutrienti.
+    """
+    risultato = await letture.esegui(alimenti_simili, codice_alimento, limite, categoria, profilo)
+    if risultato is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Alimento non trovato")
+    return risultato
 
 
 @app.get("/api/pasti/{pasto_id}/nutrizione")
-def nutrizione_pasto_endpoint(
+async def nutrizione_pasto_endpoint(
     pasto_id: int,
-    conn: sqlite3.Connection = Depends(get_db),
-    current_user: dict = Depends(get_utente_corrente),
+    current_user: dict = Depends(get_utente_corrente_async),
 ) -> dict:
-    totali = calcola_macro_pasto(conn, pasto_id)
+    def calcola(conn: sqlite3.Connection) -> dict:
+        with misura("calcolo_nutrienti"):
+            return calcola_macro_pasto(conn, pasto_id)
+
+    totali = await letture.esegui(calcola, shard=current_user["shard"])
     return {
         "pasto_id": pasto_id,
         "kcal": totali["energia_kcal"],
@@ -263,13 +784,52 @@ def nutrizione_pasto_endpoint(
     }
 
 
-@app.post("/api/nutrizione/giornaliera/micro")
-def nutrizione_giornaliera_micro_endpoint(
+# I risultati sono gia' nella forma finale: restituiti come RispostaJSON non passano dalla
+# validazione del response_model (che resta per la documentazione OpenAPI).
+@app.post("/api/nutrizione/giornaliera/micro", response_model=dict[str, dict[str, float]])
+async def nutrizione_giornaliera_micro_endpoint(
     payload: CalcoloMicroRequest,
+    current_user: dict = Depends(get_utente_corrente_async),
+) -> RispostaJSON:
+    def calcola(conn: sqlite3.Connection) -> dict:
+        with misura("calcolo_nutrienti"):
+            return calcola_micronutrienti_lista(
+                conn, payload.alimenti, current_user["sesso"], current_user["id"]
+            )
+
+    return RispostaJSON(await letture.esegui(calcola, shard=current_user["shard"]))
+
+
+@app.post("/api/nutrizione/micro/batch", response_model=dict[str, dict[str, dict[str, float]]])
+async def nutrizione_micro_batch_endpoint(
+    payload: CalcoloMicroBatchRequest,
+    current_user: dict = Depends(get_utente_corrente_async),
+) -> RispostaJSON:
+    def calcola(conn: sqlite3.Connection) -> dict:
+        with misura("calcolo_nutrienti"):
+            return calcola_micronutrienti_gruppi(
+                conn, payload.gruppi, current_user["sesso"], current_user["id"]
+            )
+
+    return RispostaJSON(await letture.esegui(calcola, shard=current_user["shard"]))
+
+
+@app.get("/api/admin/statistiche")
+def statistiche_popolazione_endpoint(
+    limite_alimenti: int = 20,
     conn: sqlite3.Connection = Depends(get_db),
-    current_user: dict = Depends(get_utente_corrente),
-) -> dict[str, dict[str, float]]:
-    return calcola_micronutrienti_lista(conn, payload.alimenti, current_user["sesso"])
+    admin_user: dict = Depends(get_utente_admin),
+) -> dict:
+    # Import differito: NumPy serve solo a questo endpoint e rallenterebbe l'avvio.
+    from analitica import calcola_statistiche_popolazione
+
+    try:
+        with misura("analitica"):
+            return calcola_statistiche_popolazione(
+                conn, max(1, min(limite_alimenti, 200)), percorsi_diete=router_shard.percorsi()
+            )
+    except RuntimeError as exc:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(exc))
 
 
 @app.post("/api/token")
@@ -288,7 +848,9 @@ def login_for_access_token(
     )
     user = cursor.fetchone()
 
-    if not user or not verify_password(form_data.password, user[2]):
+    with misura("bcrypt"):
+        password_valida = bool(user) and verify_password(form_data.password, user[2])
+    if not password_valida:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Credenziali non valide",
@@ -300,5 +862,28 @@ def login_for_access_token(
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+@app.get("/health")
+def health_endpoint() -> dict:
+    """Liveness: risponde appena il processo accetta connessioni, anche durante il riscaldamento."""
+    return {"status": "ok"}
+
+
+@app.get("/health/pronto")
+def health_pronto_endpoint() -> JSONResponse:
+    """Readiness: 200 solo a riscaldamento concluso (target, schema, catalogo in memoria)."""
+    stato = riscaldamento.stato()
+    return JSONResponse(stato, status_code=200 if stato["pronto"] else 503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint() -> PlainTextResponse:
+    return PlainTextResponse(
+        registro.esporta_prometheus(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run("main_api:app", host="127.0.0.1", port=8000, reload=True)
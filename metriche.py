@@ -0,0 +1,313 @@
+"""
+Strumentazione delle richieste API.
+
+- tempo di ogni richiesta per rotta (istogrammi + quantili sugli ultimi campioni);
+- statement SQL eseguiti da ogni richiesta (numero, tempo totale, i piu' lenti),
+  raccolti da una connessione sqlite3 tracciata;
+- durata delle fasi principali (setup_database, decodifica JWT, bcrypt, calcoli);
+- memoria del processo (RSS, PSS, pagine condivise e private), per verificare la
+  condivisione copy-on-write tra i worker di ``server.py``;
+- esposizione in formato Prometheus e log opzionale delle richieste lente.
+
+Il log delle richieste lente si attiva con la variabile d'ambiente
+``SOGLIA_RICHIESTA_LENTA_MS`` (es. 500).
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Generator
+
+from fastapi import Request
+
+SOGLIA_RICHIESTA_LENTA_MS = float(os.environ.get("SOGLIA_RICHIESTA_LENTA_MS", "0") or 0)
+BUCKET_SECONDI = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILI = (0.5, 0.95, 0.99)
+CAMPIONI_PER_QUANTILI = 1000
+STATEMENT_PIU_LENTI = 5
+PREFISSO = "macromicro"
+
+logger = logging.getLogger("macro_micro.metriche")
+
+
+@dataclass
+class StatisticheRichiesta:
+    statement: list[tuple[str, float]] = field(default_factory=list)
+    fasi: dict[str, float] = field(default_factory=dict)
+
+    @property
+    def durata_sql(self) -> float:
+        return sum(durata for _sql, durata in self.statement)
+
+    def piu_lenti(self, quanti: int = STATEMENT_PIU_LENTI) -> list[tuple[str, float]]:
+        ordinati = sorted(self.statement, key=lambda voce: voce[1], reverse=True)
+        return [(_normalizza_sql(sql), durata) for sql, durata in ordinati[:quanti]]
+
+
+_richiesta_corrente: ContextVar[StatisticheRichiesta | None] = ContextVar(
+    "richiesta_corrente", default=None
+)
+
+
+def _normalizza_sql(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+class Istogramma:
+    def __init__(self) -> None:
+        self.bucket = [0] * len(BUCKET_SECONDI)
+        self.conteggio = 0
+        self.somma = 0.0
+        self.ultimi: deque[float] = deque(maxlen=CAMPIONI_PER_QUANTILI)
+
+    def osserva(self, valore: float) -> None:
+        self.conteggio += 1
+        self.somma += valore
+        self.ultimi.append(valore)
+        for indice, limite in enumerate(BUCKET_SECONDI):
+            if valore <= limite:
+                self.bucket[indice] += 1
+
+    def quantile(self, q: float) -> float:
+        if not self.ultimi:
+            return 0.0
+        ordinati = sorted(self.ultimi)
+        return ordinati[min(len(ordinati) - 1, int(q * len(ordinati)))]
+
+
+class RegistroMetriche:
+    """Contatori e istogrammi condivisi dal processo, protetti da lock."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.richieste: dict[tuple[str, str, int], int] = {}
+        self.durate_richieste: dict[tuple[str, str], Istogramma] = {}
+        self.statement_sql: dict[tuple[str, str], int] = {}
+        self.durate_sql: dict[tuple[str, str], Istogramma] = {}
+        self.fasi: dict[str, Istogramma] = {}
+
+    def registra_richiesta(
+        self,
+        metodo: str,
+        percorso: str,
+        stato: int,
+        durata: float,
+        statistiche: StatisticheRichiesta,
+    ) -> None:
+        chiave = (metodo, percorso)
+        with self._lock:
+            self.richieste[(metodo, percorso, stato)] = self.richieste.get((metodo, percorso, stato), 0) + 1
+            self.durate_richieste.setdefault(chiave, Istogramma()).osserva(durata)
+            self.statement_sql[chiave] = self.statement_sql.get(chiave, 0) + len(statistiche.statement)
+            self.durate_sql.setdefault(chiave, Istogramma()).osserva(statistiche.durata_sql)
+
+    def registra_fase(self, fase: str, durata: float) -> None:
+        with self._lock:
+            self.fasi.setdefault(fase, Istogramma()).osserva(durata)
+
+    def esporta_prometheus(self) -> str:
+        """Ritorna tutte le metriche nel formato testuale di Prometheus (0.0.4)."""
+        righe: list[str] = []
+        with self._lock:
+            nome = f"{PREFISSO}_richieste_http_totali"
+            righe += [f"# HELP {nome} Richieste HTTP servite.", f"# TYPE {nome} counter"]
+            for (metodo, percorso, stato), valore in sorted(self.richieste.items()):
+                righe.append(f'{nome}{{metodo="{metodo}",percorso="{percorso}",stato="{stato}"}} {valore}')
+
+            righe += _esporta_istogrammi(
+                f"{PREFISSO}_richieste_http_durata_secondi",
+                "Durata delle richieste HTTP per rotta.",
+                {f'metodo="{m}",percorso="{p}"': ist for (m, p), ist in self.durate_richieste.items()},
+            )
+
+            nome = f"{PREFISSO}_sql_statement_totali"
+            righe += [f"# HELP {nome} Statement SQL eseguiti per rotta.", f"# TYPE {nome} counter"]
+            for (metodo, percorso), valore in sorted(self.statement_sql.items()):
+                righe.append(f'{nome}{{metodo="{metodo}",percorso="{percorso}"}} {valore}')
+
+            righe += _esporta_istogrammi(
+                f"{PREFISSO}_sql_durata_secondi",
+                "Tempo SQL totale per richiesta, per rotta.",
+                {f'metodo="{m}",percorso="{p}"': ist for (m, p), ist in self.durate_sql.items()},
+            )
+            righe += _esporta_istogrammi(
+                f"{PREFISSO}_fase_durata_secondi",
+                "Durata delle fasi strumentate (setup_database, jwt, bcrypt, calcoli).",
+                {f'fase="{fase}"': ist for fase, ist in self.fasi.items()},
+            )
+
+        memoria = memoria_processo()
+        if memoria:
+            nome = f"{PREFISSO}_memoria_processo_byte"
+            righe += [
+                f"# HELP {nome} Memoria del processo worker (da /proc/<pid>/smaps_rollup).",
+                f"# TYPE {nome} gauge",
+            ]
+            for tipo, valore in memoria.items():
+                righe.append(f'{nome}{{pid="{os.getpid()}",tipo="{tipo}"}} {valore}')
+        return "\n".join(righe) + "\n"
+
+
+def _esporta_istogrammi(nome: str, descrizione: str, istogrammi: dict[str, Istogramma]) -> list[str]:
+    righe = [f"# HELP {nome} {descrizione}", f"# TYPE {nome} histogram"]
+    for etichette, istogramma in sorted(istogrammi.items()):
+        for limite, valore in zip(BUCKET_SECONDI, istogramma.bucket):
+            righe.append(f'{nome}_bucket{{{etichette},le="{limite}"}} {valore}')
+        righe.append(f'{nome}_bucket{{{etichette},le="+Inf"}} {istogramma.conteggio}')
+        righe.append(f"{nome}_sum{{{etichette}}} {istogramma.somma:.6f}")
+        righe.append(f"{nome}_count{{{etichette}}} {istogramma.conteggio}")
+
+    nome_quantili = f"{nome}_quantili"
+    righe += [
+        f"# HELP {nome_quantili} {descrizione} Quantili sugli ultimi {CAMPIONI_PER_QUANTILI} campioni.",
+        f"# TYPE {nome_quantili} gauge",
+    ]
+    for etichette, istogramma in sorted(istogrammi.items()):
+        for q in QUANTILI:
+            righe.append(f'{nome_quantili}{{{etichette},quantile="{q}"}} {istogramma.quantile(q):.6f}')
+    return righe
+
+
+registro = RegistroMetriche()
+
+# Campi di smaps_rollup (in kB) sommati per ciascuna voce riportata.
+CAMPI_MEMORIA = {
+    "rss": ("Rss",),
+    "pss": ("Pss",),
+    "condivisa": ("Shared_Clean", "Shared_Dirty"),
+    "privata": ("Private_Clean", "Private_Dirty"),
+}
+
+
+def memoria_processo(pid: int | str = "self") -> dict[str, int]:
+    """
+    Ritorna la memoria del processo in byte ({} se /proc non e' disponibile).
+    PSS divide le pagine condivise tra i processi che le usano: se il catalogo
+    caricato prima del fork resta condiviso, la PSS dei worker e' molto sotto la RSS.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as file:
+            campi = {}
+            for riga in file:
+                parti = riga.split()
+                if len(parti) == 3 and parti[2] == "kB":
+                    campi[parti[0].rstrip(":")] = int(parti[1]) * 1024
+    except OSError:
+        return {}
+    return {tipo: sum(campi.get(nome, 0) for nome in nomi) for tipo, nomi in CAMPI_MEMORIA.items()}
+
+
+@contextmanager
+def misura(fase: str) -> Generator[None, None, None]:
+    """Misura la durata di una fase e la associa alla richiesta corrente."""
+    inizio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registra_durata(fase, time.perf_counter() - inizio)
+
+
+def registra_durata(fase: str, durata: float) -> None:
+    """Come ``misura`` per una durata gia' calcolata (es. attesa in coda)."""
+    registro.registra_fase(fase, durata)
+    statistiche = _richiesta_corrente.get()
+    if statistiche is not None:
+        statistiche.fasi[fase] = statistiche.fasi.get(fase, 0.0) + durata
+
+
+def _registra_statement(sql: str, durata: float) -> None:
+    statistiche = _richiesta_corrente.get()
+    if statistiche is not None:
+        statistiche.statement.append((sql, durata))
+
+
+class CursoreTracciato(sqlite3.Cursor):
+    """Cursor che registra testo e durata di ogni statement nella richiesta corrente."""
+
+    def execute(self, sql, parameters=(), /):
+        inizio = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _registra_statement(sql, time.perf_counter() - inizio)
+
+    def executemany(self, sql, seq_of_parameters, /):
+        inizio = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _registra_statement(sql, time.perf_counter() - inizio)
+
+
+class ConnessioneTracciata(sqlite3.Connection):
+    """Connessione da passare come ``factory`` a sqlite3.connect per tracciare gli statement."""
+
+    def cursor(self, factory=CursoreTracciato):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=(), /):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters, /):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+async def middleware_metriche(request: Request, call_next):
+    """Misura la richiesta, raccoglie gli statement SQL e aggiunge l'header Server-Timing."""
+    statistiche = StatisticheRichiesta()
+    token = _richiesta_corrente.set(statistiche)
+    inizio = time.perf_counter()
+    stato = 500
+    try:
+        response = await call_next(request)
+        stato = response.status_code
+    finally:
+        durata = time.perf_counter() - inizio
+        _richiesta_corrente.reset(token)
+        route = request.scope.get("route")
+        percorso = getattr(route, "path", None) or "non_trovato"
+        registro.registra_richiesta(request.method, percorso, stato, durata, statistiche)
+        if SOGLIA_RICHIESTA_LENTA_MS and durata * 1000 >= SOGLIA_RICHIESTA_LENTA_MS:
+            _log_richiesta_lenta(request.method, percorso, stato, durata, statistiche)
+
+    server_timing = [
+        f"app;dur={durata * 1000:.2f}",
+        f'sql;dur={statistiche.durata_sql * 1000:.2f};desc="{len(statistiche.statement)} statement"',
+    ]
+    server_timing += [f"{fase};dur={valore * 1000:.2f}" for fase, valore in statistiche.fasi.items()]
+    response.headers["Server-Timing"] = ", ".join(server_timing)
+    return response
+
+
+def _log_richiesta_lenta(
+    metodo: str,
+    percorso: str,
+    stato: int,
+    durata: float,
+    statistiche: StatisticheRichiesta,
+) -> None:
+    piu_lenti = "\n".join(
+        f"  {durata_sql * 1000:8.2f} ms  {sql}" for sql, durata_sql in statistiche.piu_lenti()
+    )
+    dettagli = "\n".join(
+        f"  {indice:>3}. {durata_sql * 1000:8.2f} ms  {_normalizza_sql(sql)}"
+        for indice, (sql, durata_sql) in enumerate(statistiche.statement, start=1)
+    )
+    logger.warning(
+        "Richiesta lenta %s %s -> %s in %.1f ms (%d statement, %.1f ms SQL, fasi: %s)\n"
+        "Statement piu' lenti:\n%s\nTutti gli statement:\n%s",
+        metodo,
+        percorso,
+        stato,
+        durata * 1000,
+        len(statistiche.statement),
+        statistiche.durata_sql * 1000,
+        ", ".join(f"{fase}={valore * 1000:.1f}ms" for fase, valore in statistiche.fasi.items()),
+        piu_lenti,
+        dettagli,
+    )
@@ -1,7 +1,9 @@
 import csv
+import threading
 from pathlib import Path
 
 LARN_DICT: dict[str, dict[str, float]] = {}
+_lock_caricamento = threading.Lock()
 
 
 def _parse_larn_value(raw_value: str) -> float:
@@ -33,5 +35,16 @@ def load_larn_data() -> None:
                 "F": _parse_larn_value(row[2]),
             }
 
-    LARN_DICT.clear()
+    # Aggiornamento in place senza svuotare: i lettori concorrenti non vedono mai il dizionario vuoto.
     LARN_DICT.update(parsed)
+    for nutriente in set(LARN_DICT) - set(parsed):
+        del LARN_DICT[nutriente]
+
+
+def assicura_larn_caricati() -> None:
+    """Carica i target LARN se non lo sono ancora (avvio rapido: caricamento al primo uso)."""
+    if LARN_DICT:
+        return
+    with _lock_caricamento:
+        if not LARN_DICT:
+            load_larn_data()
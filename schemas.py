@@ -1,4 +1,5 @@
-from typing import List
+from datetime import date
+from typing import List, Optional
 
 from pydantic import BaseModel, field_validator
 
@@ -58,3 +59,79 @@ class DietaCompletaCreate(BaseModel):
 
 class CalcoloMicroRequest(BaseModel):
     alimenti: List[AlimentoMicroRequest]
+
+
+class GruppoMicroRequest(BaseModel):
+    nome: str
+    alimenti: List[AlimentoMicroRequest]
+
+
+class CalcoloMicroBatchRequest(BaseModel):
+    gruppi: List[GruppoMicroRequest]
+
+    @field_validator("gruppi")
+    @classmethod
+    def validate_nomi_univoci(cls, value: List[GruppoMicroRequest]) -> List[GruppoMicroRequest]:
+        nomi = [gruppo.nome for gruppo in value]
+        if len(nomi) != len(set(nomi)):
+            raise ValueError("i nomi dei gruppi devono essere univoci")
+        return value
+
+
+class IngredienteRicettaCreate(BaseModel):
+    codice_alimento: str
+    grammi: float
+
+    @field_validator("grammi")
+    @classmethod
+    def validate_grammi(cls, value: float) -> float:
+        if value <= 0:
+            raise ValueError("grammi deve essere maggiore di 0")
+        return value
+
+
+class RicettaCreate(BaseModel):
+    nome: str
+    ingredienti: List[IngredienteRicettaCreate]
+    # Peso della ricetta finita (es. dopo la cottura); se assente, somma degli ingredienti.
+    grammi_totali: Optional[float] = None
+
+    @field_validator("ingredienti")
+    @classmethod
+    def validate_ingredienti(cls, value: List[IngredienteRicettaCreate]) -> List[IngredienteRicettaCreate]:
+        if not value:
+            raise ValueError("la ricetta deve avere almeno un ingrediente")
+        return value
+
+    @field_validator("grammi_totali")
+    @classmethod
+    def validate_grammi_totali(cls, value: Optional[float]) -> Optional[float]:
+        if value is not None and value <= 0:
+            raise ValueError("grammi_totali deve essere maggiore di 0")
+        return value
+
+
+class VoceDiarioCreate(BaseModel):
+    codice_alimento: str
+    # Il diario e' in sola aggiunta: una quantita' negativa storna una voce registrata per errore.
+    grammi: float
+
+    @field_validator("grammi")
+    @classmethod
+    def validate_grammi(cls, value: float) -> float:
+        if value == 0:
+            raise ValueError("grammi deve essere diverso da 0")
+        return value
+
+
+class DiarioCreate(BaseModel):
+    data: date
+    nome_pasto: Optional[str] = None
+    alimenti: List[VoceDiarioCreate]
+
+    @field_validator("alimenti")
+    @classmethod
+    def validate_alimenti(cls, value: List[VoceDiarioCreate]) -> List[VoceDiarioCreate]:
+        if not value:
+            raise ValueError("indicare almeno un alimento")
+        return value
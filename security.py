@@ -1,23 +1,29 @@
 from datetime import datetime, timedelta, timezone
+from functools import cache
 
 import jwt
-from passlib.context import CryptContext
 
 SECRET_KEY = "dev-secret-key-change-me"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+@cache
+def contesto_password():
+    """Contesto passlib creato al primo uso: l'import di passlib/bcrypt non pesa sull'avvio."""
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 def hash_password(password: str) -> str:
     """Genera l'hash della password con bcrypt."""
-    return pwd_context.hash(password)
+    return contesto_password().hash(password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifica che la password in chiaro corrisponda all'hash salvato."""
-    return pwd_context.verify(plain_password, hashed_password)
+    return contesto_password().verify(plain_password, hashed_password)
 
 
 def crea_access_token(data: dict) -> str:
@@ -0,0 +1,119 @@
+"""
+Serializzazione JSON e compressione delle risposte.
+
+- ``serializza_json`` produce i byte del corpo con orjson se installato (molto piu'
+  veloce su diete complete e risultati dei micronutrienti), altrimenti con il modulo
+  ``json`` nello stesso formato compatto;
+- ``RispostaJSON`` e' la risposta per i dati gia' nella forma finale: restituita
+  direttamente da un endpoint salta validazione e ``jsonable_encoder`` di FastAPI;
+- ``CompressioneMiddleware`` comprime le risposte sopra ``SOGLIA_COMPRESSIONE`` byte
+  con brotli (se installato e accettato dal client) o gzip;
+- ``comprimi``/``etag_codificato`` servono alle risposte con ETag, che si comprimono da
+  sole (il corpo compresso resta in cache) con un ETag forte diverso per ogni codifica.
+
+orjson e brotli sono dipendenze opzionali.
+"""
+import gzip
+import json
+import os
+
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, IdentityResponder
+from starlette.types import Receive, Scope, Send
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    brotli = None
+
+SOGLIA_COMPRESSIONE = int(os.environ.get("COMPRESSIONE_SOGLIA_BYTE", "1024"))
+# Compromesso tra byte risparmiati e CPU per le risposte non in cache.
+LIVELLO_GZIP = int(os.environ.get("COMPRESSIONE_LIVELLO_GZIP", "6"))
+QUALITA_BROTLI = int(os.environ.get("COMPRESSIONE_QUALITA_BROTLI", "5"))
+SUFFISSI_ETAG = {"br": "-br", "gzip": "-gz"}
+
+
+def serializza_json(dati: object) -> bytes:
+    """JSON compatto in UTF-8 (chiavi non stringa convertite come fa ``json``)."""
+    if orjson is not None:
+        return orjson.dumps(dati, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(dati, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class RispostaJSON(JSONResponse):
+    def render(self, content: object) -> bytes:
+        return serializza_json(content)
+
+
+def _codifiche_accettate(accept_encoding: str | None) -> set[str]:
+    accettate = set()
+    for voce in (accept_encoding or "").lower().split(","):
+        codifica, _, parametri = voce.partition(";")
+        if parametri.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accettate.add(codifica.strip())
+    return accettate
+
+
+def codifica_preferita(accept_encoding: str | None) -> str | None:
+    """``br``, ``gzip`` o None (identita') in base all'header Accept-Encoding."""
+    accettate = _codifiche_accettate(accept_encoding)
+    if brotli is not None and "br" in accettate:
+        return "br"
+    if "gzip" in accettate:
+        return "gzip"
+    return None
+
+
+def comprimi(corpo: bytes, codifica: str) -> bytes:
+    if codifica == "br":
+        return brotli.compress(corpo, quality=QUALITA_BROTLI)
+    # mtime=0: stessi byte per lo stesso corpo, come richiede un ETag forte.
+    return gzip.compress(corpo, compresslevel=LIVELLO_GZIP, mtime=0)
+
+
+def etag_codificato(etag: str, codifica: str | None) -> str:
+    """ETag della variante compressa: ``"d1-r3"`` -> ``"d1-r3-gz"``."""
+    if codifica is None:
+        return etag
+    return f'{etag[:-1]}{SUFFISSI_ETAG[codifica]}"'
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._compressore = None
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if self._compressore is None:
+            self._compressore = brotli.Compressor(quality=QUALITA_BROTLI)
+        compresso = self._compressore.process(body)
+        return compresso + (self._compressore.flush() if more_body else self._compressore.finish())
+
+
+class CompressioneMiddleware(GZipMiddleware):
+    """
+    ``GZipMiddleware`` con brotli quando disponibile. Come quello di Starlette lascia
+    invariate le risposte che hanno gia' un Content-Encoding (bundle del catalogo,
+    diete con ETag), anche in streaming (export).
+    """
+
+    def __init__(self, app, minimum_size: int = SOGLIA_COMPRESSIONE, compresslevel: int = LIVELLO_GZIP) -> None:
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and codifica_preferita(Headers(scope=scope).get("accept-encoding")) == "br":
+            responder = BrotliResponder(
+                self.app, self.minimum_size, exclude_content_types=self.exclude_content_types
+            )
+            await responder(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
@@ -0,0 +1,173 @@
+"""
+Entry point di produzione: piu' processi worker uvicorn con pre-fork.
+
+Il processo padre importa l'app, carica target LARN e catalogo in memoria (dallo
+snapshot attivo), congela gli oggetti gia' allocati (``gc.freeze``) e apre il socket;
+poi esegue il fork dei worker, che servono le richieste sullo stesso socket e
+condividono copy-on-write le strutture caricate. Il padre riavvia i worker che
+terminano (con attesa crescente se muoiono subito dopo l'avvio, e si arresta se continuano
+a farlo) e registra periodicamente la memoria di ciascuno (RSS/PSS/condivisa/privata).
+
+Uso:
+    python server.py [--host 0.0.0.0] [--port 8000] [--workers 4] [--intervallo-memoria 60]
+"""
+import argparse
+import bisect
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+from metriche import memoria_processo
+
+logger = logging.getLogger("macro_micro.server")
+
+# Un worker che termina prima di VITA_MINIMA_S non e' riuscito ad avviarsi (configurazione,
+# DB non disponibile...): i riavvii successivi attendono sempre di piu' e dopo
+# FALLIMENTI_MASSIMI fallimenti consecutivi il padre si arresta invece di ciclare sui fork.
+VITA_MINIMA_S = 10.0
+FALLIMENTI_MASSIMI = 5
+ATTESA_MASSIMA_S = 30.0
+
+
+def _precarica():
+    """Importa l'app e carica le strutture in sola lettura condivise dai worker."""
+    import main_api
+    from avvio import riscaldamento
+    from catalogo_memoria import registro_catalogo
+
+    # Target LARN, schema, catalogo e NumPy pronti prima del fork (i worker non lo ripetono).
+    riscaldamento.esegui()
+    catalogo = registro_catalogo.precarica()
+    if catalogo is None:
+        logger.warning(
+            "Nessuno snapshot del catalogo pubblicato: i worker leggeranno il catalogo da SQLite "
+            "(pubblicalo con 'python catalogo_snapshot.py pubblica')"
+        )
+    else:
+        logger.info("Catalogo %s precaricato (%d alimenti)", catalogo.versione, len(catalogo.alimenti))
+    # Gli oggetti sopravvissuti finora non vengono piu' visitati dal GC: le loro pagine
+    # non sono sporcate dai worker e restano condivise.
+    gc.collect()
+    gc.freeze()
+    return main_api.app
+
+
+def _apri_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _avvia_worker(config: uvicorn.Config, sock: socket.socket) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+    # Processo figlio: ripristina i segnali di default e serve finche' uvicorn non termina.
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    codice = 0
+    try:
+        uvicorn.Server(config).run(sockets=[sock])
+    except BaseException:
+        logger.exception("Worker %s terminato con errore", os.getpid())
+        codice = 1
+    finally:
+        os._exit(codice)
+
+
+def _registra_memoria(worker: list[int]) -> None:
+    for pid in worker:
+        memoria = memoria_processo(pid)
+        if memoria:
+            logger.info(
+                "worker %s: rss %.1f MiB, pss %.1f MiB, condivisa %.1f MiB, privata %.1f MiB",
+                pid,
+                *(memoria[tipo] / 2**20 for tipo in ("rss", "pss", "condivisa", "privata")),
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Server di produzione multi-worker (pre-fork)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--intervallo-memoria", type=float, default=60.0,
+        help="Secondi tra due report della memoria dei worker (0 per disattivare)",
+    )
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(message)s")
+    app = _precarica()
+    sock = _apri_socket(args.host, args.port)
+    config = uvicorn.Config(app, log_level=args.log_level, proxy_headers=True)
+
+    # pid -> istante di avvio
+    worker = {_avvia_worker(config, sock): time.monotonic() for _ in range(args.workers)}
+    logger.info("In ascolto su %s:%s con %d worker: %s", args.host, args.port, len(worker), list(worker))
+
+    in_chiusura = False
+    codice_uscita = 0
+    fallimenti = 0
+    # istanti (ordinati) in cui riavviare i worker terminati
+    da_riavviare: list[float] = []
+
+    def termina(signum, _frame) -> None:
+        nonlocal in_chiusura
+        in_chiusura = True
+        for pid in worker:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, termina)
+    signal.signal(signal.SIGTERM, termina)
+
+    prossimo_report = time.monotonic() + 5.0
+    while worker or (da_riavviare and not in_chiusura):
+        try:
+            pid, stato = os.waitpid(-1, os.WNOHANG) if worker else (0, 0)
+        except ChildProcessError:
+            break
+        adesso = time.monotonic()
+        if pid:
+            avviato = worker.pop(pid)
+            if not in_chiusura:
+                fallimenti = fallimenti + 1 if adesso - avviato < VITA_MINIMA_S else 0
+                if fallimenti >= FALLIMENTI_MASSIMI:
+                    logger.error(
+                        "%d worker terminati subito dopo l'avvio (ultimo %s, stato %s): arresto",
+                        fallimenti, pid, stato,
+                    )
+                    codice_uscita = 1
+                    termina(signal.SIGTERM, None)
+                    continue
+                attesa = min(0.5 * 2 ** fallimenti, ATTESA_MASSIMA_S) if fallimenti else 0.0
+                logger.warning("Worker %s terminato (stato %s), riavvio tra %.1fs", pid, stato, attesa)
+                bisect.insort(da_riavviare, adesso + attesa)
+            continue
+        while da_riavviare and da_riavviare[0] <= adesso and not in_chiusura:
+            da_riavviare.pop(0)
+            worker[_avvia_worker(config, sock)] = time.monotonic()
+        if args.intervallo_memoria and adesso >= prossimo_report:
+            _registra_memoria(list(worker))
+            prossimo_report = adesso + args.intervallo_memoria
+        time.sleep(0.5)
+
+    sock.close()
+    sys.exit(codice_uscita)
+
+
+if __name__ == "__main__":
+    main()
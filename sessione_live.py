@@ -0,0 +1,269 @@
+"""
+Sessione di modifica live di una dieta (usata dall'endpoint WebSocket).
+
+Il server tiene in memoria la dieta e i totali nutrizionali di ogni pasto e giorno.
+Il client invia delta piccoli (alimento aggiunto/rimosso, grammi cambiati, pasto
+aggiunto): i totali vengono aggiornati sommando o sottraendo il vettore nutrizionale
+dell'alimento, senza ricalcolare la dieta, e al client tornano solo i totali del pasto
+e del giorno modificati, limitati ai nutrienti cambiati. ``salva`` scrive la dieta
+con ``aggiorna_dieta_completa``.
+
+Messaggi dal client (JSON):
+    {"op": "aggiungi", "pasto_id": 12, "codice_alimento": "000500", "grammi": 80}
+    {"op": "grammi", "voce": 3, "grammi": 120}
+    {"op": "rimuovi", "voce": 3}
+    {"op": "aggiungi_pasto", "giorno_settimana": 2, "nome_pasto": "Cena", "ordine": 4}
+    {"op": "salva"}
+"""
+import sqlite3
+
+from crud_manager import (
+    MACRO_NUTRIENTI,
+    PREFISSI_NON_MICRO,
+    _carica_valori_alimenti,
+    _confronta_con_larn,
+    _normalizza_sesso,
+    _somma_vettori,
+    codici_alimento_sconosciuti,
+)
+from schemas import DietaCompletaCreate
+
+GRAMMI_MASSIMI = 5000
+
+
+def carica_vettori_alimenti(
+    conn: sqlite3.Connection,
+    codici,
+    utente_id: int | None = None,
+) -> dict[str, dict[str, float]]:
+    """
+    Vettori per 100g dei soli codici esistenti: alimenti del catalogo e ricette di
+    ``utente_id`` (gli sconosciuti sono omessi).
+    """
+    codici = set(codici)
+    esistenti = codici - codici_alimento_sconosciuti(conn, codici, utente_id)
+    return _carica_valori_alimenti(conn.cursor(), esistenti)
+
+
+class SessioneDieta:
+    def __init__(self, dieta_id: int, utente_id: int, nome: str, sesso: str | None) -> None:
+        self.dieta_id = dieta_id
+        self.utente_id = utente_id
+        self.nome = nome
+        self.sesso = _normalizza_sesso(sesso)
+        # pasto_id -> {giorno_settimana, nome_pasto, ordine, voci: {voce: [codice, grammi]}}
+        self.pasti: dict[int, dict] = {}
+        self.totali_pasti: dict[int, dict[str, float]] = {}
+        self.totali_giorni: dict[int, dict[str, float]] = {giorno: {} for giorno in range(1, 8)}
+        self.vettori: dict[str, dict[str, float]] = {}
+        self._prossima_voce = 1
+        self._prossimo_pasto_nuovo = -1
+
+    @classmethod
+    def carica(
+        cls,
+        conn: sqlite3.Connection,
+        dieta_id: int,
+        utente_id: int,
+        sesso: str | None,
+    ) -> "SessioneDieta | None":
+        """Carica la dieta (se appartiene all'utente) e calcola i totali iniziali."""
+        dieta = conn.execute(
+            "SELECT id, nome_dieta FROM diete WHERE id = ? AND utente_id = ?", (dieta_id, utente_id)
+        ).fetchone()
+        if not dieta:
+            return None
+        sessione = cls(dieta[0], utente_id, dieta[1], sesso)
+
+        righe = conn.execute(
+            """
+            SELECT p.id, p.giorno_settimana, p.nome_pasto, p.ordine,
+                   dp.codice_alimento, dp.quantita_grammi
+            FROM pasti p
+            LEFT JOIN dettaglio_pasti dp ON dp.pasto_id = p.id
+            WHERE p.dieta_id = ? AND p.giorno_settimana BETWEEN 1 AND 7
+            ORDER BY p.giorno_settimana, p.ordine, p.id, dp.id
+            """,
+            (dieta_id,),
+        ).fetchall()
+        sessione.vettori = carica_vettori_alimenti(conn, (riga[4] for riga in righe if riga[4]), utente_id)
+
+        for pasto_id, giorno, nome_pasto, ordine, codice, grammi in righe:
+            if pasto_id not in sessione.pasti:
+                sessione._nuovo_pasto(pasto_id, giorno, nome_pasto, ordine)
+            if codice:
+                voce = sessione._nuova_voce(pasto_id, codice, int(grammi or 0))
+                sessione._applica_grammi(pasto_id, codice, sessione.pasti[pasto_id]["voci"][voce][1])
+        return sessione
+
+    def _nuovo_pasto(self, pasto_id: int, giorno: int, nome_pasto: str, ordine: int) -> None:
+        self.pasti[pasto_id] = {
+            "giorno_settimana": giorno,
+            "nome_pasto": nome_pasto,
+            "ordine": ordine,
+            "voci": {},
+        }
+        self.totali_pasti[pasto_id] = {}
+
+    def _nuova_voce(self, pasto_id: int, codice: str, grammi: int) -> int:
+        voce = self._prossima_voce
+        self._prossima_voce += 1
+        self.pasti[pasto_id]["voci"][voce] = [codice, grammi]
+        return voce
+
+    def _applica_grammi(self, pasto_id: int, codice: str, delta_grammi: float) -> set[str]:
+        """Somma (o sottrae) al pasto e al giorno il vettore dell'alimento per ``delta_grammi``."""
+        vettore = self.vettori.get(codice, {})
+        fattore = delta_grammi / 100.0
+        _somma_vettori(self.totali_pasti[pasto_id], vettore, fattore)
+        _somma_vettori(self.totali_giorni[self.pasti[pasto_id]["giorno_settimana"]], vettore, fattore)
+        return set(vettore)
+
+    def _voce(self, voce: int, pasto_id: int) -> dict:
+        codice, grammi = self.pasti[pasto_id]["voci"][voce]
+        return {"voce": voce, "pasto_id": pasto_id, "codice_alimento": codice, "grammi": grammi}
+
+    def _trova_voce(self, voce: int) -> int:
+        for pasto_id, pasto in self.pasti.items():
+            if voce in pasto["voci"]:
+                return pasto_id
+        raise ValueError(f"Voce {voce} inesistente")
+
+    @staticmethod
+    def _grammi_validi(valore) -> int:
+        if isinstance(valore, bool) or not isinstance(valore, (int, float)):
+            raise ValueError("grammi deve essere un numero")
+        grammi = int(round(valore))
+        if not 0 < grammi <= GRAMMI_MASSIMI:
+            raise ValueError(f"grammi deve essere compreso tra 1 e {GRAMMI_MASSIMI}")
+        return grammi
+
+    def applica(self, messaggio: dict) -> dict:
+        """
+        Applica un delta e ritorna l'aggiornamento da inviare al client.
+        Per ``aggiungi`` il vettore dell'alimento deve essere gia' in ``self.vettori``
+        (vedi ``codice_da_caricare``). Solleva ValueError per messaggi non validi.
+        """
+        op = messaggio.get("op")
+        if op == "aggiungi":
+            pasto_id = messaggio.get("pasto_id")
+            codice = messaggio.get("codice_alimento")
+            if pasto_id not in self.pasti:
+                raise ValueError(f"Pasto {pasto_id} inesistente")
+            if codice not in self.vettori:
+                raise ValueError(f"Alimento {codice} inesistente")
+            grammi = self._grammi_validi(messaggio.get("grammi"))
+            voce = self._nuova_voce(pasto_id, codice, grammi)
+            cambiati = self._applica_grammi(pasto_id, codice, grammi)
+            risposta = {"voce": self._voce(voce, pasto_id)}
+        elif op == "grammi":
+            voce = messaggio.get("voce")
+            pasto_id = self._trova_voce(voce)
+            grammi = self._grammi_validi(messaggio.get("grammi"))
+            codice, precedenti = self.pasti[pasto_id]["voci"][voce]
+            self.pasti[pasto_id]["voci"][voce][1] = grammi
+            cambiati = self._applica_grammi(pasto_id, codice, grammi - precedenti)
+            risposta = {"voce": self._voce(voce, pasto_id)}
+        elif op == "rimuovi":
+            voce = messaggio.get("voce")
+            pasto_id = self._trova_voce(voce)
+            codice, grammi = self.pasti[pasto_id]["voci"].pop(voce)
+            cambiati = self._applica_grammi(pasto_id, codice, -grammi)
+            if not self.pasti[pasto_id]["voci"]:
+                # Pasto o giorno vuoto: azzera i residui di arrotondamento.
+                self.totali_pasti[pasto_id] = {nutriente: 0.0 for nutriente in self.totali_pasti[pasto_id]}
+                giorno = self.pasti[pasto_id]["giorno_settimana"]
+                if not any(p["voci"] for p in self.pasti.values() if p["giorno_settimana"] == giorno):
+                    self.totali_giorni[giorno] = {nutriente: 0.0 for nutriente in self.totali_giorni[giorno]}
+            risposta = {"rimossa": voce}
+        elif op == "aggiungi_pasto":
+            giorno = messaggio.get("giorno_settimana")
+            if not isinstance(giorno, int) or not 1 <= giorno <= 7:
+                raise ValueError("giorno_settimana deve essere compreso tra 1 e 7")
+            pasto_id = self._prossimo_pasto_nuovo
+            self._prossimo_pasto_nuovo -= 1
+            ordine = messaggio.get("ordine")
+            if not isinstance(ordine, int) or ordine <= 0:
+                ordine = 1 + sum(1 for p in self.pasti.values() if p["giorno_settimana"] == giorno)
+            self._nuovo_pasto(pasto_id, giorno, str(messaggio.get("nome_pasto") or "Pasto"), ordine)
+            return {"tipo": "pasto_aggiunto", "pasto": self._pasto_completo(pasto_id)}
+        else:
+            raise ValueError(f"Operazione sconosciuta: {op}")
+
+        return {
+            "tipo": "aggiornamento",
+            **risposta,
+            "pasto": self._totali(pasto_id, self.totali_pasti[pasto_id], cambiati),
+            "giorno": self._totali(
+                self.pasti[pasto_id]["giorno_settimana"],
+                self.totali_giorni[self.pasti[pasto_id]["giorno_settimana"]],
+                cambiati,
+            ),
+        }
+
+    def codice_da_caricare(self, messaggio: dict) -> str | None:
+        """Codice di cui serve il vettore prima di applicare ``messaggio`` (se non gia' noto)."""
+        codice = messaggio.get("codice_alimento")
+        if messaggio.get("op") == "aggiungi" and isinstance(codice, str) and codice not in self.vettori:
+            return codice
+        return None
+
+    def _totali(self, chiave: int, totali: dict[str, float], nutrienti: set[str] | None = None) -> dict:
+        """Macro completi e micro (con confronto LARN) limitati a ``nutrienti`` se indicati."""
+        macro = {nome: totali.get(nutriente, 0.0) for nutriente, nome in MACRO_NUTRIENTI.items()}
+        micro = {
+            nutriente: valore
+            for nutriente, valore in totali.items()
+            if not nutriente.startswith(PREFISSI_NON_MICRO)
+            and (nutrienti is None or nutriente in nutrienti)
+        }
+        return {"id": chiave, "macro": macro, "micro": _confronta_con_larn(micro, self.sesso)}
+
+    def _pasto_completo(self, pasto_id: int) -> dict:
+        pasto = self.pasti[pasto_id]
+        return {
+            "id": pasto_id,
+            "giorno_settimana": pasto["giorno_settimana"],
+            "nome_pasto": pasto["nome_pasto"],
+            "ordine": pasto["ordine"],
+            "alimenti": [
+                {"voce": voce, "codice_alimento": codice, "grammi": grammi}
+                for voce, (codice, grammi) in pasto["voci"].items()
+            ],
+            "totali": self._totali(pasto_id, self.totali_pasti[pasto_id]),
+        }
+
+    def _pasti_ordinati(self) -> list[int]:
+        def chiave(pasto_id: int) -> tuple:
+            pasto = self.pasti[pasto_id]
+            return (pasto["giorno_settimana"], pasto["ordine"], pasto_id)
+
+        return sorted(self.pasti, key=chiave)
+
+    def stato(self) -> dict:
+        """Stato completo, inviato all'apertura della sessione e dopo il salvataggio."""
+        return {
+            "tipo": "stato",
+            "dieta_id": self.dieta_id,
+            "nome": self.nome,
+            "pasti": [self._pasto_completo(pasto_id) for pasto_id in self._pasti_ordinati()],
+            "giorni": [self._totali(giorno, totali) for giorno, totali in self.totali_giorni.items()],
+        }
+
+    def come_payload(self) -> DietaCompletaCreate:
+        """Dieta corrente nel formato di ``aggiorna_dieta_completa``."""
+        return DietaCompletaCreate(
+            nome=self.nome,
+            pasti=[
+                {
+                    "nome_pasto": self.pasti[pasto_id]["nome_pasto"],
+                    "giorno_settimana": self.pasti[pasto_id]["giorno_settimana"],
+                    "ordine": self.pasti[pasto_id]["ordine"],
+                    "alimenti": [
+                        {"codice_alimento": codice, "grammi": grammi}
+                        for codice, grammi in self.pasti[pasto_id]["voci"].values()
+                    ],
+                }
+                for pasto_id in self._pasti_ordinati()
+            ],
+        )
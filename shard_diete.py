@@ -0,0 +1,423 @@
+"""
+Sharding delle diete per utente.
+
+Le tabelle di proprieta' degli utenti (diete con pasti e dettagli, ricette, diario) possono
+stare in DB shard separati (``diete-<n>.db`` nella cartella ``SHARD_DIETE_DIR``), ognuno
+con il proprio writer: le scritture di utenti su shard diversi non si contendono piu' lo
+stesso lock SQLite. Utenti e catalogo restano nel DB principale; sulle connessioni degli
+shard il catalogo e' collegato in sola lettura (lo snapshot attivo o, in mancanza, il DB
+principale) con gli stessi nomi ``alimenti``/``valori_nutrizionali``.
+
+La colonna ``utenti.shard`` indica dove sono le diete di ciascun utente (NULL = DB
+principale). Con ``SHARD_DIETE=<n>`` i nuovi utenti vengono assegnati a uno degli ``n``
+shard per hash dell'email; gli utenti esistenti si spostano con il comando ``ribilancia``
+(da eseguire con l'API ferma o sugli utenti inattivi: lo spostamento non blocca le
+scritture gia' instradate sul DB di origine).
+Gli id di ogni shard partono da ``(n + 1) * PASSO_ID_SHARD``: restano unici tra tutti i DB
+e non cambiano quando le diete di un utente vengono spostate.
+La pubblicazione di uno snapshot ricalcola solo il DB principale: per gli shard va
+eseguito ``ricalcola``.
+
+Uso:
+    python shard_diete.py stato [--db nutrizione.db] [--dir shard]
+    python shard_diete.py ribilancia [--shard 4] [--utente ID] [--verso N|principale] [--prova]
+    python shard_diete.py ricalcola [--snapshot-dir catalogo_snapshot]
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from catalogo_snapshot import CARTELLA_SNAPSHOT, GestoreSnapshot, collega_catalogo, collega_snapshot
+from coda_scritture import CodaScritture
+from database import COLONNE_TOTALI, DB_PATH, ricalcola_totali_nutrizionali, setup_database, setup_shard
+from metriche import misura
+
+NUMERO_SHARD = int(os.environ.get("SHARD_DIETE", "0"))
+CARTELLA_SHARD = os.environ.get("SHARD_DIETE_DIR", "shard")
+PREFISSO_SHARD = "diete-"
+# Gli id del DB principale restano sotto il primo passo.
+PASSO_ID_SHARD = 1 << 40
+
+COLONNE_DIETE = ("id", "utente_id", "nome_dieta", "data_creazione", *COLONNE_TOTALI, "revisione")
+COLONNE_PASTI = ("id", "dieta_id", "giorno_settimana", "nome_pasto", "ordine", *COLONNE_TOTALI)
+COLONNE_DETTAGLI = ("id", "pasto_id", "codice_alimento", "quantita_grammi")
+COLONNE_RICETTE = ("id", "utente_id", "codice", "nome", "grammi_totali", "data_creazione")
+COLONNE_INGREDIENTI = ("id", "ricetta_id", "codice_alimento", "grammi")
+COLONNE_VALORI_RICETTE = ("codice_ricetta", "nutriente", "valore_100g")
+COLONNE_DIARIO = ("id", "utente_id", "data", "nome_pasto", "codice_alimento", "quantita_grammi", "registrato_il")
+COLONNE_RIEPILOGHI_DIARIO = ("utente_id", "periodo", "inizio", "nutriente", "totale")
+
+
+def shard_per_email(email: str, numero: int = NUMERO_SHARD) -> int | None:
+    """Shard predefinito di un utente (hash stabile dell'email), None se lo sharding e' spento."""
+    if numero <= 0:
+        return None
+    return zlib.crc32(email.strip().lower().encode("utf-8")) % numero
+
+
+def percorso_shard(indice: int, cartella: str = CARTELLA_SHARD) -> Path:
+    return Path(cartella) / f"{PREFISSO_SHARD}{indice:03d}.db"
+
+
+def apri_shard(
+    indice: int,
+    cartella: str = CARTELLA_SHARD,
+    factory: type[sqlite3.Connection] = sqlite3.Connection,
+) -> sqlite3.Connection:
+    """Connessione allo shard ``indice`` (creato se manca), senza catalogo collegato."""
+    percorso = percorso_shard(indice, cartella)
+    percorso.parent.mkdir(parents=True, exist_ok=True)
+    return setup_shard(str(percorso), factory=factory, primo_id=(indice + 1) * PASSO_ID_SHARD)
+
+
+class RouterShard:
+    """
+    Instrada l'accesso alle diete verso il DB che le contiene: ``shard=None`` e' il DB
+    principale, un intero e' lo shard corrispondente. Tiene un writer (``CodaScritture``)
+    per ogni DB, creato al primo uso.
+    """
+
+    def __init__(
+        self,
+        db_name: str = DB_PATH,
+        cartella: str = CARTELLA_SHARD,
+        numero: int = NUMERO_SHARD,
+        factory: type[sqlite3.Connection] = sqlite3.Connection,
+        gestore_snapshot=None,
+    ) -> None:
+        self.db_name = db_name
+        self.cartella = cartella
+        self.numero = numero
+        self.factory = factory
+        self.gestore_snapshot = gestore_snapshot
+        self._lock = threading.Lock()
+        self._code: dict[int | None, CodaScritture] = {}
+
+    def shard_nuovo_utente(self, email: str) -> int | None:
+        return shard_per_email(email, self.numero)
+
+    def _setup(self, indice: int | None):
+        if indice is None:
+            return setup_database
+        return lambda _db_name, factory: apri_shard(indice, self.cartella, factory)
+
+    def coda(self, shard: int | None = None) -> CodaScritture:
+        """Writer del DB che contiene le diete dello ``shard``."""
+        coda = self._code.get(shard)
+        if coda is not None:
+            return coda
+        with self._lock:
+            if shard not in self._code:
+                self._code[shard] = CodaScritture(
+                    self.db_name if shard is None else str(percorso_shard(shard, self.cartella)),
+                    factory=self.factory,
+                    gestore_snapshot=self.gestore_snapshot,
+                    setup=self._setup(shard),
+                    catalogo_principale=self.catalogo_principale(shard),
+                )
+            return self._code[shard]
+
+    def catalogo_principale(self, shard: int | None) -> str | None:
+        """DB da cui leggere il catalogo senza snapshot: per gli shard e' il DB principale."""
+        return None if shard is None else self.db_name
+
+    def apri(self, shard: int | None = None) -> sqlite3.Connection:
+        """Connessione al DB dello ``shard`` (creato se manca), senza catalogo collegato."""
+        if shard is None:
+            return setup_database(self.db_name, factory=self.factory)
+        return apri_shard(shard, self.cartella, self.factory)
+
+    @contextmanager
+    def connessione(self, shard: int | None = None) -> Iterator[sqlite3.Connection]:
+        """
+        Apre una connessione al DB dello ``shard`` con il catalogo collegato in sola
+        lettura (snapshot attivo, o DB principale per gli shard) e la chiude all'uscita.
+        """
+        with self.snapshot_attivo() as snapshot:
+            with misura("setup_database"):
+                conn = self.apri(shard)
+            try:
+                if snapshot:
+                    collega_snapshot(conn, snapshot)
+                elif shard is not None:
+                    collega_catalogo(conn, self.db_name, immutabile=False)
+                yield conn
+            finally:
+                conn.close()
+
+    @contextmanager
+    def snapshot_attivo(self):
+        """Snapshot del catalogo attivo (o None), in uso fino all'uscita."""
+        if self.gestore_snapshot is None:
+            yield None
+        else:
+            with self.gestore_snapshot.acquisisci() as snapshot:
+                yield snapshot
+
+    def shard_esistenti(self) -> list[int]:
+        """Indici degli shard presenti su disco (anche oltre ``numero``, finche' non ribilanciati)."""
+        cartella = Path(self.cartella)
+        if not cartella.is_dir():
+            return []
+        return sorted(
+            int(percorso.stem.removeprefix(PREFISSO_SHARD))
+            for percorso in cartella.glob(f"{PREFISSO_SHARD}[0-9]*.db")
+        )
+
+    def percorsi(self) -> list[str]:
+        """File di tutti i DB che possono contenere diete: principale e shard."""
+        return [self.db_name] + [str(percorso_shard(i, self.cartella)) for i in self.shard_esistenti()]
+
+    def chiudi(self) -> None:
+        with self._lock:
+            code, self._code = list(self._code.values()), {}
+        for coda in code:
+            coda.chiudi()
+
+
+def _copia_righe(
+    origine: sqlite3.Connection,
+    destinazione: sqlite3.Connection,
+    tabella: str,
+    colonne: tuple[str, ...],
+    filtro: str,
+    parametri: tuple,
+) -> int:
+    righe = origine.execute(f"SELECT {', '.join(colonne)} FROM {tabella} WHERE {filtro}", parametri).fetchall()
+    destinazione.executemany(
+        f"INSERT INTO {tabella} ({', '.join(colonne)}) VALUES ({', '.join('?' for _ in colonne)})",
+        righe,
+    )
+    return len(righe)
+
+
+def _elimina_diete_utente(conn: sqlite3.Connection, utente_id: int) -> None:
+    conn.execute(
+        """
+        DELETE FROM dettaglio_pasti
+        WHERE pasto_id IN (
+            SELECT p.id FROM pasti p JOIN diete d ON d.id = p.dieta_id WHERE d.utente_id = ?
+        )
+        """,
+        (utente_id,),
+    )
+    conn.execute(
+        "DELETE FROM pasti WHERE dieta_id IN (SELECT id FROM diete WHERE utente_id = ?)",
+        (utente_id,),
+    )
+    conn.execute("DELETE FROM diete WHERE utente_id = ?", (utente_id,))
+    conn.execute(
+        "DELETE FROM valori_ricette WHERE codice_ricetta IN (SELECT codice FROM ricette WHERE utente_id = ?)",
+        (utente_id,),
+    )
+    conn.execute(
+        "DELETE FROM ingredienti_ricetta WHERE ricetta_id IN (SELECT id FROM ricette WHERE utente_id = ?)",
+        (utente_id,),
+    )
+    conn.execute("DELETE FROM ricette WHERE utente_id = ?", (utente_id,))
+    conn.execute("DELETE FROM diario_alimenti WHERE utente_id = ?", (utente_id,))
+    conn.execute("DELETE FROM riepiloghi_diario WHERE utente_id = ?", (utente_id,))
+
+
+def sposta_utente(
+    conn_utenti: sqlite3.Connection,
+    utente_id: int,
+    origine: sqlite3.Connection,
+    destinazione: sqlite3.Connection,
+    shard_destinazione: int | None,
+) -> int:
+    """
+    Sposta diete, ricette e diario di un utente tra due DB mantenendo gli id, poi aggiorna
+    ``utenti.shard``. Ritorna il numero di diete spostate.
+
+    Ordine delle operazioni: copia (committata) -> cambio di instradamento -> pulizia
+    dell'origine. Un'interruzione lascia al piu' una copia orfana nella destinazione,
+    rimossa al tentativo successivo.
+    """
+    filtro_pasti = "dieta_id IN (SELECT id FROM diete WHERE utente_id = ?)"
+    filtro_dettagli = (
+        "pasto_id IN (SELECT p.id FROM pasti p JOIN diete d ON d.id = p.dieta_id WHERE d.utente_id = ?)"
+    )
+    destinazione.execute("BEGIN IMMEDIATE")
+    try:
+        _elimina_diete_utente(destinazione, utente_id)
+        diete = _copia_righe(origine, destinazione, "diete", COLONNE_DIETE, "utente_id = ?", (utente_id,))
+        _copia_righe(origine, destinazione, "pasti", COLONNE_PASTI, filtro_pasti, (utente_id,))
+        _copia_righe(origine, destinazione, "dettaglio_pasti", COLONNE_DETTAGLI, filtro_dettagli, (utente_id,))
+        _copia_righe(origine, destinazione, "ricette", COLONNE_RICETTE, "utente_id = ?", (utente_id,))
+        _copia_righe(
+            origine,
+            destinazione,
+            "ingredienti_ricetta",
+            COLONNE_INGREDIENTI,
+            "ricetta_id IN (SELECT id FROM ricette WHERE utente_id = ?)",
+            (utente_id,),
+        )
+        _copia_righe(
+            origine,
+            destinazione,
+            "valori_ricette",
+            COLONNE_VALORI_RICETTE,
+            "codice_ricetta IN (SELECT codice FROM ricette WHERE utente_id = ?)",
+            (utente_id,),
+        )
+        _copia_righe(origine, destinazione, "diario_alimenti", COLONNE_DIARIO, "utente_id = ?", (utente_id,))
+        _copia_righe(
+            origine, destinazione, "riepiloghi_diario", COLONNE_RIEPILOGHI_DIARIO, "utente_id = ?", (utente_id,)
+        )
+        destinazione.commit()
+    except Exception:
+        destinazione.rollback()
+        raise
+
+    conn_utenti.execute("UPDATE utenti SET shard = ? WHERE id = ?", (shard_destinazione, utente_id))
+    conn_utenti.commit()
+
+    origine.execute("BEGIN IMMEDIATE")
+    try:
+        _elimina_diete_utente(origine, utente_id)
+        origine.commit()
+    except Exception:
+        origine.rollback()
+        raise
+    return diete
+
+
+def ribilancia(
+    conn_utenti: sqlite3.Connection,
+    cartella: str = CARTELLA_SHARD,
+    numero: int = NUMERO_SHARD,
+    utente_id: int | None = None,
+    verso: int | None | str = "hash",
+    prova: bool = False,
+) -> list[dict]:
+    """
+    Porta ogni utente (o solo ``utente_id``) sullo shard di destinazione: quello per hash
+    dell'email su ``numero`` shard, oppure ``verso`` (indice, o None per il DB principale).
+    Ritorna gli spostamenti effettuati (o solo pianificati con ``prova=True``).
+    """
+    db_name = _percorso_principale(conn_utenti)
+    filtro, parametri = ("WHERE id = ?", (utente_id,)) if utente_id is not None else ("", ())
+    utenti = conn_utenti.execute(f"SELECT id, email, shard FROM utenti {filtro} ORDER BY id", parametri).fetchall()
+
+    connessioni: dict[int | None, sqlite3.Connection] = {}
+
+    def connessione(shard: int | None) -> sqlite3.Connection:
+        if shard not in connessioni:
+            connessioni[shard] = setup_database(db_name) if shard is None else apri_shard(shard, cartella)
+        return connessioni[shard]
+
+    spostamenti = []
+    try:
+        for id_utente, email, attuale in utenti:
+            destinazione = shard_per_email(email or "", numero) if verso == "hash" else verso
+            if destinazione == attuale:
+                continue
+            spostamento = {"utente_id": id_utente, "da": attuale, "a": destinazione, "diete": None}
+            if not prova:
+                spostamento["diete"] = sposta_utente(
+                    conn_utenti, id_utente, connessione(attuale), connessione(destinazione), destinazione
+                )
+            spostamenti.append(spostamento)
+    finally:
+        for conn in connessioni.values():
+            conn.close()
+    return spostamenti
+
+
+def _percorso_principale(conn: sqlite3.Connection) -> str:
+    for _seq, nome, percorso in conn.execute("PRAGMA database_list"):
+        if nome == "main":
+            return percorso
+    raise RuntimeError("Database principale non trovato")
+
+
+def stato_shard(conn_utenti: sqlite3.Connection, cartella: str = CARTELLA_SHARD) -> list[dict]:
+    """Utenti assegnati e diete presenti in ogni DB (principale = shard None)."""
+    router = RouterShard(_percorso_principale(conn_utenti), cartella)
+    assegnati = dict(conn_utenti.execute("SELECT shard, COUNT(*) FROM utenti GROUP BY shard").fetchall())
+    stato = []
+    for shard in [None, *router.shard_esistenti()]:
+        conn = conn_utenti if shard is None else apri_shard(shard, cartella)
+        try:
+            diete = conn.execute("SELECT COUNT(*) FROM diete").fetchone()[0]
+        finally:
+            if shard is not None:
+                conn.close()
+        stato.append({"shard": shard, "utenti": assegnati.get(shard, 0), "diete": diete})
+    return stato
+
+
+def ricalcola_shard(
+    conn_utenti: sqlite3.Connection,
+    cartella: str = CARTELLA_SHARD,
+    cartella_snapshot: str = CARTELLA_SNAPSHOT,
+) -> list[int]:
+    """
+    Ricalcola vettori delle ricette e totali materializzati di ogni shard con il catalogo
+    attivo (snapshot corrente o, in mancanza, il DB principale). Ritorna gli shard elaborati.
+    """
+    db_name = _percorso_principale(conn_utenti)
+    router = RouterShard(db_name, cartella, gestore_snapshot=GestoreSnapshot(cartella_snapshot))
+    elaborati = []
+    for shard in router.shard_esistenti():
+        with router.connessione(shard) as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                ricalcola_totali_nutrizionali(cursor)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        elaborati.append(shard)
+    return elaborati
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Gestione degli shard delle diete")
+    parser.add_argument("comando", choices=["stato", "ribilancia", "ricalcola"])
+    parser.add_argument("--db", default=DB_PATH, help="DB principale (utenti e catalogo)")
+    parser.add_argument("--dir", default=CARTELLA_SHARD, help="Cartella degli shard")
+    parser.add_argument("--shard", type=int, default=NUMERO_SHARD, help="Numero di shard per hash (0 = nessuno)")
+    parser.add_argument("--utente", type=int, help="Ribilancia solo questo utente")
+    parser.add_argument("--verso", help="Shard di destinazione esplicito (indice o 'principale')")
+    parser.add_argument("--prova", action="store_true", help="Mostra gli spostamenti senza eseguirli")
+    parser.add_argument("--snapshot-dir", default=CARTELLA_SNAPSHOT, help="Cartella degli snapshot del catalogo")
+    args = parser.parse_args()
+
+    conn = setup_database(args.db)
+    try:
+        if args.comando == "stato":
+            for voce in stato_shard(conn, args.dir):
+                nome = "principale" if voce["shard"] is None else f"shard {voce['shard']}"
+                print(f"{nome:<12} utenti {voce['utenti']:>8} diete {voce['diete']:>10}")
+            return
+        if args.comando == "ricalcola":
+            elaborati = ricalcola_shard(conn, args.dir, args.snapshot_dir)
+            print(f"Totali ricalcolati su {len(elaborati)} shard")
+            return
+
+        verso: int | None | str = "hash"
+        if args.verso is not None:
+            verso = None if args.verso == "principale" else int(args.verso)
+        spostamenti = ribilancia(conn, args.dir, args.shard, args.utente, verso, args.prova)
+    finally:
+        conn.close()
+
+    for voce in spostamenti:
+        da = "principale" if voce["da"] is None else voce["da"]
+        a = "principale" if voce["a"] is None else voce["a"]
+        diete = "" if voce["diete"] is None else f" ({voce['diete']} diete)"
+        print(f"utente {voce['utente_id']}: {da} -> {a}{diete}")
+    azione = "da spostare" if args.prova else "spostati"
+    print(f"{len(spostamenti)} utenti {azione}")
+
+
+if __name__ == "__main__":
+    main()
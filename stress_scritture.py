@@ -0,0 +1,160 @@
+"""
+Stress test delle scritture concorrenti.
+
+Su un database temporaneo (come ``benchmark.py``) esegue in parallelo:
+- salvataggi di diete complete via API in-process ad alta concorrenza (crea e
+  aggiorna), mescolati a letture delle stesse diete;
+- processi esterni che scrivono direttamente con ``crud_manager`` sullo stesso file,
+  per simulare altri worker/processi batch.
+
+Termina con codice 1 se una qualsiasi scrittura fallisce (es. ``database is locked``).
+
+Uso:
+    python stress_scritture.py [--concorrenza 32] [--richieste 400] [--processi 3]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def _scrittore_esterno(
+    percorso_db: str,
+    utente_id: int,
+    codici: list[str],
+    scritture: int,
+    seme: int,
+    esiti,
+) -> None:
+    """Processo separato che crea e aggiorna diete con connessioni proprie."""
+    from benchmark import genera_payload_dieta
+    from crud_manager import aggiorna_dieta_completa, crea_dieta_completa
+    from database import setup_database
+
+    rng = random.Random(seme)
+    errori: list[str] = []
+    conn = setup_database(percorso_db)
+    try:
+        dieta_id = None
+        for indice in range(scritture):
+            payload = genera_payload_dieta(rng, codici, f"Stress processo {seme}-{indice}")
+            try:
+                if dieta_id is None or indice % 2 == 0:
+                    dieta_id = crea_dieta_completa(conn, utente_id, payload)
+                else:
+                    aggiorna_dieta_completa(conn, dieta_id, utente_id, payload)
+            except sqlite3.Error as exc:
+                errori.append(str(exc))
+    finally:
+        conn.close()
+    esiti.put((seme, scritture, errori))
+
+
+async def _stress_api(percorso_db: str, args: argparse.Namespace) -> list[dict]:
+    import httpx
+
+    import main_api
+    from benchmark import ContestoBenchmark, misura_scenario
+    from genera_dati import DOMINIO_EMAIL
+    from nutritional_targets import load_larn_data
+    from security import crea_access_token
+
+    load_larn_data()
+    conn = sqlite3.connect(percorso_db)
+    try:
+        codici = [row[0] for row in conn.execute("SELECT codice_alimento FROM alimenti")]
+        utenti = []
+        for utente_id, email in conn.execute(
+            "SELECT id, email FROM utenti WHERE email LIKE ? ORDER BY id", (f"%@{DOMINIO_EMAIL}",)
+        ):
+            diete = [
+                row[0] for row in conn.execute("SELECT id FROM diete WHERE utente_id = ?", (utente_id,))
+            ]
+            token = crea_access_token(data={"sub": str(utente_id), "email": email})
+            utenti.append({"id": utente_id, "email": email, "token": token, "diete": diete})
+    finally:
+        conn.close()
+
+    transport = httpx.ASGITransport(app=main_api.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://stress", timeout=None) as client:
+        contesto = ContestoBenchmark(client, utenti, codici, args.seme)
+        risultati = await asyncio.gather(
+            *(
+                misura_scenario(contesto, scenario, args.concorrenza, args.richieste, 0)
+                for scenario in ("crea_dieta", "aggiorna_dieta", "apri_dieta")
+            )
+        )
+    main_api.router_shard.chiudi()
+    return list(risultati)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stress test delle scritture concorrenti")
+    parser.add_argument("--concorrenza", type=int, default=32, help="Worker concorrenti per scenario API")
+    parser.add_argument("--richieste", type=int, default=400, help="Richieste per scenario API")
+    parser.add_argument("--processi", type=int, default=3, help="Processi esterni che scrivono in parallelo")
+    parser.add_argument("--scritture-per-processo", type=int, default=100)
+    parser.add_argument("--utenti", type=int, default=20)
+    parser.add_argument("--catalogo", default="nutrizione.db", help="DB da cui copiare il catalogo")
+    parser.add_argument("--seme", type=int, default=42)
+    args = parser.parse_args()
+
+    sorgente_catalogo = str(Path(args.catalogo).resolve())
+    with tempfile.TemporaryDirectory(prefix="macro-micro-stress-") as cartella:
+        percorso_db = os.path.join(cartella, "stress.db")
+        # Va impostato prima di importare main_api/database.
+        os.environ["NUTRIZIONE_DB"] = percorso_db
+        os.environ["CATALOGO_SNAPSHOT_DIR"] = os.path.join(cartella, "catalogo")
+
+        from benchmark import prepara_database
+
+        print(f"Generazione database di stress ({args.utenti} utenti)...")
+        prepara_database(percorso_db, sorgente_catalogo, args.utenti, 2, args.seme)
+        conn = sqlite3.connect(percorso_db)
+        codici = [row[0] for row in conn.execute("SELECT codice_alimento FROM alimenti")]
+        utente_id = conn.execute("SELECT MIN(id) FROM utenti WHERE ruolo = 'user'").fetchone()[0]
+        conn.close()
+
+        contesto_mp = multiprocessing.get_context("spawn")
+        esiti = contesto_mp.Queue()
+        processi = [
+            contesto_mp.Process(
+                target=_scrittore_esterno,
+                args=(percorso_db, utente_id, codici, args.scritture_per_processo, args.seme + numero, esiti),
+            )
+            for numero in range(1, args.processi + 1)
+        ]
+        inizio = time.perf_counter()
+        for processo in processi:
+            processo.start()
+        risultati_api = asyncio.run(_stress_api(percorso_db, args))
+        esiti_processi = [esiti.get() for _ in processi]
+        for processo in processi:
+            processo.join()
+        durata = time.perf_counter() - inizio
+
+    errori_totali = 0
+    for risultato in risultati_api:
+        errori_totali += risultato["errori"]
+        print(
+            f"API {risultato['scenario']:<15} c={risultato['concorrenza']:<3} "
+            f"{risultato['throughput_rps']:>8.1f} req/s  p99 {risultato['p99_ms']:>8.2f} ms  "
+            f"errori {risultato['errori']}"
+        )
+    for seme, scritture, errori in esiti_processi:
+        errori_totali += len(errori)
+        dettaglio = f" ({errori[0]})" if errori else ""
+        print(f"Processo {seme}: {scritture} scritture, errori {len(errori)}{dettaglio}")
+
+    print(f"Completato in {durata:.1f}s, errori totali: {errori_totali}")
+    sys.exit(1 if errori_totali else 0)
+
+
+if __name__ == "__main__":
+    main()